@@ -5,22 +5,31 @@
 # DESCRIPTION: gaitGM module with functions for KEGG PEA Tools
 #######################################################################################
 
+import os
 import re
 import sys
 import csv
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
 import requests
 import logging
+import heapq
 import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from difflib import SequenceMatcher
+from functools import lru_cache
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import scipy.stats as st
-from rpy2 import robjects as robjects
-from rpy2.robjects.conversion import localconverter
-from rpy2.robjects import pandas2ri
+import scipy.sparse as sparse
 from matplotlib.backends.backend_pdf import PdfPages
-from rpy2.robjects.packages import SignatureTranslatedAnonymousPackage as STAP
 from secimtools.dataManager import logger as sl
 from secimtools.dataManager.interface import wideToDesign
 from secimtools.visualManager.manager_color import colorHandler
@@ -28,6 +37,9 @@ from secimtools.visualManager.manager_figure import figureHandler
 from secimtools.visualManager.module_mmc import expansion, get_clustering
 from importlib import resources as ires
 
+# rpy2 is imported inside the functions that call R, so that importing this module (e.g. for the
+# numpy correlation engine) does not load the R library.
+
 
 def checkForDuplicates(dataset, uniqID):
     """
@@ -59,7 +71,233 @@ def checkForDuplicates(dataset, uniqID):
         sys.exit(1)
 
 
-def downloadGeneParser(species):
+# KEGG REST downloads are kept in an on-disk cache shared by all the KEGG tools. The cache
+# directory can be set with the GAITGM_KEGG_CACHE environment variable or the tools CLI.
+# GAITGM_KEGG_URL points the tools to a KEGG mirror (or a local server for testing).
+KEGG_REST_URL = os.environ.get("GAITGM_KEGG_URL", "http://rest.kegg.jp/")
+KEGG_CACHE_ENV = "GAITGM_KEGG_CACHE"
+KEGG_CACHE_DEFAULT = os.path.join(os.path.expanduser("~"), ".cache", "gaitGM", "kegg")
+# Seconds a cached response is used without asking KEGG again, per endpoint (list, link, ...)
+KEGG_CACHE_TTL = {"list": 7 * 24 * 3600, "link": 7 * 24 * 3600}
+# (connect, read) timeouts in seconds for every KEGG request
+KEGG_TIMEOUT = (30, 300)
+# Failed requests are retried KEGG_RETRIES times, waiting KEGG_BACKOFF * 2^attempt seconds
+KEGG_RETRIES = 3
+KEGG_BACKOFF = 2
+# KEGG asks users not to open many connections at once
+KEGG_MAX_WORKERS = 3
+
+_keggSession = None
+_keggSessionLock = threading.Lock()
+
+
+def getKeggSession():
+    """
+    Return the requests Session shared by all the KEGG downloads, so connections to KEGG are
+    pooled and reused between requests.
+
+    Returns:
+        :return _keggSession: Session for the KEGG REST API
+        :rtype _keggSession: requests.Session
+    """
+
+    global _keggSession
+    with _keggSessionLock:
+        if _keggSession is None:
+            _keggSession = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=KEGG_MAX_WORKERS, pool_maxsize=KEGG_MAX_WORKERS
+            )
+            _keggSession.mount("http://", adapter)
+            _keggSession.mount("https://", adapter)
+    return _keggSession
+
+
+def getKeggCacheDir(cacheDir=None):
+    """
+    Find the KEGG cache directory: given cacheDir, then the GAITGM_KEGG_CACHE environment variable,
+    then ~/.cache/gaitGM/kegg.
+
+    Arguments:
+        :param cacheDir: Cache directory requested by the user, if any.
+        :type cacheDir: string
+
+    Returns:
+        :return cacheDir: Absolute path of the (existing) cache directory.
+        :rtype cacheDir: string
+    """
+
+    if not cacheDir:
+        cacheDir = os.environ.get(KEGG_CACHE_ENV) or KEGG_CACHE_DEFAULT
+    cacheDir = os.path.abspath(os.path.expanduser(cacheDir))
+    os.makedirs(cacheDir, exist_ok=True)
+    return cacheDir
+
+
+def atomicWrite(path, chunks):
+    """
+    Write content to a temporary file next to path and rename it over path, so concurrent jobs
+    never read a partially written file.
+
+    Arguments:
+        :param path: Destination file.
+        :type path: string
+
+        :param chunks: Content to write, as an iterable of bytes chunks.
+        :type chunks: iterable
+    """
+
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            for chunk in chunks:
+                fh.write(chunk)
+        os.replace(tmpPath, path)
+    except BaseException:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+
+def downloadKegg(endpoint, cacheDir=None):
+    """
+    Download a KEGG REST endpoint (e.g. 'list/compound') through the on-disk cache.
+    A cached copy younger than its endpoint TTL is used directly. Older copies are revalidated
+    with KEGG (ETag/Last-Modified) and only downloaded again if they changed. Connection errors,
+    timeouts and server errors are retried with exponential backoff. If KEGG can not be reached,
+    a stale cached copy is used.
+
+    Arguments:
+        :param endpoint: KEGG REST endpoint, without the base URL.
+        :type endpoint: string
+
+        :param cacheDir: Cache directory (see getKeggCacheDir).
+        :type cacheDir: string
+
+    Returns:
+        :return cacheFile: Path to the local copy of the KEGG response.
+        :rtype cacheFile: string
+    """
+
+    logger = logging.getLogger()
+    cacheDir = getKeggCacheDir(cacheDir)
+    cacheFile = os.path.join(cacheDir, re.sub(r"[^A-Za-z0-9_.-]", "_", endpoint))
+    metaFile = cacheFile + ".json"
+
+    meta = {}
+    if os.path.exists(cacheFile) and os.path.exists(metaFile):
+        with open(metaFile, "r") as fh:
+            meta = json.load(fh)
+        ttl = KEGG_CACHE_TTL.get(endpoint.split("/")[0], 0)
+        if time.time() - meta.get("fetched", 0) < ttl:
+            logger.info("Using cached KEGG " + endpoint)
+            return cacheFile
+
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    for attempt in range(KEGG_RETRIES + 1):
+        try:
+            # Stream the body to the cache file, KEGG lists are too big to hold them in memory
+            with getKeggSession().get(
+                KEGG_REST_URL + endpoint, headers=headers, timeout=KEGG_TIMEOUT, stream=True
+            ) as response:
+                response.raise_for_status()
+                if response.status_code == 304:
+                    logger.info("Cached KEGG " + endpoint + " is up to date")
+                else:
+                    atomicWrite(cacheFile, response.iter_content(chunk_size=1 << 16))
+                    logger.info("Downloaded KEGG " + endpoint)
+                    meta = {
+                        "url": KEGG_REST_URL + endpoint,
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                    }
+            break
+        except requests.RequestException as err:
+            # Client errors (bad species, ...) will not be fixed by asking again
+            status = getattr(err.response, "status_code", None)
+            retry = status is None or status >= 500 or status == 429
+            if retry and attempt < KEGG_RETRIES:
+                wait = KEGG_BACKOFF * 2 ** attempt
+                logger.warning(
+                    "KEGG {0} failed ({1}), retrying in {2}s".format(endpoint, err, wait)
+                )
+                time.sleep(wait)
+                continue
+            if not meta:
+                raise
+            logger.warning("KEGG not available ({0}), using cached {1}".format(err, endpoint))
+            return cacheFile
+
+    meta["fetched"] = time.time()
+    atomicWrite(metaFile, [json.dumps(meta).encode("utf-8")])
+
+    return cacheFile
+
+
+def downloadKeggFiles(endpoints, cacheDir=None):
+    """
+    Download several KEGG REST endpoints concurrently (at most KEGG_MAX_WORKERS at a time) with
+    downloadKegg. If an output file is given for an endpoint, the download is copied to it as soon
+    as it finishes.
+
+    Arguments:
+        :param endpoints: List of (endpoint, outputFile) tuples. outputFile can be None.
+        :type endpoints: list
+
+        :param cacheDir: KEGG cache directory (see getKeggCacheDir)
+        :type cacheDir: string
+
+    Returns:
+        :return keggFiles: Dictionary with this structure: {endpoint: cacheFile}
+        :rtype keggFiles: dictionary
+    """
+
+    def download(endpoint, outputFile):
+        keggFile = downloadKegg(endpoint, cacheDir)
+        if outputFile:
+            shutil.copyfile(keggFile, outputFile)
+        return keggFile
+
+    # Create the cache directory before the workers race to do it
+    cacheDir = getKeggCacheDir(cacheDir)
+    with ThreadPoolExecutor(max_workers=KEGG_MAX_WORKERS) as executor:
+        futures = {
+            endpoint: executor.submit(download, endpoint, outputFile)
+            for endpoint, outputFile in endpoints
+        }
+        keggFiles = {endpoint: future.result() for endpoint, future in futures.items()}
+
+    return keggFiles
+
+
+def parseKeggList(keggFile):
+    """
+    Read a KEGG list file (kegg_id "\t" names) into a dictionary. The file is read and decoded
+    line by line, so only the dictionary is kept in memory.
+
+    Arguments:
+        :param keggFile: KEGG list file, as downloaded by downloadKegg.
+        :type keggFile: string
+
+    Returns:
+        :return keggsArray: Dictionary with this structure: {kegg_id: names}
+        :rtype keggsArray: dictionary
+    """
+
+    keggsArray = {}
+    with open(keggFile, "r", encoding="utf-8") as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            keggsArray[fields[0]] = fields[1]
+
+    return keggsArray
+
+
+def downloadGeneParser(species, cacheDir=None):
     """
     Add KEGG Annotation Info (kegg_id, gene_name) from KEGG database.
 
@@ -67,45 +305,46 @@ def downloadGeneParser(species):
         :param species: species identifier in kegg to download
         :type species: string
 
+        :param cacheDir: KEGG cache directory (see getKeggCacheDir)
+        :type cacheDir: string
+
     Returns:
         :return gene2keggsArray: Dictionary with KEGG information about gene name and identifier
         :rtype gene2keggsArray: Dictionary
     """
 
-    gene2keggsArray = {}
-    with requests.get("http://rest.kegg.jp/list/" + species) as genes:
-        gene2keggs = genes.content.splitlines()
-    for line in gene2keggs:
-        line = line.decode('utf-8')
-        geneId = line.split("\t")[0]
-        geneNames = line.split("\t")[1]
-        gene2keggsArray[geneId] = geneNames
-
-    return gene2keggsArray
+    return parseKeggList(downloadKegg("list/" + species, cacheDir))
 
 
-def downloadMetParser():
+def downloadMetParser(cacheDir=None):
     """
     Download metabolite information (kegg_id, cpd_name) from KEGG database.
 
+    Arguments:
+        :param cacheDir: KEGG cache directory (see getKeggCacheDir)
+        :type cacheDir: string
+
     Returns:
         :return met2keggsArray: Dictionary with KEGG information about compound name and identifier
         :rtype met2keggsArray: dictionary
     """
 
-    met2keggsArray = {}
-    with requests.get("http://rest.kegg.jp/list/compound") as metabolites:
-        met2keggs = metabolites.content.splitlines()
-    for line in met2keggs:
-        line = line.decode('utf-8')
-        cpdId = line.split("\t")[0]
-        cpdNames = line.split("\t")[1]
-        met2keggsArray[cpdId] = cpdNames
+    return parseKeggList(downloadKegg("list/compound", cacheDir))
 
-    return met2keggsArray
 
-
-def keggAnno(feature_table, feature2keggs, featureOut, uniqIDNameCol, featureNameCol, featureType):
+def keggAnno(
+    feature_table,
+    feature2keggs,
+    featureOut,
+    uniqIDNameCol,
+    featureNameCol,
+    featureType,
+    difflibCompatible=True,
+    jobs=1,
+    matchCache=None,
+    previous=None,
+    exactFirst=False,
+):
     """
     Takes the Name column of a Dataset and find KEGG-related information.
     It works for Gene Expression and Metabolomic data (depending on featureType parameter).
@@ -132,899 +371,3130 @@ def keggAnno(feature_table, feature2keggs, featureOut, uniqIDNameCol, featureNam
         :param featureType: One of: 'Gene' or 'Metabolite'.
         :type featureType: string
 
+        :param difflibCompatible: Score names with difflib.SequenceMatcher (default) instead of
+        the faster Indel similarity (see calculateSimilarities).
+        :type difflibCompatible: boolean
+
+        :param jobs: Number of processes to annotate the features with.
+        :type jobs: int
+
+        :param matchCache: Match cache (SQLite file) to reuse the matches of names annotated in
+        previous runs against the same KEGG data.
+        :type matchCache: string
+
+        :param previous: Output of a previous run to reuse for the features with the same
+        unique identifier and name (see loadPreviousAnno).
+        :type previous: dictionary
+
+        :param exactFirst: Only search gene names without an exact (case insensitive) KEGG
+        symbol, see matchFeature.
+        :type exactFirst: boolean
+
     Returns:
         :return featureOut: Finished output table
         :rtype featureOut: File
     """
 
-    tmpList_v1 = []
-    tmpList_v2 = []
-    emptyList = ["nan", "", "na"]
-
+    features = []
     for index, featureRow in feature_table.iterrows():
         uniqueID = str(featureRow[uniqIDNameCol]).strip()
         featureName = str(featureRow[featureNameCol]).strip()
         featureName = featureName.replace("\t", "_")
-        if (featureType == "Metabolite") and (featureName not in emptyList):
-            newMetNames = metaboliteModification(featureName)
-        # To not match NaN to KEGG
-        if featureName.lower() in emptyList:
-            tmpList_v1.append(
-                uniqueID +
-                "\t" +
-                featureName +
-                "\t" +
-                featureType +
-                "\tNA\tNA\tNA\tNA\tNA\tNA\n"
+        features.append((uniqueID, featureName))
+
+    # Features annotated in a previous run are not matched again
+    if previous is None:
+        previous = {}
+    reused = 0
+    # Every name is matched only once, its matches are kept until its last feature
+    emptyList = ["nan", "", "na"]
+    nameCounts = {}
+    for uniqueID, featureName in features:
+        if (featureType, uniqueID, featureName) in previous:
+            reused += 1
+        elif featureName.lower() not in emptyList:
+            nameCounts[featureName] = nameCounts.get(featureName, 0) + 1
+    if previous:
+        logger = logging.getLogger()
+        logger.info(
+            "Reusing the previous annotation of {0} of {1} features".format(
+                reused, len(features)
             )
-        else:
-            featureDict_v1 = {}
-            # metabolite dict: {keggMetName1: [similarity1, kegg_cpd1], keggMetName2: [similarity2,
-            # kegg_cpd2], ...}
-            for kegg_id, keggFeatureNames in feature2keggs.items():
-                if featureType == "Gene":
-                    keggGeneNames = keggFeatureNames.split(";")[0].split(",")
-                    for keggGeneName in keggGeneNames:
-                        if re.search(
-                            ".*" + re.escape(str(featureName)) + ".*",
-                            keggGeneName,
-                            re.IGNORECASE,
-                        ):
-                            similarity = calculateSimilarity(
-                                str(featureName).strip(), str(keggGeneName).strip()
-                            )
-                            featureDict_v1[str(keggGeneName).strip()] = [
-                                similarity,
-                                kegg_id,
-                            ]
-                else:
-                    for newMetName in newMetNames:
-                        if re.search(
-                            ".*" + re.escape(newMetName) + ".*",
-                            keggFeatureNames,
-                            re.IGNORECASE,
-                        ):
-                            featureDict_v1 = add2Dictionary(
-                                featureName,
-                                newMetName,
-                                kegg_id,
-                                keggFeatureNames,
-                                featureDict_v1,
-                            )
-            if featureDict_v1:
-                # Solving ties and Sort by similarity
-                sortedMetDict = sorted(featureDict_v1.values(), reverse=True)
-                maximum_v1 = sortedMetDict[0]
-                if len(featureDict_v1) > 1:
-                    maximum_v2 = sortedMetDict[1]
-                    if (maximum_v1[0] == maximum_v2[0]) or (
-                        maximum_v1[0] - maximum_v2[0] <= 0.05 * maximum_v1[0]
-                    ):
-                        # Warning Message
-                        print(
-                            "Warning! There is a tie with",
-                            featureName + ":",
-                            list(featureDict_v1.keys())[
-                                list(featureDict_v1.values()).index(maximum_v1)
-                            ],
-                            "selected,",
-                            list(featureDict_v1.keys())[
-                                list(featureDict_v1.values()).index(maximum_v2)
-                            ],
-                            "rejected.",
-                        )
-                        is_tie = "Yes"
-                    else:
-                        is_tie = "No"
-                else:
-                    is_tie = "No"
-            # UniqueID FeatureName featureType Matched KEGG_Name Kegg_cpd Similarity Tie  elected
-                tmpList_v1.append(
-                    uniqueID +
-                    "\t" +
-                    featureName +
-                    "\t" +
-                    featureType +
-                    "\t" +
-                    "Yes" +
-                    "\t" +
-                    str(
-                        list(featureDict_v1.keys())[
-                            list(featureDict_v1.values()).index(maximum_v1)
-                        ]
-                    ) +
-                    "\t" +
-                    str(maximum_v1[1]) +
-                    "\t" +
-                    str(round(maximum_v1[0], 2)) +
-                    "\t" +
-                    is_tie +
-                    "\tYes\n")
-                featureDict_v2 = dict(featureDict_v1)
-                del featureDict_v2[
-                    list(featureDict_v2.keys())[
-                        list(featureDict_v2.values()).index(maximum_v1)
-                    ]
-                ]
-                for keggName in featureDict_v2:
-                    if is_tie == "Yes":
-                        if (
-                            keggName == list(featureDict_v1.keys())[
-                                list(featureDict_v1.values()).index(maximum_v2)
-                            ]
-                        ):
-                            tmpList_v1.append(
-                                uniqueID +
-                                "\t" +
-                                featureName +
-                                "\t" +
-                                featureType +
-                                "\tYes\t" +
-                                str(keggName.strip()) +
-                                "\t" +
-                                str(featureDict_v2[keggName][1]) +
-                                "\t" +
-                                str(round(featureDict_v2[keggName][0], 2)) +
-                                "\t" +
-                                is_tie +
-                                "\tNo\n"
-                            )
-                        else:
-                            tmpList_v2.append(
-                                uniqueID +
-                                "\t" +
-                                featureName +
-                                "\t" +
-                                featureType +
-                                "\tYes\t" +
-                                str(keggName.strip()) +
-                                "\t" +
-                                str(featureDict_v2[keggName][1]) +
-                                "\t" +
-                                str(round(featureDict_v2[keggName][0], 2)) +
-                                "\tNo\tNo\n"
-                            )
-                    else:
-                        tmpList_v2.append(
-                            uniqueID +
-                            "\t" +
-                            featureName +
-                            "\t" +
-                            featureType +
-                            "\tYes\t" +
-                            str(keggName.strip()) +
-                            "\t" +
-                            str(featureDict_v2[keggName][1]) +
-                            "\t" +
-                            str(round(featureDict_v2[keggName][0], 2)) +
-                            "\t" +
-                            is_tie +
-                            "\tNo\n")
+        )
+    matchStream = iterFeatureMatches(
+        list(nameCounts),
+        feature2keggs,
+        featureType,
+        difflibCompatible,
+        jobs,
+        matchCache,
+        exactFirst,
+    )
+    matches = {}
+    # Number of features matched exactly, by search or not matched
+    tiers = {"exact": 0, "search": 0, "none": 0}
+
+    # Selected matches are written right away, the non-selected ones go to a temporary file
+    with tempfile.TemporaryFile(mode="w+") as rejectedOut:
+        for uniqueID, featureName in features:
+            if (featureType, uniqueID, featureName) in previous:
+                selected, rejected, warnings = previous[(featureType, uniqueID, featureName)]
             else:
-                tmpList_v1.append(
-                    uniqueID +
-                    "\t" +
-                    featureName +
-                    "\t" +
-                    featureType +
-                    "\tNo\tNA\tNA\tNA\tNA\tNA\n"
+                candidates = None
+                if featureName in nameCounts:
+                    if featureName not in matches:
+                        matchName, candidates = next(matchStream)
+                        matches[matchName] = candidates
+                    candidates = matches[featureName]
+                    nameCounts[featureName] -= 1
+                    if not nameCounts[featureName]:
+                        del matches[featureName]
+                    tiers[matchTier(featureName, candidates, featureType, exactFirst)] += 1
+                selected, rejected, warnings = annotateFeature(
+                    uniqueID, featureName, featureType, candidates
+                )
+            for warning in warnings:
+                print(warning)
+            featureOut.writelines(selected)
+            rejectedOut.writelines(rejected)
+        # Close the match cache and the worker processes
+        matchStream.close()
+        if exactFirst and featureType == "Gene":
+            logger = logging.getLogger()
+            logger.info(
+                "Gene names matched exactly: {0}, by search: {1}, not found: {2}".format(
+                    tiers["exact"], tiers["search"], tiers["none"]
                 )
+            )
 
-    # Writing results - first selected metabolites, last non-selected metabolites.
-    for line in tmpList_v1:
-        featureOut.write(line)
-    for line2 in tmpList_v2:
-        featureOut.write(line2)
+        # Writing results - first selected metabolites, last non-selected metabolites.
+        rejectedOut.seek(0)
+        shutil.copyfileobj(rejectedOut, featureOut)
 
     return featureOut
 
 
-def metaboliteModification(metabolite):
+def iterFeatureMatches(
+    featureNames,
+    feature2keggs,
+    featureType,
+    difflibCompatible=True,
+    jobs=1,
+    matchCache=None,
+    exactFirst=False,
+):
     """
-    Modify input metabolite name in order to find its kegg identifier. It will be modified
-    following this pipeline:
-    - Remove common metabolite prefixes (d-, alpha-, ...)
-    - Use long name if aminoacid abreviation provided (cys = cysteine, ...)
-    - Use long name if metabolite abreviation provided (orn = ornithine, ...)
-    - Change -ic acid ending by -ate
-    - Remove common chemical words that can worsen the matching (sulfoxide, ...)
-    - Use long name if lipid abreviation provided (pc = phosphatidylcholine, ...)
-    - If everything fails, use input metabolite name
+    Match feature names to KEGG (see matchFeature) in batches, reusing and filling the match
+    cache, in one or several processes.
 
-   Arguments:
-        :param metabolite: Input metabolite name
-        :type metabolite: string
+    Arguments:
+        :param featureNames: Distinct feature names to match.
+        :type featureNames: list
+
+        :param feature2keggs: Dictionary created with KEGG Information: {KEGG_ID: FeatureName}
+        :type feature2keggs: dictionary
+
+        :param featureType: One of: 'Gene' or 'Metabolite'.
+        :type featureType: string
+
+        :param difflibCompatible: Score names with difflib.SequenceMatcher.
+        :type difflibCompatible: boolean
+
+        :param jobs: Number of processes to match the names with.
+        :type jobs: int
+
+        :param matchCache: Match cache (SQLite file), if any.
+        :type matchCache: string
+
+        :param exactFirst: Only search gene names without an exact KEGG symbol.
+        :type exactFirst: boolean
 
     Returns:
-        :return newMetNames: Modified metabolite names in a list.
-        :rtype newMetNames: list
+        :return matches: (featureName, [KeggMatch, ...]) in the order of featureNames.
+        :rtype matches: generator
     """
 
-    mainPrefixes = [
-        re.compile(r"^n?(-|\s)?[0-9]?(-|\s)?.*yl(-|\s)"),
-        re.compile(r"^(((l|d|dl|ld)|[0-9])(-|\s))?tert(-|\s)?"),
-        re.compile(r"^[0-9]?(-|\s)?hydroxy(-|\s)?"),
-        re.compile(r"^n?(-|\s)?[0-9]?(-|\s)?boc(-|\s)?"),
-        re.compile(r"\(.*\)"),
-        re.compile(r"^n?(-|\s)?[0-9]?(-|\s)?acetyl(-|\s)?"),
-        re.compile(
-            r"^((cis|trans)?(-|\s))?((s|r|\(s\)|\(r\))?(-|\s))?((([0-9]?)(,?))+?(-|\s))?(n(-|\s))?((d|l|dl|ld)(-|\s))?((alpha|beta|a|b)(-|\s))?(([0-9]?)(,?))+?(-|\s)?"
-        ),
-    ]
-    # Add as many chemical words as desired
-    chemWords = [
-        "sulfoxide",
-        "-sulfoxide",
-        "sulfate",
-        "-sulfate",
-        "sulfonate",
-        "-sulfonate",
-    ]
-    # Commonly abbreviated words, like aminoacids
-    aminoacids = {
-        "l-cysteine": ["c", "cys"],
-        "l-aspartate": ["d", "asp"],
-        "l-serine": ["s", "ser"],
-        "l-glutamine": ["q", "gln"],
-        "l-lysine": ["k", "lys"],
-        "l-isoleucine": ["i", "ile"],
-        "l-proline": ["p", "pro"],
-        "l-threonine": ["t", "thr"],
-        "l-phenylalanine": ["f", "phe"],
-        "l-asparagine": ["n", "asn"],
-        "glycine": ["g", "gly"],
-        "l-histidine": ["h", "his"],
-        "l-leucine": ["l", "leu"],
-        "l-arginine": ["r", "arg"],
-        "l-tryptophan": ["w", "trp"],
-        "l-alanine": ["a", "ala"],
-        "l-valine": ["v", "val"],
-        "l-glutamate": ["e", "glu"],
-        "l-tyrosine": ["y", "tyr"],
-        "l-methionine": ["m", "met"],
-    }
-    abbreviations = {
-        "citrate": "cit",
-        "ornithine": "orn",
-        "thyroxine": "thyr",
-        "butoxycarbonyl": "boc",
-    }
-    lipids = {
-        "sphingomyelin": "sm",
-        "lysophosphatidylcholine": "lysopc",
-        "phosphatidylcholine": "pc",
-        "phosphatidylethanolamine": "pe",
-        "lysophosphatidylethanolamine": "lysope",
-    }
-
-    metabolite = metabolite.lower()
-    newMetNames = []
-    newMetNamesNoPrefix = []
-    # If metabolite is an abbreviation of an aminoacid
-    if (
-        (metabolite in dict(tuple(aminoacids.values())).keys()) or
-        (metabolite in dict(tuple(aminoacids.values())).values()) or
-        (metabolite in str(tuple(aminoacids.keys())))
-    ):
-        for aminoacid in aminoacids.keys():
-            if (metabolite in aminoacids[aminoacid]) and (aminoacid not in newMetNames):
-                newMetNames.append(aminoacid)
-            elif (aminoacid.endswith(metabolite)) and (aminoacid not in newMetNames):
-                newMetNames.append(aminoacid)
-    # If metabolite is an abbreviation of another commonly abbreviated metabolites
-    if any(completeName in metabolite for completeName in abbreviations.values()):
-        for completeName in abbreviations.keys():
-            if abbreviations[completeName] in metabolite:
-                newMetNames.append(
-                    re.sub(abbreviations[completeName], completeName, metabolite)
+    keggIndex = None
+    pool = None
+    hits = 0
+    if matchCache:
+        fingerprint = keggFingerprint(feature2keggs)
+        scoring = "difflib" if difflibCompatible else "indel"
+        if exactFirst and featureType == "Gene":
+            scoring = scoring + "-exact"
+        cacheConn = openMatchCache(matchCache)
+    batchSize = MATCH_BATCH_SIZE * max(jobs, 1)
+    try:
+        for start in range(0, len(featureNames), batchSize):
+            batch = featureNames[start:start + batchSize]
+            matches = {}
+            if matchCache:
+                matches = lookupMatchCache(cacheConn, featureType, fingerprint, scoring, batch)
+                hits += len(matches)
+            newNames = [featureName for featureName in batch if featureName not in matches]
+            if newNames:
+                if keggIndex is None:
+                    keggIndex = KeggNameIndex(feature2keggs, featureType)
+                if jobs > 1 and pool is None:
+                    # Forked workers share the KEGG index copy-on-write instead of unpickling it
+                    if "fork" in multiprocessing.get_all_start_methods():
+                        context = multiprocessing.get_context("fork")
+                    else:
+                        context = multiprocessing.get_context()
+                    pool = context.Pool(
+                        jobs,
+                        initializer=initAnnotationWorker,
+                        initargs=(keggIndex, featureType, difflibCompatible, exactFirst),
+                    )
+                if pool is not None and len(newNames) > 1:
+                    # Contiguous chunks, so concatenating their results keeps the input order
+                    nChunks = min(len(newNames), jobs * 4)
+                    chunks = [
+                        newNames[len(newNames) * i // nChunks:len(newNames) * (i + 1) // nChunks]
+                        for i in range(nChunks)
+                    ]
+                    newMatches = [
+                        candidates
+                        for chunk in pool.map(matchFeaturesWorker, chunks)
+                        for candidates in chunk
+                    ]
+                else:
+                    newMatches = [
+                        matchFeature(
+                            featureName, keggIndex, featureType, difflibCompatible, exactFirst
+                        )
+                        for featureName in newNames
+                    ]
+                newMatches = dict(zip(newNames, newMatches))
+                if matchCache:
+                    storeMatchCache(cacheConn, featureType, fingerprint, scoring, newMatches)
+                matches.update(newMatches)
+            for featureName in batch:
+                yield featureName, matches[featureName]
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if matchCache:
+            cacheConn.close()
+            logger = logging.getLogger()
+            logger.info(
+                "KEGG match cache {0}: {1} hits, {2} misses".format(
+                    matchCache, hits, len(featureNames) - hits
                 )
-                newMetNames.append(metabolite)
-    # If metabolite is an acid, use the -ate nomenclature
-    if (
-        ("ic acid" in metabolite) or
-        ("ic_acid" in metabolite) or
-        ("icacid" in metabolite)
-    ) and (re.sub(r"ic.?acid", "ate", metabolite) not in newMetNames):
-        newMetNames.append(re.sub(r"ic.?acid", "ate", metabolite))
-        newMetNames.append(re.sub(r"ic.?acid", "ic acid", metabolite))
-    # If metabolite contains any chemical word, remove it
-    if any(chemWord in metabolite for chemWord in chemWords):
-        for chemWord in chemWords:
-            if (chemWord in metabolite) and (
-                re.sub(chemWord, "", metabolite) not in newMetNames
-            ):
-                newMetNames.append(re.sub(chemWord, "", metabolite))
-                newMetNames.append(metabolite)
-    # Search in pubchem for synonyms - skipped, but retained for the future
-    #    if (pcp.get_synonyms(metabolite, 'name', 'compound')) and (not newMetNames):
-    #        synonymsList = pcp.get_synonyms(metabolite, 'name', 'compound')
-    #        for dictionarySynonyms in synonymsList:
-    #            synonyms = dictionarySynonyms[u'Synonym']
-    #            for synonym in synonyms:
-    #                # similarity > 0.2 to increase the speed
-    #                if (str(synonym) not in newMetNames) and
-    #                   (SequenceMatcher(a=metabolite, b=synonym).ratio() > 0.2):
-    #                    newMetNames.append(str(synonym))
-    # If metabolite is an abbreviation of a lipid
-    if any(lipid in metabolite for lipid in lipids.values()):
-        for lipid in lipids.keys():
-            if (metabolite.startswith(lipids[lipid])) and (lipid not in newMetNames):
-                newMetNames.append(lipid)
-    # If everything fails, take original name
-    if not newMetNames:
-        newMetNames.append(metabolite.strip())
-    # Check for prefixes
-    for newMetName in newMetNames:
-        for mainPrefix in mainPrefixes:
-            if (
-                mainPrefix.search(newMetName) and
-                (re.sub(mainPrefix, "", newMetName) not in newMetNamesNoPrefix) and
-                (newMetName not in aminoacids)
-            ):
-                newMetNameNoPrefix = re.sub(mainPrefix, "", newMetName)
-                newMetNames.insert(len(newMetNames), newMetNameNoPrefix)
-                newMetNamesNoPrefix.append(newMetNameNoPrefix)
-        if newMetName not in newMetNamesNoPrefix:
-            newMetNamesNoPrefix.append(newMetName)
+            )
+
+
+# Number of feature names matched at a time (per process)
+MATCH_BATCH_SIZE = 1000
 
-    return newMetNamesNoPrefix
+# KeggNameIndex and settings of the annotation worker processes
+annotationWorker = {}
 
 
-def add2Dictionary(metabolite, newMetName, kegg_cpd, keggMetNames, metDict):
+def initAnnotationWorker(keggIndex, featureType, difflibCompatible, exactFirst):
+    """
+    Keep the KEGG index in the annotation worker process. With fork it is inherited, not copied.
     """
-    Compare input metabolite name with KEGG name.
 
-    If newMetName (metabolite without prefix) == keggMetName:
-        Calculate similarity between metabolite (oirginal name) and keggMetName
+    annotationWorker["keggIndex"] = keggIndex
+    annotationWorker["featureType"] = featureType
+    annotationWorker["difflibCompatible"] = difflibCompatible
+    annotationWorker["exactFirst"] = exactFirst
 
-    It creates different dictionaries for each metabolite (one per match)
 
-     Arguments:
-        :param metabolite: Input metabolite name
-        :type metabolite: string
+def matchFeaturesWorker(featureNames):
+    """
+    matchFeature for several names in an annotation worker process (see initAnnotationWorker).
+    """
 
-        :param newMetName: Input metabolite name without prefix and chemical words.
-        :type newMetName: string
+    return [
+        matchFeature(
+            featureName,
+            annotationWorker["keggIndex"],
+            annotationWorker["featureType"],
+            annotationWorker["difflibCompatible"],
+            annotationWorker["exactFirst"],
+        )
+        for featureName in featureNames
+    ]
 
-        :param kegg_cpd: Kegg identifier of the metabolite
-        :type kegg_cpd: string
 
-        :param keggMetNames: "List" of Kegg metabolite names associated to a Kegg identifier
-        :type keggMetNames: string
+def matchFeature(featureName, keggIndex, featureType, difflibCompatible=True, exactFirst=False):
+    """
+    Find the KEGG names that match a feature name and their similarity to it. Gene names are
+    searched in every KEGG symbol, unless exactFirst is set and there are KEGG symbols equal to
+    the name (case insensitive): then only those are matched.
+
+    Arguments:
+        :param featureName: Feature (gene/metabolite) name.
+        :type featureName: string
+
+        :param keggIndex: Index of the KEGG names.
+        :type keggIndex: KeggNameIndex
+
+        :param featureType: One of: 'Gene' or 'Metabolite'.
+        :type featureType: string
+
+        :param difflibCompatible: Score names with difflib.SequenceMatcher.
+        :type difflibCompatible: boolean
+
+        :param exactFirst: Only search gene names without an exact KEGG symbol.
+        :type exactFirst: boolean
 
     Returns:
-        :return metDict: Output dictionary with this structure: {Metabolite_Name_in_Kegg:
-        [similarity, Kegg_compound_identifier]
-        :rtype metDict: dictionary
+        :return candidates: Matches, in KEGG order, one per KEGG name.
+        :rtype candidates: list of KeggMatch
     """
 
-    keggMetNames = keggMetNames.split(";")
-    for keggMetName in keggMetNames:
-        if re.search(
-            ".*" + re.escape(newMetName) + ".*", keggMetName.strip(), re.IGNORECASE
+    featureDict_v1 = {}
+    # metabolite dict: {keggMetName1: [similarity1, kegg_cpd1], keggMetName2: [similarity2,
+    # kegg_cpd2], ...}
+    if featureType == "Gene":
+        matches = []
+        if exactFirst:
+            matches = keggIndex.searchExact(featureName)
+        if not matches:
+            matches = keggIndex.search(featureName)
+        matches = [(str(keggGeneName).strip(), kegg_id) for keggGeneName, kegg_id in matches]
+        similarities = calculateSimilarities(
+            str(featureName).strip(),
+            [keggGeneName for keggGeneName, kegg_id in matches],
+            difflibCompatible,
+        )
+        for (keggGeneName, kegg_id), similarity in zip(matches, similarities):
+            featureDict_v1[keggGeneName] = [similarity, kegg_id]
+    else:
+        newMetNames = metaboliteModification(featureName)
+        # Only KEGG compounds with a synonym that may contain a new name are checked
+        for kegg_id, keggFeatureNames, candidateNames in keggIndex.searchEntries(
+            newMetNames
         ):
-            similarity = calculateSimilarity(metabolite.strip(), keggMetName.strip())
-            metDict[keggMetName.strip()] = [similarity, kegg_cpd]
+            for newMetName in candidateNames:
+                if re.search(
+                    ".*" + re.escape(newMetName) + ".*",
+                    keggFeatureNames,
+                    re.IGNORECASE,
+                ):
+                    featureDict_v1 = add2Dictionary(
+                        featureName,
+                        newMetName,
+                        kegg_id,
+                        keggFeatureNames,
+                        featureDict_v1,
+                        difflibCompatible,
+                    )
 
-    return metDict
+    return [
+        KeggMatch(keggName, similarity, kegg_id)
+        for keggName, (similarity, kegg_id) in featureDict_v1.items()
+    ]
 
 
-def calculateSimilarity(featureName, keggName):
+class KeggMatch(object):
     """
-    Compare two feature (gene/metabolite) names and return the similarity between them. If the only
-    difference between the names is one of the mainPrefixes a similarity of 90% is returned.
+    KEGG name matched by a feature name.
 
-     Arguments:
-        :param metabolite: Input metabolite name
-        :type metabolite: string
+    Arguments:
+        :param name: KEGG name.
+        :type name: string
 
-        :param keggName: Name to check the similarity with
-        :type keggName: string
+        :param similarity: Similarity between the feature name and the KEGG name.
+        :type similarity: float
+
+        :param kegg_id: KEGG identifier.
+        :type kegg_id: string
+    """
+
+    __slots__ = ("name", "similarity", "kegg_id")
+
+    def __init__(self, name, similarity, kegg_id):
+        self.name = name
+        self.similarity = similarity
+        self.kegg_id = kegg_id
+
+    def sortKey(self):
+        """
+        Matches are ranked by similarity and then by KEGG identifier.
+        """
+
+        return (self.similarity, self.kegg_id)
+
+
+def matchTier(featureName, candidates, featureType, exactFirst=False):
+    """
+    How a feature name was matched: 'exact' (see matchFeature), 'search' or 'none'.
+
+    Arguments:
+        :param featureName: Feature (gene/metabolite) name.
+        :type featureName: string
+
+        :param candidates: Matches from matchFeature.
+        :type candidates: list of KeggMatch
+
+        :param featureType: One of: 'Gene' or 'Metabolite'.
+        :type featureType: string
+
+        :param exactFirst: Gene names were matched with exactFirst.
+        :type exactFirst: boolean
 
     Returns:
-        :return similarity: Percentage of similarity between 2 input names.
-        :rtype similarity: float
+        :return tier: One of: 'exact', 'search' or 'none'.
+        :rtype tier: string
     """
 
-    mainPrefixes = [
-        "",
-        "cis-",
-        "trans-",
-        "d-",
-        "l-",
-        "(s)-",
-        "alpha-",
-        "beta-",
-        "alpha ",
-        "beta ",
-        "alpha-d-",
-        "beta-d-",
-        "alpha-l-",
-        "beta-l-",
-        "l-beta-",
-        "l-alpha-",
-        "d-beta-",
-        "d-alpha-",
-    ]
+    if not candidates:
+        return "none"
+    # Exact symbols exclude the other matches
+    if exactFirst and featureType == "Gene" and candidates[0].name.lower() == featureName.lower():
+        return "exact"
+    return "search"
+
+
+def annotateFeature(uniqueID, featureName, featureType, candidates):
+    """
+    Select the best KEGG match of a feature and format its output lines (see keggAnno).
+
+    Arguments:
+        :param uniqueID: Unique identifier of the feature.
+        :type uniqueID: string
+
+        :param featureName: Feature (gene/metabolite) name.
+        :type featureName: string
+
+        :param featureType: One of: 'Gene' or 'Metabolite'.
+        :type featureType: string
+
+        :param candidates: Matches from matchFeature.
+        :type candidates: list of KeggMatch
+
+    Returns:
+        :return tmpList_v1: Output lines of the selected match and tie.
+        :rtype tmpList_v1: list
+
+        :return tmpList_v2: Output lines of the non-selected matches.
+        :rtype tmpList_v2: list
+
+        :return warnings: Tie warnings.
+        :rtype warnings: list
+    """
+
+    tmpList_v1 = []
+    tmpList_v2 = []
+    warnings = []
+    emptyList = ["nan", "", "na"]
+
+    feature = [uniqueID, featureName, featureType]
+    # To not match NaN to KEGG
+    if featureName.lower() in emptyList:
+        tmpList_v1.append("\t".join(feature + ["NA", "NA", "NA", "NA", "NA", "NA"]) + "\n")
+    else:
+        if candidates:
+            # Solving ties: the best 2 matches by similarity (and KEGG identifier)
+            best = heapq.nlargest(2, candidates, key=KeggMatch.sortKey)
+            selected = best[0]
+            tie = None
+            is_tie = "No"
+            if len(best) > 1:
+                # The first match like the second best, the selected one if they are equal
+                tie = best[1]
+                if tie.sortKey() == selected.sortKey():
+                    tie = selected
+                if (selected.similarity == tie.similarity) or (
+                    selected.similarity - tie.similarity <= 0.05 * selected.similarity
+                ):
+                    # Warning Message
+                    warnings.append(
+                        "Warning! There is a tie with " +
+                        featureName +
+                        ": " +
+                        selected.name +
+                        " selected, " +
+                        tie.name +
+                        " rejected."
+                    )
+                    is_tie = "Yes"
+        # UniqueID FeatureName featureType Matched KEGG_Name Kegg_cpd Similarity Tie Selected
+            tmpList_v1.append(
+                "\t".join(
+                    feature +
+                    [
+                        "Yes",
+                        str(selected.name),
+                        str(selected.kegg_id),
+                        str(round(selected.similarity, 2)),
+                        is_tie,
+                        "Yes",
+                    ]
+                ) +
+                "\n"
+            )
+            for match in candidates:
+                if match is selected:
+                    continue
+                row = feature + [
+                    "Yes",
+                    str(match.name.strip()),
+                    str(match.kegg_id),
+                    str(round(match.similarity, 2)),
+                ]
+                if is_tie == "Yes":
+                    if match is tie:
+                        tmpList_v1.append("\t".join(row + [is_tie, "No"]) + "\n")
+                    else:
+                        tmpList_v2.append("\t".join(row + ["No", "No"]) + "\n")
+                else:
+                    tmpList_v2.append("\t".join(row + [is_tie, "No"]) + "\n")
+        else:
+            tmpList_v1.append("\t".join(feature + ["No", "NA", "NA", "NA", "NA", "NA"]) + "\n")
+
+    return tmpList_v1, tmpList_v2, warnings
+
+
+def loadPreviousAnno(previousFiles):
+    """
+    Read outputs of previous keggAnno runs, to reuse them for the features that did not change.
+
+    Arguments:
+        :param previousFiles: Paths of previous add_kegg_anno_info outputs.
+        :type previousFiles: list
+
+    Returns:
+        :return previous: Output lines and tie warnings of each feature: {(featureType, uniqueID,
+        featureName): (selectedLines, nonSelectedLines, warnings)}
+        :rtype previous: dictionary
+    """
+
+    previous = {}
+    for previousFile in previousFiles:
+        with open(previousFile, "r") as previousAnno:
+            # UniqueID FeatureName featureType Matched KEGG_Name Kegg_cpd Similarity Tie Selected
+            previousAnno.readline()
+            for line in previousAnno:
+                if not line.endswith("\n"):
+                    line = line + "\n"
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 9:
+                    continue
+                selected, rejected, warnings = previous.setdefault(
+                    (fields[2], fields[0], fields[1]), ([], [], [])
+                )
+                # Non-selected matches are written after all the selected ones and ties
+                if fields[7] == "No" and fields[8] == "No":
+                    rejected.append(line)
+                else:
+                    selected.append(line)
+    # Tie warnings: the selected match and the rejected one in the tie
+    for (featureType, uniqueID, featureName), (selected, rejected, warnings) in previous.items():
+        fields = [line.rstrip("\n").split("\t") for line in selected]
+        selectedNames = [field[4] for field in fields if field[8] == "Yes"]
+        tieNames = [field[4] for field in fields if field[7] == "Yes" and field[8] == "No"]
+        if selectedNames and tieNames:
+            warnings.append(
+                "Warning! There is a tie with " +
+                featureName +
+                ": " +
+                selectedNames[0] +
+                " selected, " +
+                tieNames[0] +
+                " rejected."
+            )
+
+    return previous
+
+
+def keggFingerprint(feature2keggs):
+    """
+    Fingerprint of KEGG names and identifiers, to tell apart KEGG snapshots.
+
+    Arguments:
+        :param feature2keggs: Dictionary created with KEGG Information: {KEGG_ID: FeatureName}
+        :type feature2keggs: dictionary
+
+    Returns:
+        :return fingerprint: SHA-256 hex digest.
+        :rtype fingerprint: string
+    """
+
+    digest = hashlib.sha256()
+    for kegg_id, keggFeatureNames in feature2keggs.items():
+        digest.update((kegg_id + "\t" + keggFeatureNames + "\n").encode("utf-8"))
+    return digest.hexdigest()
+
+
+MATCH_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    feature_type TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    scoring TEXT NOT NULL,
+    name TEXT NOT NULL,
+    candidates TEXT NOT NULL,
+    PRIMARY KEY (feature_type, fingerprint, scoring, name)
+);
+"""
+
+
+def openMatchCache(matchCache):
+    """
+    Open (and create if needed) a match cache.
+
+    Arguments:
+        :param matchCache: Path of the SQLite match cache.
+        :type matchCache: string
+
+    Returns:
+        :return conn: Connection to the match cache.
+        :rtype conn: sqlite3.Connection
+    """
+
+    directory = os.path.dirname(os.path.abspath(matchCache))
+    os.makedirs(directory, exist_ok=True)
+    # Several runs may share a cache, wait for the others to write
+    conn = sqlite3.connect(matchCache, timeout=300)
+    conn.executescript(MATCH_CACHE_SCHEMA)
+    return conn
+
+
+def lookupMatchCache(conn, featureType, fingerprint, scoring, featureNames):
+    """
+    Matches of feature names from previous runs.
+
+    Arguments:
+        :param conn: Connection to the match cache.
+        :type conn: sqlite3.Connection
+
+        :param featureType: One of: 'Gene' or 'Metabolite'.
+        :type featureType: string
+
+        :param fingerprint: Fingerprint of the KEGG data (see keggFingerprint).
+        :type fingerprint: string
+
+        :param scoring: Similarity scoring: 'difflib' or 'indel'.
+        :type scoring: string
+
+        :param featureNames: Feature names to look up.
+        :type featureNames: list
+
+    Returns:
+        :return matches: Cached matches: {featureName: [KeggMatch, ...]}
+        :rtype matches: dictionary
+    """
+
+    matches = {}
+    # SQLite limits the number of query parameters
+    for start in range(0, len(featureNames), 500):
+        names = featureNames[start:start + 500]
+        query = (
+            "SELECT name, candidates FROM matches WHERE feature_type = ? AND fingerprint = ? "
+            "AND scoring = ? AND name IN (" + ",".join("?" * len(names)) + ")"
+        )
+        for name, candidates in conn.execute(
+            query, [featureType, fingerprint, scoring] + names
+        ):
+            matches[name] = [KeggMatch(*candidate) for candidate in json.loads(candidates)]
+    return matches
+
+
+def storeMatchCache(conn, featureType, fingerprint, scoring, matches):
+    """
+    Add matches of feature names to the match cache.
+
+    Arguments:
+        :param conn: Connection to the match cache.
+        :type conn: sqlite3.Connection
+
+        :param featureType: One of: 'Gene' or 'Metabolite'.
+        :type featureType: string
+
+        :param fingerprint: Fingerprint of the KEGG data (see keggFingerprint).
+        :type fingerprint: string
+
+        :param scoring: Similarity scoring: 'difflib' or 'indel'.
+        :type scoring: string
+
+        :param matches: Matches: {featureName: [KeggMatch, ...]}
+        :type matches: dictionary
+    """
+
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    featureType,
+                    fingerprint,
+                    scoring,
+                    name,
+                    json.dumps(
+                        [[match.name, match.similarity, match.kegg_id] for match in candidates]
+                    ),
+                )
+                for name, candidates in matches.items()
+            ),
+        )
+
+
+class KeggNameIndex(object):
+    """
+    Trigram index over the names of the KEGG genes (symbols) or compounds (synonyms). It finds the
+    names that contain a feature name (case insensitive) looking only at the names that share all
+    its trigrams, instead of searching every KEGG entry.
+
+    Arguments:
+        :param feature2keggs: Dictionary created with KEGG Information: {KEGG_ID: FeatureName}
+        :type feature2keggs: dictionary
+
+        :param featureType: One of: 'Gene' or 'Metabolite'.
+        :type featureType: string
+    """
+
+    def __init__(self, feature2keggs, featureType):
+        # (kegg_id, keggFeatureNames) for every KEGG entry, in KEGG order
+        self.entries = []
+        # (keggName, entry position) for every name, in KEGG order
+        self.names = []
+        self.lowerNames = []
+        # Non ASCII names can match differently in re.IGNORECASE, always check them
+        self.unindexed = []
+        self.trigrams = {}
+        # Positions of the names with the same lowercase name, without spaces around
+        self.exactNames = {}
+        for kegg_id, keggFeatureNames in feature2keggs.items():
+            if featureType == "Gene":
+                keggNames = keggFeatureNames.split(";")[0].split(",")
+            else:
+                keggNames = [keggName.strip() for keggName in keggFeatureNames.split(";")]
+            for keggName in keggNames:
+                nameIndex = len(self.names)
+                lowerName = keggName.lower()
+                self.names.append((keggName, len(self.entries)))
+                self.lowerNames.append(lowerName)
+                self.exactNames.setdefault(lowerName.strip(), []).append(nameIndex)
+                if not keggName.isascii():
+                    self.unindexed.append(nameIndex)
+                    continue
+                for trigram in set(lowerName[i:i + 3] for i in range(len(lowerName) - 2)):
+                    self.trigrams.setdefault(trigram, []).append(nameIndex)
+            self.entries.append((kegg_id, keggFeatureNames))
+
+    def candidates(self, featureName):
+        """
+        Find the positions of the KEGG names that may contain featureName. Every name that
+        contains it is returned, but the result must be confirmed by the caller.
+
+        Arguments:
+            :param featureName: Feature name to search.
+            :type featureName: string
+
+        Returns:
+            :return candidates: Sorted positions in self.names.
+            :rtype candidates: list
+        """
+
+        lowerName = featureName.lower()
+        if not featureName.isascii():
+            return range(len(self.names))
+        if len(lowerName) < 3:
+            candidates = set(
+                i for i, lowerKeggName in enumerate(self.lowerNames) if lowerName in lowerKeggName
+            )
+        else:
+            postings = sorted(
+                (self.trigrams.get(lowerName[i:i + 3], []) for i in range(len(lowerName) - 2)),
+                key=len,
+            )
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+
+        return sorted(candidates.union(self.unindexed))
+
+    def search(self, featureName):
+        """
+        Find the KEGG gene symbols that contain featureName.
+
+        Arguments:
+            :param featureName: Gene name to search.
+            :type featureName: string
+
+        Returns:
+            :return matches: (keggGeneName, kegg_id) of the matching symbols, in KEGG order.
+            :rtype matches: list
+        """
+
+        # Candidates are confirmed with the original search
+        pattern = re.compile(".*" + re.escape(str(featureName)) + ".*", re.IGNORECASE)
+        matches = []
+        for i in self.candidates(featureName):
+            keggName, entry = self.names[i]
+            if pattern.search(keggName):
+                matches.append((keggName, self.entries[entry][0]))
+        return matches
+
+    def searchExact(self, featureName):
+        """
+        Find the KEGG gene symbols equal to featureName (case insensitive).
+
+        Arguments:
+            :param featureName: Gene name to search.
+            :type featureName: string
+
+        Returns:
+            :return matches: (keggGeneName, kegg_id) of the equal symbols, in KEGG order.
+            :rtype matches: list
+        """
+
+        return [
+            (self.names[i][0], self.entries[self.names[i][1]][0])
+            for i in self.exactNames.get(str(featureName).strip().lower(), [])
+        ]
+
+    def searchEntries(self, featureNames):
+        """
+        Find the KEGG entries with a name that may contain any of featureNames.
+
+        Arguments:
+            :param featureNames: Feature names to search (e.g. from metaboliteModification).
+            :type featureNames: list
+
+        Returns:
+            :return matches: (kegg_id, keggFeatureNames, featureNames) for every candidate entry,
+            in KEGG order, with the featureNames (in input order) that may be contained in it.
+            :rtype matches: list
+        """
+
+        entryNames = {}
+        for featureName in featureNames:
+            for i in self.candidates(featureName):
+                entryNames.setdefault(self.names[i][1], set()).add(featureName)
+
+        return [
+            self.entries[entry] + ([name for name in featureNames if name in entryNames[entry]],)
+            for entry in sorted(entryNames)
+        ]
+
+
+# Metabolite name normalization (see metaboliteModification)
+# Common metabolite prefixes (d-, alpha-, ...)
+METABOLITE_PREFIXES = [
+    re.compile(r"^n?(-|\s)?[0-9]?(-|\s)?.*yl(-|\s)"),
+    re.compile(r"^(((l|d|dl|ld)|[0-9])(-|\s))?tert(-|\s)?"),
+    re.compile(r"^[0-9]?(-|\s)?hydroxy(-|\s)?"),
+    re.compile(r"^n?(-|\s)?[0-9]?(-|\s)?boc(-|\s)?"),
+    re.compile(r"\(.*\)"),
+    re.compile(r"^n?(-|\s)?[0-9]?(-|\s)?acetyl(-|\s)?"),
+    re.compile(
+        r"^((cis|trans)?(-|\s))?((s|r|\(s\)|\(r\))?(-|\s))?((([0-9]?)(,?))+?(-|\s))?(n(-|\s))?((d|l|dl|ld)(-|\s))?((alpha|beta|a|b)(-|\s))?(([0-9]?)(,?))+?(-|\s)?"
+    ),
+]
+# Add as many chemical words as desired
+METABOLITE_CHEM_WORDS = [
+    "sulfoxide",
+    "-sulfoxide",
+    "sulfate",
+    "-sulfate",
+    "sulfonate",
+    "-sulfonate",
+]
+# Commonly abbreviated words, like aminoacids
+METABOLITE_AMINOACIDS = {
+    "l-cysteine": ["c", "cys"],
+    "l-aspartate": ["d", "asp"],
+    "l-serine": ["s", "ser"],
+    "l-glutamine": ["q", "gln"],
+    "l-lysine": ["k", "lys"],
+    "l-isoleucine": ["i", "ile"],
+    "l-proline": ["p", "pro"],
+    "l-threonine": ["t", "thr"],
+    "l-phenylalanine": ["f", "phe"],
+    "l-asparagine": ["n", "asn"],
+    "glycine": ["g", "gly"],
+    "l-histidine": ["h", "his"],
+    "l-leucine": ["l", "leu"],
+    "l-arginine": ["r", "arg"],
+    "l-tryptophan": ["w", "trp"],
+    "l-alanine": ["a", "ala"],
+    "l-valine": ["v", "val"],
+    "l-glutamate": ["e", "glu"],
+    "l-tyrosine": ["y", "tyr"],
+    "l-methionine": ["m", "met"],
+}
+METABOLITE_ABBREVIATIONS = {
+    "citrate": "cit",
+    "ornithine": "orn",
+    "thyroxine": "thyr",
+    "butoxycarbonyl": "boc",
+}
+METABOLITE_LIPIDS = {
+    "sphingomyelin": "sm",
+    "lysophosphatidylcholine": "lysopc",
+    "phosphatidylcholine": "pc",
+    "phosphatidylethanolamine": "pe",
+    "lysophosphatidylethanolamine": "lysope",
+}
+METABOLITE_ACID = re.compile(r"ic.?acid")
+
+
+class MetaboliteNormalizer(object):
+    """
+    Modify metabolite names in order to find their kegg identifiers (see metaboliteModification).
+    Lookup tables are built once and normalized names are memoized, so names repeated in a
+    panel (e.g. lipid classes) are only modified once.
+
+    Arguments:
+        :param cacheSize: Number of normalized names to remember.
+        :type cacheSize: int
+    """
+
+    def __init__(self, cacheSize=65536):
+        # Aminoacid abbreviations (one and three letters) and the names they may be part of
+        self.aminoacidCodes = set(
+            code for codes in METABOLITE_AMINOACIDS.values() for code in codes
+        )
+        self.aminoacidNames = str(tuple(METABOLITE_AMINOACIDS.keys()))
+        self.abbreviations = [
+            (completeName, re.compile(abbreviation))
+            for completeName, abbreviation in METABOLITE_ABBREVIATIONS.items()
+        ]
+        self.chemWords = [
+            (chemWord, re.compile(chemWord)) for chemWord in METABOLITE_CHEM_WORDS
+        ]
+        self.normalizeCached = lru_cache(maxsize=cacheSize)(self.modify)
+
+    def normalize(self, metabolite):
+        """
+        Modified names of a metabolite, memoized.
+
+        Arguments:
+            :param metabolite: Input metabolite name
+            :type metabolite: string
+
+        Returns:
+            :return newMetNames: Modified metabolite names in a list.
+            :rtype newMetNames: list
+        """
+
+        return list(self.normalizeCached(metabolite.lower()))
+
+    def modify(self, metabolite):
+        """
+        Modified names of a lowercase metabolite name.
+
+        Arguments:
+            :param metabolite: Input metabolite name in lowercase
+            :type metabolite: string
+
+        Returns:
+            :return newMetNames: Modified metabolite names.
+            :rtype newMetNames: tuple
+        """
+
+        newMetNames = []
+        newMetNamesNoPrefix = []
+        # If metabolite is an abbreviation of an aminoacid
+        if (metabolite in self.aminoacidCodes) or (metabolite in self.aminoacidNames):
+            for aminoacid, codes in METABOLITE_AMINOACIDS.items():
+                if (metabolite in codes) and (aminoacid not in newMetNames):
+                    newMetNames.append(aminoacid)
+                elif (aminoacid.endswith(metabolite)) and (aminoacid not in newMetNames):
+                    newMetNames.append(aminoacid)
+        # If metabolite is an abbreviation of another commonly abbreviated metabolites
+        if any(abbreviation.pattern in metabolite for _, abbreviation in self.abbreviations):
+            for completeName, abbreviation in self.abbreviations:
+                if abbreviation.pattern in metabolite:
+                    newMetNames.append(abbreviation.sub(completeName, metabolite))
+                    newMetNames.append(metabolite)
+        # If metabolite is an acid, use the -ate nomenclature
+        if (
+            ("ic acid" in metabolite) or
+            ("ic_acid" in metabolite) or
+            ("icacid" in metabolite)
+        ) and (METABOLITE_ACID.sub("ate", metabolite) not in newMetNames):
+            newMetNames.append(METABOLITE_ACID.sub("ate", metabolite))
+            newMetNames.append(METABOLITE_ACID.sub("ic acid", metabolite))
+        # If metabolite contains any chemical word, remove it
+        for chemWord, chemWordPattern in self.chemWords:
+            if chemWord in metabolite:
+                newMetName = chemWordPattern.sub("", metabolite)
+                if newMetName not in newMetNames:
+                    newMetNames.append(newMetName)
+                    newMetNames.append(metabolite)
+        # Search in pubchem for synonyms - skipped, see metaboliteModification
+        # If metabolite is an abbreviation of a lipid
+        for lipid, abbreviation in METABOLITE_LIPIDS.items():
+            if (metabolite.startswith(abbreviation)) and (lipid not in newMetNames):
+                newMetNames.append(lipid)
+        # If everything fails, take original name
+        if not newMetNames:
+            newMetNames.append(metabolite.strip())
+        # Check for prefixes, names without a prefix are checked too
+        for newMetName in newMetNames:
+            for mainPrefix in METABOLITE_PREFIXES:
+                if mainPrefix.search(newMetName) and (newMetName not in METABOLITE_AMINOACIDS):
+                    newMetNameNoPrefix = mainPrefix.sub("", newMetName)
+                    if newMetNameNoPrefix not in newMetNamesNoPrefix:
+                        newMetNames.append(newMetNameNoPrefix)
+                        newMetNamesNoPrefix.append(newMetNameNoPrefix)
+            if newMetName not in newMetNamesNoPrefix:
+                newMetNamesNoPrefix.append(newMetName)
+
+        return tuple(newMetNamesNoPrefix)
+
+
+METABOLITE_NORMALIZER = MetaboliteNormalizer()
+
+
+def metaboliteModification(metabolite):
+    """
+    Modify input metabolite name in order to find its kegg identifier. It will be modified
+    following this pipeline:
+    - Remove common metabolite prefixes (d-, alpha-, ...)
+    - Use long name if aminoacid abreviation provided (cys = cysteine, ...)
+    - Use long name if metabolite abreviation provided (orn = ornithine, ...)
+    - Change -ic acid ending by -ate
+    - Remove common chemical words that can worsen the matching (sulfoxide, ...)
+    - Use long name if lipid abreviation provided (pc = phosphatidylcholine, ...)
+    - If everything fails, use input metabolite name
+
+   Arguments:
+        :param metabolite: Input metabolite name
+        :type metabolite: string
+
+    Returns:
+        :return newMetNames: Modified metabolite names in a list.
+        :rtype newMetNames: list
+    """
+
+    # Search in pubchem for synonyms - skipped, but retained for the future
+    #    if (pcp.get_synonyms(metabolite, 'name', 'compound')) and (not newMetNames):
+    #        synonymsList = pcp.get_synonyms(metabolite, 'name', 'compound')
+    #        for dictionarySynonyms in synonymsList:
+    #            synonyms = dictionarySynonyms[u'Synonym']
+    #            for synonym in synonyms:
+    #                # similarity > 0.2 to increase the speed
+    #                if (str(synonym) not in newMetNames) and
+    #                   (SequenceMatcher(a=metabolite, b=synonym).ratio() > 0.2):
+    #                    newMetNames.append(str(synonym))
+    return METABOLITE_NORMALIZER.normalize(metabolite)
+
+
+def add2Dictionary(
+    metabolite, newMetName, kegg_cpd, keggMetNames, metDict, difflibCompatible=True
+):
+    """
+    Compare input metabolite name with KEGG name.
+
+    If newMetName (metabolite without prefix) == keggMetName:
+        Calculate similarity between metabolite (oirginal name) and keggMetName
+
+    It creates different dictionaries for each metabolite (one per match)
+
+     Arguments:
+        :param metabolite: Input metabolite name
+        :type metabolite: string
+
+        :param newMetName: Input metabolite name without prefix and chemical words.
+        :type newMetName: string
+
+        :param kegg_cpd: Kegg identifier of the metabolite
+        :type kegg_cpd: string
+
+        :param keggMetNames: "List" of Kegg metabolite names associated to a Kegg identifier
+        :type keggMetNames: string
+
+        :param difflibCompatible: Score names with difflib.SequenceMatcher (default) instead of
+        the faster Indel similarity (see calculateSimilarities).
+        :type difflibCompatible: boolean
+
+    Returns:
+        :return metDict: Output dictionary with this structure: {Metabolite_Name_in_Kegg:
+        [similarity, Kegg_compound_identifier]
+        :rtype metDict: dictionary
+    """
+
+    keggMetNames = [
+        keggMetName.strip()
+        for keggMetName in keggMetNames.split(";")
+        if re.search(".*" + re.escape(newMetName) + ".*", keggMetName.strip(), re.IGNORECASE)
+    ]
+    similarities = calculateSimilarities(metabolite.strip(), keggMetNames, difflibCompatible)
+    for keggMetName, similarity in zip(keggMetNames, similarities):
+        metDict[keggMetName] = [similarity, kegg_cpd]
+
+    return metDict
+
+
+# If the only difference between two names is one of these prefixes they are 90% similar
+SIMILARITY_PREFIXES = frozenset(
+    [
+        "",
+        "cis-",
+        "trans-",
+        "d-",
+        "l-",
+        "(s)-",
+        "alpha-",
+        "beta-",
+        "alpha ",
+        "beta ",
+        "alpha-d-",
+        "beta-d-",
+        "alpha-l-",
+        "beta-l-",
+        "l-beta-",
+        "l-alpha-",
+        "d-beta-",
+        "d-alpha-",
+    ]
+)
+
+
+def calculateSimilarity(featureName, keggName):
+    """
+    Compare two feature (gene/metabolite) names and return the similarity between them. If the only
+    difference between the names is one of the mainPrefixes a similarity of 90% is returned.
+
+     Arguments:
+        :param metabolite: Input metabolite name
+        :type metabolite: string
+
+        :param keggName: Name to check the similarity with
+        :type keggName: string
+
+    Returns:
+        :return similarity: Percentage of similarity between 2 input names.
+        :rtype similarity: float
+    """
+
+    return calculateSimilarities(featureName, [keggName])[0]
+
+
+def calculateSimilarities(featureName, keggNames, difflibCompatible=True):
+    """
+    Compare one feature (gene/metabolite) name with many KEGG names at once, with the same rules
+    as calculateSimilarity. By default the scores are exactly the difflib.SequenceMatcher ratios
+    used by calculateSimilarity. Without difflibCompatible names are scored with the Indel
+    similarity (2 * longest common subsequence / total length), computed with a bit-parallel
+    algorithm that prepares the feature name only once.
+
+     Arguments:
+        :param featureName: Input feature name
+        :type featureName: string
+
+        :param keggNames: Names to check the similarity with
+        :type keggNames: list
+
+        :param difflibCompatible: Reproduce the difflib.SequenceMatcher scores (default).
+        :type difflibCompatible: boolean
+
+    Returns:
+        :return similarities: Percentage of similarity between featureName and each KEGG name.
+        :rtype similarities: list
+    """
+
+    if difflibCompatible:
+        ratio = difflibRatio
+    else:
+        ratio = IndelRatio(featureName).ratio
+        lowerRatio = IndelRatio(featureName.lower()).ratio
+    lowerName = featureName.lower()
+
+    similarities = []
+    for keggName in keggNames:
+        lowerKeggName = keggName.lower()
+        if featureName == keggName:
+            similarity = 1.0
+        elif lowerName == lowerKeggName:
+            similarity = 0.9
+        elif (lowerName in SIMILARITY_PREFIXES) or (lowerKeggName in SIMILARITY_PREFIXES):
+            if difflibCompatible:
+                similarity = difflibRatio(lowerName, lowerKeggName)
+            else:
+                similarity = lowerRatio(lowerKeggName)
+        elif lowerKeggName.replace(lowerName, "") in SIMILARITY_PREFIXES:
+            similarity = 0.9
+        elif lowerName.replace(lowerKeggName, "") in SIMILARITY_PREFIXES:
+            similarity = 0.9
+        elif difflibCompatible:
+            similarity = ratio(featureName, keggName)
+        else:
+            similarity = ratio(keggName)
+        similarities.append(similarity)
+
+    return similarities
+
+
+def difflibRatio(a, b):
+    """
+    difflib.SequenceMatcher(a=a, b=b).ratio(), skipping SequenceMatcher when one name contains the
+    other. Then the whole shorter name is the only matching block and the ratio is
+    2 * len(shorter) / (len(a) + len(b)). This does not hold for b with 200 or more characters,
+    where SequenceMatcher ignores "popular" characters (autojunk).
+
+     Arguments:
+        :params a b: Names to compare
+        :types a b: strings
+
+    Returns:
+        :return ratio: Similarity between a and b.
+        :rtype ratio: float
+    """
+
+    if len(b) < 200 and (a in b or b in a):
+        length = len(a) + len(b)
+        return 2.0 * min(len(a), len(b)) / length if length else 1.0
+    return SequenceMatcher(a=a, b=b).ratio()
+
+
+class IndelRatio(object):
+    """
+    Indel similarity between one name and many others: 2 * LCS / (len(a) + len(b)), where LCS is
+    the longest common subsequence, computed with the bit-parallel algorithm of Hyyrö (2004).
+
+    Arguments:
+        :param name: Name to compare with the others.
+        :type name: string
+    """
+
+    def __init__(self, name):
+        self.length = len(name)
+        self.full = (1 << self.length) - 1
+        # Bit mask of the positions of each character in name
+        self.masks = {}
+        for i, char in enumerate(name):
+            self.masks[char] = self.masks.get(char, 0) | (1 << i)
+
+    def ratio(self, other):
+        """
+        Similarity between the name and other.
+
+        Arguments:
+            :param other: Name to compare with.
+            :type other: string
+
+        Returns:
+            :return ratio: Indel similarity, between 0 and 1.
+            :rtype ratio: float
+        """
+
+        length = self.length + len(other)
+        if not length:
+            return 1.0
+        masks = self.masks
+        full = self.full
+        row = full
+        for char in other:
+            match = row & masks.get(char, 0)
+            row = ((row + match) | (row - match)) & full
+        lcs = self.length - bin(row).count("1")
+        return 2.0 * lcs / length
+
+
+def downloadKeggInfo(args):
+    """
+    Download necessary information from Kegg Database for parsing.
+
+    Arguments:
+        :param geneKeggAnnot: Gene to KEGG ID Link file
+        :type geneKeggAnnot: file
+
+        :param metKeggAnnot: Metabolite to KEGG ID Link file
+        :type metKeggAnnot: file
+
+        :param cacheDir: KEGG cache directory (see getKeggCacheDir)
+        :type cacheDir: string
+
+    Returns:
+        :return gen2kegg: kegg_gene_identifier "\t" Gene_Symbol ";" Gene_name
+        :rtype gen2kegg: file
+
+        :return kgen2pathway: kegg_gene_identifier "\t" pathway_identifier_for_gene
+        :rtype kgen2pathway: file
+
+        :return met2kegg: kegg_metabolite_identifier "\t" Metabolite_names_list_sep_;
+        :rtype met2kegg: file
+
+        :return kmet2pathway: kegg_metabolite_identifier "\t" pathway_identifier_for_metabolite
+        :rtype kmet2pathway:similarity file
+
+        :return pathways: pathway_identifier_for_gene "\t" Pathway_name "-" Specified_organism
+        :rtype pathways: file
+    """
+
+    endpoints = []
+    # GeneKeggID2PathwayID
+    if args.geneKeggAnnot:
+        endpoints.append(("link/" + args.species + "/pathway", args.kgen2pathways))
+    # MetaboliteKeggID2PathwayID
+    if args.metKeggAnnot:
+        endpoints.append(("link/compound/pathway", args.kmet2pathways))
+    # PathwayID2PathwayNames
+    if args.pathways:
+        endpoints.append(("list/pathway/" + args.species, args.pathways))
+
+    downloadKeggFiles(endpoints, args.cacheDir)
+
+
+###########
+# KEGG DB #
+###########
+
+# Version of the KEGG SQLite database layout, bump it when the schema changes.
+KEGG_DB_VERSION = 2
+
+KEGG_DB_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE entries (kegg_id TEXT NOT NULL, feature_type TEXT NOT NULL, names TEXT NOT NULL);
+CREATE TABLE links (pathway_id TEXT NOT NULL, kegg_id TEXT NOT NULL, feature_type TEXT NOT NULL);
+CREATE TABLE pathways (pathway_id TEXT NOT NULL, name TEXT NOT NULL);
+CREATE INDEX entries_kegg_id ON entries (kegg_id);
+CREATE INDEX entries_feature_type ON entries (feature_type);
+CREATE INDEX links_kegg_id ON links (kegg_id COLLATE NOCASE);
+CREATE INDEX links_pathway_id ON links (pathway_id COLLATE NOCASE);
+CREATE INDEX pathways_pathway_id ON pathways (pathway_id COLLATE NOCASE);
+"""
+
+
+def parseKeggLink(keggFile):
+    """
+    Read a two column KEGG file (link or pathway list) into a list of pairs, in file order.
+
+    Arguments:
+        :param keggFile: KEGG file, as downloaded by downloadKegg.
+        :type keggFile: string
+
+    Returns:
+        :return pairs: List of (first_column, second_column) tuples.
+        :rtype pairs: list
+    """
+
+    pairs = []
+    with open(keggFile, "r", encoding="utf-8") as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 1:
+                pairs.append((fields[0].strip(), fields[1].strip()))
+
+    return pairs
+
+
+def buildKeggDb(keggDb, species, cacheDir=None):
+    """
+    Build a versioned SQLite snapshot of the KEGG information used by the gaitGM tools:
+    gene and compound lists, gene/compound to pathway links and pathway names for a species. The
+    database is written to a temporary file and renamed when complete.
+
+    Arguments:
+        :param keggDb: Output SQLite file.
+        :type keggDb: string
+
+        :param species: species identifier in kegg to download
+        :type species: string
+
+        :param cacheDir: KEGG cache directory (see getKeggCacheDir)
+        :type cacheDir: string
+    """
+
+    endpoints = [
+        ("Gene", "list/" + species),
+        ("Metabolite", "list/compound"),
+        ("Gene", "link/" + species + "/pathway"),
+        ("Metabolite", "link/compound/pathway"),
+        ("Pathway", "list/pathway/" + species),
+    ]
+    downloads = downloadKeggFiles([(endpoint, None) for _, endpoint in endpoints], cacheDir)
+    keggFiles = [
+        (featureType, endpoint, downloads[endpoint]) for featureType, endpoint in endpoints
+    ]
+    fingerprint = hashlib.sha256()
+    for featureType, endpoint, keggFile in keggFiles:
+        fingerprint.update(endpoint.encode("utf-8"))
+        with open(keggFile, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                fingerprint.update(chunk)
+
+    keggDb = os.path.abspath(keggDb)
+    fd, tmpDb = tempfile.mkstemp(dir=os.path.dirname(keggDb), prefix=".tmp_", suffix=".db")
+    os.close(fd)
+    conn = sqlite3.connect(tmpDb)
+    try:
+        conn.executescript(KEGG_DB_SCHEMA)
+        for featureType, endpoint, keggFile in keggFiles:
+            if endpoint.startswith("list/") and featureType != "Pathway":
+                conn.executemany(
+                    "INSERT INTO entries VALUES (?, ?, ?)",
+                    [
+                        (keggId, featureType, keggNames)
+                        for keggId, keggNames in parseKeggList(keggFile).items()
+                    ],
+                )
+            elif featureType == "Pathway":
+                conn.executemany("INSERT INTO pathways VALUES (?, ?)", parseKeggLink(keggFile))
+            else:
+                conn.executemany(
+                    "INSERT INTO links VALUES (?, ?, ?)",
+                    [
+                        (pathId, keggId, featureType)
+                        for pathId, keggId in parseKeggLink(keggFile)
+                    ],
+                )
+        conn.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [
+                ("version", str(KEGG_DB_VERSION)),
+                ("species", species),
+                ("created", time.strftime("%Y-%m-%dT%H:%M:%S")),
+                ("fingerprint", fingerprint.hexdigest()),
+            ],
+        )
+        conn.commit()
+        conn.close()
+        os.replace(tmpDb, keggDb)
+    except BaseException:
+        conn.close()
+        os.remove(tmpDb)
+        raise
+
+
+def openKeggDb(keggDb, species=None):
+    """
+    Open (read only) a KEGG SQLite database created by buildKeggDb. If the file is not a
+    compatible KEGG database, or was built for another species, terminate the program and provide
+    information to stderr.
+
+    Arguments:
+        :param keggDb: SQLite file created by buildKeggDb.
+        :type keggDb: string
+
+        :param species: species identifier in kegg expected in the database (optional)
+        :type species: string
+
+    Returns:
+        :return conn: Connection to the KEGG database.
+        :rtype conn: sqlite3.Connection
+    """
+
+    if not os.path.exists(keggDb):
+        sys.stderr.write("KEGG database " + keggDb + " does not exist.\n")
+        sys.exit(1)
+    conn = sqlite3.connect("file:" + os.path.abspath(keggDb) + "?mode=ro", uri=True)
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+    except sqlite3.DatabaseError:
+        meta = {}
+    if not meta or meta.get("species") is None:
+        conn.close()
+        sys.stderr.write(
+            keggDb + " is not a KEGG database, please build it with build_kegg_db.py.\n"
+        )
+        sys.exit(1)
+    if meta.get("version") != str(KEGG_DB_VERSION):
+        conn.close()
+        sys.stderr.write(
+            keggDb + " is not a KEGG database version " + str(KEGG_DB_VERSION) +
+            ", please build it again.\n"
+        )
+        sys.exit(1)
+    if species and meta.get("species") != species:
+        conn.close()
+        sys.stderr.write(
+            "KEGG database " + keggDb + " was built for species " + meta.get("species") +
+            ", not " + species + ".\n"
+        )
+        sys.exit(1)
+
+    return conn
+
+
+def loadKeggDbList(conn, featureType):
+    """
+    Load the KEGG gene or compound list from a KEGG database, in the same format (and order) as
+    downloadGeneParser and downloadMetParser.
+
+    Arguments:
+        :param conn: Connection to the KEGG database.
+        :type conn: sqlite3.Connection
+
+        :param featureType: One of 'Gene' or 'Metabolite'.
+        :type featureType: string
+
+    Returns:
+        :return keggsArray: Dictionary with this structure: {kegg_id: names}
+        :rtype keggsArray: dictionary
+    """
+
+    return dict(
+        conn.execute(
+            "SELECT kegg_id, names FROM entries WHERE feature_type = ? ORDER BY rowid",
+            (featureType,),
+        )
+    )
+
+
+def exportKeggDbInfo(args, conn):
+    """
+    Write the KEGG link and pathway files (as downloadKeggInfo does) from a KEGG database.
+
+    Arguments:
+        :param conn: Connection to the KEGG database.
+        :type conn: sqlite3.Connection
+
+    Returns:
+        :return kgen2pathway: pathway_identifier "\t" kegg_gene_identifier
+        :rtype kgen2pathway: file
+
+        :return kmet2pathway: pathway_identifier "\t" kegg_metabolite_identifier
+        :rtype kmet2pathway: file
+
+        :return pathways: pathway_identifier_for_gene "\t" Pathway_name "-" Specified_organism
+        :rtype pathways: file
+    """
+
+    exports = []
+    if args.geneKeggAnnot:
+        exports.append(
+            (
+                args.kgen2pathways,
+                "SELECT pathway_id, kegg_id FROM links WHERE feature_type = 'Gene' ORDER BY rowid",
+            )
+        )
+    if args.metKeggAnnot:
+        exports.append(
+            (
+                args.kmet2pathways,
+                "SELECT pathway_id, kegg_id FROM links WHERE feature_type = 'Metabolite' "
+                "ORDER BY rowid",
+            )
+        )
+    if args.pathways:
+        exports.append((args.pathways, "SELECT pathway_id, name FROM pathways ORDER BY rowid"))
+
+    for outputFile, query in exports:
+        with open(outputFile, "w") as fh:
+            for first, second in conn.execute(query):
+                fh.write(first + "\t" + second + "\n")
+
+
+def keggAnnot2list(keggAnnotFile, UniqueID, featureName, featureKeggId, featureType):
+    """
+    Read the features and their KEGG IDs for the next function to find KEGG pathway information.
+    Use when the input dataset has been parsed with metabolite_parser tool.
+
+    Only the unique ID, feature name, KEGG ID and Selected columns are read, in a single pass and
+    as strings. If a feature is listed twice, its first position and its last KEGG ID are kept.
+
+    Arguments:
+        :param keggAnnotFile: Output file from Add KEGG Annotation Info Tool
+        :type keggAnnotFile: file
+
+        :param UniqueID: Name of the column with the unique identifiers.
+        :type UniqueID: string
+
+        :param featureName: Name of the column with feature names.
+        :type featureName: string
+
+        :param featureKeggId: Name of the column with KEGG Identifiers.
+        :type featureKeggId: string
+
+        :param featureType: One of 'Gene' or 'Metabolite'
+        :type featureType: string
+
+    Returns:
+        :return features: Table with the uniqueID, featureName and kegg_id of the features with a
+        kegg_id, in the columns UniqueID, Feature_Name and KEGG_ID
+        :rtype features: pandas.DataFrame
+
+        :return featureList: List with the information of the features without kegg_id
+        :return featureList: list
+    """
+
+    with open(keggAnnotFile, "r") as keggAnnot:
+        header = keggAnnot.readline().strip().split("\t")
+    columns = [UniqueID, featureName, featureKeggId]
+    hasSelected = "Selected" in header
+    if hasSelected:
+        columns.append("Selected")
+
+    # Raw strings: no quoting, type inference or NA conversion
+    table = pd.read_csv(
+        keggAnnotFile,
+        sep="\t",
+        header=0,
+        usecols=list(dict.fromkeys(columns)),
+        dtype=str,
+        quoting=csv.QUOTE_NONE,
+        keep_default_na=False,
+        na_filter=False,
+        index_col=False,
+        engine="c",
+    )
+    features = pd.DataFrame(
+        {
+            "UniqueID": table[columns[0]].to_numpy(dtype=object),
+            "Feature_Name": table[columns[1]].to_numpy(dtype=object),
+            "KEGG_ID": table[columns[2]].to_numpy(dtype=object),
+        },
+        dtype=object,
+    )
+    if hasSelected:
+        selected = table["Selected"].to_numpy(dtype=object)
+        # Only values with surrounding whitespace need to be stripped
+        padded = ~np.isin(selected, ("Yes", "No", "NA"))
+        if padded.any():
+            selected[padded] = [value.strip() for value in selected[padded]]
+        withKeggId = selected == "Yes"
+        # For those that does not have kegg_id
+        withoutKeggId = selected == "NA"
+    else:
+        withKeggId = features["KEGG_ID"].to_numpy() != ""
+        withoutKeggId = ~withKeggId
+
+    featureList = [
+        uniqueID + "\t" + name + "\t" + featureType + "\tNA\tNA\tNA\n"
+        for uniqueID, name in zip(
+            features["UniqueID"].to_numpy()[withoutKeggId],
+            features["Feature_Name"].to_numpy()[withoutKeggId],
+        )
+    ]
+
+    features = features.loc[withKeggId]
+    if features.duplicated(["UniqueID", "Feature_Name"]).any():
+        features = (
+            features.groupby(["UniqueID", "Feature_Name"], sort=False)["KEGG_ID"]
+            .last()
+            .reset_index()
+        )
+    features = features.reset_index(drop=True)
+
+    return (features, featureList)
+
+
+def add_path_info(
+    features,
+    featureList,
+    featureType,
+    keggId2pathway,
+    pathId2pathName,
+    species,
+    outputFile,
+    keggDb=None,
+    sortBuffer=None,
+):
+    """
+    Find all pathways in KEGG related to a gene or a metabolite.
+
+    Arguments:
+        :param features: Features with a kegg_id (see keggAnnot2list)
+        :type features: pandas.DataFrame
+
+        :param featureList: List with the information of the features without kegg_id
+        :type featureList: list
+
+        :param featureType: Type of the feature. One of 'Gene' or 'Metabolite'
+        :type featureType: string
+
+        :param keggId2pathway: Downloaded information from KEGG with the gene/metabolite KEGG Id
+        and the Pathway ID
+        :type keggId2pathway: file
+
+        :param pathId2pathName: Downloaded information from KEGG with the Pathway ID and the
+        Pathway Names
+        :type pathId2pathName: file
+
+        :param species: species identifier in kegg
+        :type species: string
+
+        :param outputFile: Output File Name to write the results.
+        :type outputFile: string
+
+        :param keggDb: Connection to a KEGG database (see openKeggDb). If provided, it is used
+        instead of the keggId2pathway and pathId2pathName files.
+        :type keggDb: sqlite3.Connection
+
+        :param sortBuffer: Number of output lines sorted in memory at a time (default:
+        PATH_SORT_BUFFER), see sortLines.
+        :type sortBuffer: int
+    """
+
+    # KEGG ID -> pathway IDs and pathway ID -> pathway name, read only once
+    if keggDb is not None:
+        keggId2pathway = KeggWordIndex(
+            keggDb.execute(
+                "SELECT kegg_id, pathway_id FROM links WHERE feature_type = ? ORDER BY rowid",
+                (featureType,),
+            ),
+            species,
+        )
+        pathId2pathName = KeggWordIndex(
+            keggDb.execute("SELECT pathway_id, name FROM pathways ORDER BY rowid"), species
+        )
+    else:
+        keggId2pathway = loadKeggWordIndex(keggId2pathway, 1, species)
+        pathId2pathName = loadKeggWordIndex(pathId2pathName, 0, species)
+
+    output = open(outputFile, "w")
+    output.write(
+        "UniqueID\tFeature_Name\tFeature_Type\tKEGG_ID\tPathway_ID\tPathway_Name\n"
+    )
+
+    # KEGG ID -> pathways, shared by the features with the same KEGG ID
+    keggId2paths = {}
+
+    def pathLines():
+        for uniqueID, featureName, feature in zip(
+            features["UniqueID"], features["Feature_Name"], features["KEGG_ID"]
+        ):
+            paths = keggId2paths.get(feature)
+            if paths is None:
+                kegg_ids = [feature]
+                # Step 1) Obtain path_id
+                path_ids = parseWordIndex(kegg_ids, keggId2pathway)
+                # Step 2) Obtain path_name
+                paths = parseWordIndex(path_ids, pathId2pathName)
+                keggId2paths[feature] = paths
+            if paths:
+                prefix = uniqueID + "\t" + featureName + "\t" + featureType + "\t"
+                for path in paths:
+                    yield prefix + path + "\n"
+        for feature in featureList:
+            yield feature
+
+    output.writelines(sortLines(pathLines(), natural_keys, sortBuffer))
+
+    output.close()
+
+
+# Number of lines sorted in memory by sortLines, the others are sorted in temporary files
+PATH_SORT_BUFFER = 500000
+
+
+def sortLines(lines, key, sortBuffer=None):
+    """
+    Sort lines like sorted(lines, key=key), keeping at most sortBuffer lines in memory: sorted
+    runs of sortBuffer lines are written to temporary files and merged. Equal lines keep their
+    order, as in sorted.
+
+    Arguments:
+        :param lines: Lines to sort, ending with a newline.
+        :type lines: iterable
+
+        :param key: Sort key of a line.
+        :type key: function
+
+        :param sortBuffer: Number of lines sorted in memory at a time (default: PATH_SORT_BUFFER)
+        :type sortBuffer: int
+
+    Returns:
+        :return sortedLines: Sorted lines.
+        :rtype sortedLines: generator
+    """
+
+    if sortBuffer is None:
+        sortBuffer = PATH_SORT_BUFFER
+    runs = []
+    try:
+        buffer = []
+        for line in lines:
+            buffer.append(line)
+            if len(buffer) >= sortBuffer:
+                run = tempfile.TemporaryFile(mode="w+", newline="\n")
+                runs.append(run)
+                buffer.sort(key=key)
+                run.writelines(buffer)
+                run.seek(0)
+                buffer = []
+        buffer.sort(key=key)
+        if not runs:
+            yield from buffer
+        else:
+            # Runs are in input order, heapq.merge keeps equal lines in that order
+            yield from heapq.merge(*(runs + [buffer]), key=key)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def parseWord(toParseList, parser, nameIndex, species):
+    """
+    Read a column from a KEGG file, find a given word and return a value from another column.
+    Use to parse genes and metabolites into kegg identifiers and find related pathways via names.
+
+    Arguments:
+        :param toParseList: Input words list to parse
+        :type toParseList: list
+
+        :param parser: Kegg downloaded file
+        :type parser: file
+
+        :param nameIndex: index value of the column where the input word is in the parser file
+        :type nameIndex: integer (0 or 1)
+
+        :param species: species identifier in kegg
+        :type species: string
+
+    Returns:
+        :return outputList: Input list with parsed value included. outputList_v2 if removing gene
+        symbol needed
+        :rtype outputList: list
+    """
+
+    return parseWordIndex(toParseList, loadKeggWordIndex(parser, nameIndex, species))
+
+
+def loadKeggWordIndex(keggFile, nameIndex, species):
+    """
+    KeggWordIndex of a KEGG file, reused while the file does not change.
+
+    Arguments:
+        :param keggFile: Kegg downloaded file
+        :type keggFile: file
+
+        :param nameIndex: index value of the column where the words are in the file
+        :type nameIndex: integer (0 or 1)
+
+        :param species: species identifier in kegg
+        :type species: string
+
+    Returns:
+        :return wordIndex: Index of the file.
+        :rtype wordIndex: KeggWordIndex
+    """
+
+    keggFile = os.path.abspath(keggFile)
+    stat = os.stat(keggFile)
+    return cachedKeggWordIndex(
+        keggFile, nameIndex, species, (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    )
+
+
+@lru_cache(maxsize=8)
+def cachedKeggWordIndex(keggFile, nameIndex, species, fileVersion):
+    """
+    KeggWordIndex.fromFile, cached by file path and version (inode, modification time, size).
+    """
+
+    return KeggWordIndex.fromFile(keggFile, nameIndex, species)
+
+
+def parseWordIndex(toParseList, wordIndex):
+    """
+    parseWord with the KEGG file already read into a KeggWordIndex.
+
+    Arguments:
+        :param toParseList: Input words list to parse
+        :type toParseList: list
+
+        :param wordIndex: Index of the KEGG file.
+        :type wordIndex: KeggWordIndex
+
+    Returns:
+        :return outputList: Input list with parsed value included. outputList_v2 if removing gene
+        symbol needed
+        :rtype outputList: list
+    """
+
+    outputList = []
+    outputList_v2 = []
+    for toParseLine in toParseList:
+        toParseLineList = toParseLine.split("\t")
+        toParseWord = toParseLineList[len(toParseLineList) - 1]
+        for parsedName in wordIndex.search(toParseWord):
+            outputList.append(toParseLine + "\t" + parsedName)
+        if not outputList:
+            outputList.append(toParseLine + "\tNA")
+    # In cases of ensembl-gene_symbol-kegg_id-path_id-path_name
+    for outputLine in outputList:
+        if len(outputLine.split("\t")) == 4:
+            if outputLine.split("\t")[3] != "NA":
+                outputLineList = outputLine.split("\t")
+                del outputLineList[0]
+                outputList_v2.append("\t".join(outputLineList))
+            else:
+                outputList.remove(outputLine)
+
+    return outputList_v2 if outputList_v2 else outputList
+
+
+# Words that KeggWordIndex finds without a regular expression: word characters, maybe separated
+# by characters without a special meaning in regular expressions (":", "-", " ", ...)
+INDEXED_WORD = re.compile(r"\w+(?:[^\w.^$*+?{}\[\]\\|()]+\w+)*")
+
+
+class KeggWordIndex(object):
+    """
+    Two column KEGG file (link or pathway list) indexed by the whole words of its key column, so
+    words are found as with findWholeWord in a dictionary instead of scanning the file.
+    Values are parsed as in parseWord: " - species" is removed from pathway names and reference
+    ("map") pathways are made organism specific.
+
+    Arguments:
+        :param pairs: (key, value) pairs in file order.
+        :type pairs: iterable
+
+        :param species: species identifier in kegg
+        :type species: string
+    """
+
+    def __init__(self, pairs, species):
+        self.keys = []
+        self.values = []
+        # Lowercase whole word -> positions of the keys that contain it
+        self.words = {}
+        # Non ASCII keys can match differently in re.IGNORECASE, always check them
+        self.unindexed = []
+        for names2findIn, parsedName in pairs:
+            names2findIn = names2findIn.strip()
+            if ";" in names2findIn:
+                names2findIn = names2findIn.split(";")[0].strip()
+            parsedName = parsedName.strip()
+            # Remove " - species information" from pathway name
+            if " - " in parsedName:
+                parsedName = parsedName.split(" - ")[0]
+            # Organism specific pathways
+            elif "map" in parsedName:
+                parsedName = parsedName.replace("map", species)
+            position = len(self.keys)
+            self.keys.append(names2findIn)
+            self.values.append(parsedName)
+            if not names2findIn.isascii():
+                self.unindexed.append(position)
+                continue
+            # A whole word runs from the start to the end of word character runs, and it cannot
+            # be followed by "-"
+            runs = [(run.start(), run.end()) for run in re.finditer(r"\w+", names2findIn)]
+            words = set()
+            for i, (start, _) in enumerate(runs):
+                for _, end in runs[i:]:
+                    if names2findIn[end:end + 1] != "-":
+                        words.add(names2findIn[start:end].lower())
+            for word in words:
+                self.words.setdefault(word, []).append(position)
+
+    @classmethod
+    def fromFile(cls, keggFile, nameIndex, species):
+        """
+        Index a KEGG file.
+
+        Arguments:
+            :param keggFile: Kegg downloaded file
+            :type keggFile: file
+
+            :param nameIndex: index value of the column where the words are in the file
+            :type nameIndex: integer (0 or 1)
+
+            :param species: species identifier in kegg
+            :type species: string
+
+        Returns:
+            :return wordIndex: Index of the file.
+            :rtype wordIndex: KeggWordIndex
+        """
+
+        with open(keggFile, "r") as parser:
+            return cls(
+                (
+                    (parserLine.split("\t")[nameIndex], parserLine.split("\t")[abs(nameIndex - 1)])
+                    for parserLine in parser
+                ),
+                species,
+            )
+
+    def search(self, word):
+        """
+        Find the values of the keys that contain word (see findWholeWord).
+
+        Arguments:
+            :param word: Word to find.
+            :type word: string
+
+        Returns:
+            :return parsedNames: Values, in file order.
+            :rtype parsedNames: list
+        """
+
+        if word.isascii() and INDEXED_WORD.fullmatch(word):
+            positions = self.words.get(word.lower(), [])
+            if self.unindexed:
+                isContained = findWholeWord(word)
+                positions = sorted(
+                    set(positions).union(i for i in self.unindexed if isContained(self.keys[i]))
+                )
+        else:
+            isContained = findWholeWord(word)
+            positions = [i for i, keyNames in enumerate(self.keys) if isContained(keyNames)]
+        return [self.values[i] for i in positions]
+
+
+def findWholeWord(word):
+    """
+    Find one word inside another word.
+
+    Arguments:
+        :param word: word to check if is contained inside another word
+        :type word: string
+
+    Returns:
+        :return is_contained: Returns "yes" if it's contained, "no" if not
+        :rtype is_contained: boolean
+    """
+
+    return compileWholeWord(word).search
+
+
+@lru_cache(maxsize=4096)
+def compileWholeWord(word):
+    """
+    Compiled findWholeWord pattern. Patterns are kept for the most recent words, the re module
+    cache is too small for the words of a whole KEGG file.
+
+    Arguments:
+        :param word: word to check if is contained inside another word
+        :type word: string
+
+    Returns:
+        :return pattern: Case insensitive pattern of the whole word, not next to "-".
+        :rtype pattern: re.Pattern
+    """
+
+    return re.compile(r"\b(?![-])({0})(?![-])\b".format(word), flags=re.IGNORECASE)
+
+
+# Numbers in text, for natural_keys
+NATURAL_KEY_SPLIT = re.compile(r"(\d+)")
+
+
+def atoi(text):
+    """
+    Sort numbers in human readable order.
+    """
+    return int(text) if text.isdigit() else text
+
+
+def natural_keys(text):
+    """
+    alist.sort(key=natural_keys) sorts in human readable order
+    http://nedbatchelder.com/blog/200712/human_sorting.html
+    (See Toothy's implementation in the comments)
+    """
+    return [atoi(c) for c in NATURAL_KEY_SPLIT.split(text)]
+
+
+def readDeaFlags(deaDataset, idCol, flagCol):
+    """
+    Read the flag of each feature of a Differential Expression Analysis table in a single pass.
+
+    Arguments:
+        :param deaDataset: Table with Differential Expression Analysis information
+        :type deaDataset: file
+
+        :param idCol: Name of the column with the unique identifiers
+        :type idCol: string
+
+        :param flagCol: Name of the flag column
+        :type flagCol: string
+
+    Returns:
+        :return id2flag: Flag of each unique identifier (without quotes), from its first row
+        :rtype id2flag: dictionary
+
+        :return deCount: Number of rows flagged 1
+        :rtype deCount: int
+
+        :return nonDeCount: Number of rows flagged 0
+        :rtype nonDeCount: int
+    """
+
+    id2flag = {}
+    deCount = 0
+    nonDeCount = 0
+    with open(deaDataset, "r") as dataset:
+        header = dataset.readline().rstrip("\r\n").split("\t")
+        idIndex = header.index(idCol)
+        flagIndex = header.index(flagCol)
+        for line in dataset:
+            fields = line.rstrip("\r\n").split("\t")
+            flag = int(fields[flagIndex])
+            if flag == 1:
+                deCount += 1
+            elif flag == 0:
+                nonDeCount += 1
+            id2flag.setdefault(fields[idIndex].replace('"', ""), flag)
+
+    return (id2flag, deCount, nonDeCount)
+
+
+def benjaminiHochberg(pvalues):
+    """
+    Benjamini-Hochberg FDR correction, as p.adjust(pvalues, method="BH") in R.
+
+    Arguments:
+        :param pvalues: P-values
+        :type pvalues: numpy array
+
+    Returns:
+        :return fdr: Adjusted p-values, in the order of pvalues
+        :rtype fdr: numpy array
+    """
+
+    pvalues = np.asarray(pvalues, dtype=float)
+    n = len(pvalues)
+    order = np.argsort(pvalues, kind="stable")[::-1]
+    adjusted = pvalues[order] * n / np.arange(n, 0, -1)
+    fdr = np.empty(n)
+    fdr[order] = np.minimum(np.minimum.accumulate(adjusted), 1)
+
+    return fdr
+
+
+def enrichmentTest(a, a_c, a_b, c_d):
+    """
+    One-sided (enrichment) Fisher exact test of contingency tables given as arrays, see
+    fisherExactTest for the table. The arrays are broadcast against each other.
+
+    Arguments:
+        :param a: Flagged molecules associated to the pathway
+        :type a: numpy array
+
+        :param a_c: Molecules associated to the pathway
+        :type a_c: numpy array
+
+        :param a_b: Flagged molecules
+        :type a_b: numpy array
+
+        :param c_d: Not flagged molecules
+        :type c_d: numpy array
+
+    Returns:
+        :return oddsratios: Odds ratios, as in scipy.stats.fisher_exact
+        :rtype oddsratios: numpy array
+
+        :return pvalues: P(X >= a) in the hypergeometric distribution
+        :rtype pvalues: numpy array
+    """
+
+    # b), c), d)
+    b = a_b - a
+    c = a_c - a
+    d = c_d - c
+
+    # Same odds ratio as scipy.stats.fisher_exact, NaN if a row or a column adds up to 0
+    empty = (a_b == 0) | (c_d == 0) | (a_c == 0) | (b + d == 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        oddsratios = np.where((b > 0) & (c > 0), a * d / (b * c), np.inf)
+    oddsratios = np.where(empty, np.nan, oddsratios)
+    pvalues = st.hypergeom.sf(a - 1, a_b + c_d, a_b, a_c)
+    pvalues = np.where(empty, 1.0, np.clip(pvalues, 0, 1))
+
+    return (oddsratios, pvalues)
+
+
+def fisherExactTest(args, path_feat):
+    """
+    Perform a complete Pathway enrichment analysis:
+    1) Calculate all values of the contingency table
+    2) Perform a Fisher Exact test
+    3) Perform an FDR correction of p-values
+    *********************
+    * Fisher exact test *
+    *********************
+             | Molecules associated to pathway | Molecules not associated to pathway | Total
+    -----------------------------------------------------------------------------------------
+    DEG/M    |              a                  |                 b                   |  a+b
+    -----------------------------------------------------------------------------------------
+    No DEG/M |              c                  |                 d                   |  c+d
+    -----------------------------------------------------------------------------------------
+    Total    |             a+c                 |                b+d                  |   N
+    -----------------------------------------------------------------------------------------
+
+    N = Total of molecules
+    a+b = Total 1 flags
+    c+d = Total 0 flags
+
+    The contingency tables of all the pathways are computed at once. The P-value is the one-sided
+    (enrichment) Fisher exact test, P(X >= a) in the hypergeometric distribution, and the FDR is
+    the Benjamini-Hochberg correction of the P-values of all the pathways.
+
+    Arguments:
+        :params deaGeneDataset deaMetDataset: Tables with Differential Expression Analysis
+        information for gene expression and metabolomics, respectively
+        :types deaGeneDataset met_dataset: files
+
+        :params gene_id_col, met_id_col, gene_flag_col, met_flag_col: Column names of unique
+        identifiers and desired flag column of gene expression and metabolomics datasets,
+        respectively
+        :type gene_id_col, met_id_col, gene_flag_col, met_flag_col: strings
+
+        :param path_feat: Unique identifiers of the molecules of each pathway
+        :type path_feat: dictionary
+
+    Returns:
+        :return PEAList: Lines with this structure: Pathway Odds_Ratio P_value FDR_BH
+        :rtype PEAList: list
+    """
+
+    # Flag of each molecule, a+b, c+d)
+    gene2flag, geneDeCounter, geneNonDeCounter = readDeaFlags(
+        args.deaGeneDataset, args.gene_id_col, args.gene_flag_col
+    )
+    met2flag, metDeCounter, metNonDeCounter = readDeaFlags(
+        args.deaMetDataset, args.met_id_col, args.met_flag_col
+    )
+    a_b = geneDeCounter + metDeCounter
+    c_d = geneNonDeCounter + metNonDeCounter
+
+    # a) and a+c) of every pathway, adding up the flags of their molecules
+    pathways = list(path_feat.keys())
+    pathIndex = []
+    flags = []
+    found = []
+    for index, pathway in enumerate(pathways):
+        for value in path_feat[pathway]:
+            pathIndex.append(index)
+            flags.append(gene2flag.get(value, 0) + met2flag.get(value, 0))
+            found.append((value in gene2flag) + (value in met2flag))
+    a = np.zeros(len(pathways), dtype=np.int64)
+    a_c = np.zeros(len(pathways), dtype=np.int64)
+    np.add.at(a, pathIndex, np.array(flags, dtype=np.int64))
+    np.add.at(a_c, pathIndex, np.array(found, dtype=np.int64))
+
+    oddsratios, pvalues = enrichmentTest(a, a_c, a_b, c_d)
+    fdrs = benjaminiHochberg(pvalues)
+
+    PEAList = [
+        pathway + "\t" + str(float(oddsratio)) + "\t" + str(float(pvalue)) + "\t" +
+        str(float(fdr))
+        for pathway, oddsratio, pvalue, fdr in zip(pathways, oddsratios, pvalues, fdrs)
+    ]
+
+    return PEAList
+
+
+def readDeaFlagTable(deaDataset, idCol, flagCols=None):
+    """
+    Read several flag columns of a Differential Expression Analysis table (e.g. the output of
+    add_pval_flags.py) at once.
+
+    Arguments:
+        :param deaDataset: Table with Differential Expression Analysis information
+        :type deaDataset: file
+
+        :param idCol: Name of the column with the unique identifiers
+        :type idCol: string
+
+        :param flagCols: Names of the flag columns (default: all the Flag_ columns)
+        :type flagCols: list
+
+    Returns:
+        :return ids: Unique identifiers (without quotes), first row of each one only
+        :rtype ids: pandas.Index
+
+        :return flags: Flags of the ids, one column per flag column
+        :rtype flags: numpy array
+
+        :return deCounts: Number of rows flagged 1 in each flag column
+        :rtype deCounts: numpy array
+
+        :return nonDeCounts: Number of rows flagged 0 in each flag column
+        :rtype nonDeCounts: numpy array
+
+        :return flagCols: Names of the flag columns
+        :rtype flagCols: list
+    """
+
+    if flagCols is None:
+        with open(deaDataset, "r") as dataset:
+            header = dataset.readline().rstrip("\r\n").split("\t")
+        flagCols = [column for column in header if column.startswith("Flag_")]
+    table = pd.read_csv(
+        deaDataset,
+        sep="\t",
+        header=0,
+        usecols=[idCol] + list(flagCols),
+        dtype=dict({column: np.int64 for column in flagCols}, **{idCol: str}),
+        quoting=csv.QUOTE_NONE,
+        keep_default_na=False,
+        na_filter=False,
+        index_col=False,
+    )
+    flags = table[flagCols].to_numpy(dtype=np.int64)
+    deCounts = (flags == 1).sum(axis=0)
+    nonDeCounts = (flags == 0).sum(axis=0)
+
+    ids = pd.Index(table[idCol].str.replace('"', ""), dtype=object)
+    first = ~ids.duplicated()
+
+    return (ids[first], flags[first], deCounts, nonDeCounts, list(flagCols))
+
+
+def readPathwayMembers(pathwayFiles):
+    """
+    Read the unique identifiers of the molecules of each pathway (path_feat of fisherExactTest)
+    from add_kegg_pathway_info.py outputs.
+
+    Arguments:
+        :param pathwayFiles: Gene and/or metabolite outputs of add_kegg_pathway_info.py
+        :type pathwayFiles: list
+
+    Returns:
+        :return path_feat: Unique identifiers of each pathway, once each, with the pathways and
+        identifiers in order of appearance
+        :rtype path_feat: dictionary
+
+        :return pathwayNames: Name of each pathway
+        :rtype pathwayNames: dictionary
+    """
+
+    path_feat = {}
+    pathwayNames = {}
+    for pathwayFile in pathwayFiles:
+        with open(pathwayFile, "r") as pathways:
+            header = pathways.readline().rstrip("\r\n").split("\t")
+            idIndex = header.index("UniqueID")
+            pathIndex = header.index("Pathway_ID")
+            nameIndex = header.index("Pathway_Name")
+            for line in pathways:
+                fields = line.rstrip("\r\n").split("\t")
+                pathway = fields[pathIndex]
+                if pathway == "NA":
+                    continue
+                path_feat.setdefault(pathway, {})[fields[idIndex]] = None
+                pathwayNames.setdefault(pathway, fields[nameIndex])
+
+    return ({pathway: list(ids) for pathway, ids in path_feat.items()}, pathwayNames)
+
+
+def loadPathwayIncidence(pathwayFiles, featureIndexes):
+    """
+    Build the pathway x feature incidence matrix from add_kegg_pathway_info.py outputs.
+
+    Arguments:
+        :param pathwayFiles: Gene and/or metabolite outputs of add_kegg_pathway_info.py
+        :type pathwayFiles: list
+
+        :param featureIndexes: Unique identifiers of each block of features (columns of the
+        matrix), in order. An identifier found in several blocks is a member of all of them.
+        :type featureIndexes: list of pandas.Index
+
+    Returns:
+        :return pathwayIds: Pathway IDs (rows of the matrix), in order of appearance
+        :rtype pathwayIds: numpy array
+
+        :return pathwayNames: Pathway names of the pathwayIds
+        :rtype pathwayNames: numpy array
+
+        :return incidence: 1 if the feature is associated to the pathway
+        :rtype incidence: scipy.sparse.csr_matrix
+    """
+
+    links = pd.concat(
+        [
+            pd.read_csv(
+                pathwayFile,
+                sep="\t",
+                header=0,
+                usecols=["UniqueID", "Pathway_ID", "Pathway_Name"],
+                dtype=str,
+                quoting=csv.QUOTE_NONE,
+                keep_default_na=False,
+                na_filter=False,
+                index_col=False,
+            )
+            for pathwayFile in pathwayFiles
+        ],
+        ignore_index=True,
+    )
+    links = links.loc[links["Pathway_ID"] != "NA"]
+    pathwayCodes, pathwayIds = pd.factorize(links["Pathway_ID"])
+    pathwayNames = links.drop_duplicates("Pathway_ID")["Pathway_Name"].to_numpy()
+
+    rows = []
+    columns = []
+    offset = 0
+    for featureIndex in featureIndexes:
+        positions = featureIndex.get_indexer(links["UniqueID"])
+        found = positions >= 0
+        rows.append(pathwayCodes[found])
+        columns.append(positions[found] + offset)
+        offset += len(featureIndex)
+    rows = np.concatenate(rows)
+    columns = np.concatenate(columns)
+
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, columns)), shape=(len(pathwayIds), offset)
+    )
+    # A feature linked twice to a pathway (several KEGG IDs) is counted once
+    incidence.sum_duplicates()
+    incidence.data[:] = 1
+
+    return (np.asarray(pathwayIds, dtype=object), pathwayNames, incidence)
+
+
+def multiFlagEnrichment(args, pathwayFiles, flagCols=None):
+    """
+    Pathway enrichment analysis (see fisherExactTest) of several flag columns at once, e.g. all
+    the thresholds of add_pval_flags.py. The contingency tables of every pathway and flag column
+    come from a single product of the sparse pathway x feature incidence matrix with the flags.
+
+    Arguments:
+        :params deaGeneDataset deaMetDataset: Tables with Differential Expression Analysis
+        information for gene expression and metabolomics, respectively
+        :types deaGeneDataset met_dataset: files
+
+        :params gene_id_col, met_id_col: Column names of unique identifiers of gene expression and
+        metabolomics datasets, respectively
+        :type gene_id_col, met_id_col: strings
+
+        :param pathwayFiles: Gene and/or metabolite outputs of add_kegg_pathway_info.py
+        :type pathwayFiles: list
+
+        :param flagCols: Names of the flag columns, in both datasets (default: all the Flag_
+        columns of the gene expression dataset)
+        :type flagCols: list
+
+    Returns:
+        :return enrichment: Table with these columns: Pathway_ID Pathway_Name Flag Odds_Ratio
+        P_value FDR_BH, one row per flag column and pathway. The FDR is corrected within each
+        flag column.
+        :rtype enrichment: pandas.DataFrame
+    """
+
+    geneIds, geneFlags, geneDeCounts, geneNonDeCounts, flagCols = readDeaFlagTable(
+        args.deaGeneDataset, args.gene_id_col, flagCols
+    )
+    metIds, metFlags, metDeCounts, metNonDeCounts, flagCols = readDeaFlagTable(
+        args.deaMetDataset, args.met_id_col, flagCols
+    )
+    pathwayIds, pathwayNames, incidence = loadPathwayIncidence(pathwayFiles, [geneIds, metIds])
+
+    # a) for every pathway and flag column at once, a+c), a+b), c+d)
+    a = incidence @ np.vstack([geneFlags, metFlags])
+    a_c = np.asarray(incidence.sum(axis=1)).reshape(-1, 1)
+    a_b = (geneDeCounts + metDeCounts).reshape(1, -1)
+    c_d = (geneNonDeCounts + metNonDeCounts).reshape(1, -1)
+
+    oddsratios, pvalues = enrichmentTest(a, a_c, a_b, c_d)
+    fdrs = np.empty_like(pvalues)
+    for flag in range(len(flagCols)):
+        fdrs[:, flag] = benjaminiHochberg(pvalues[:, flag])
+
+    # One block of pathways per flag column
+    enrichment = pd.DataFrame(
+        {
+            "Pathway_ID": np.tile(pathwayIds, len(flagCols)),
+            "Pathway_Name": np.tile(pathwayNames, len(flagCols)),
+            "Flag": np.repeat(flagCols, len(pathwayIds)),
+            "Odds_Ratio": oddsratios.T.ravel(),
+            "P_value": pvalues.T.ravel(),
+            "FDR_BH": fdrs.T.ravel(),
+        }
+    )
+
+    return enrichment
+
+
+##########################
+# All vs All Correlation #
+##########################
+
+
+def Ids2Names(dataset, Id, annot, annotName):
+    """
+    Change unique identifiers to feature names. It could be used for genes or for metabolites.
+
+    Arguments:
+        :param dataset: Wide dataset (Gene Expression/Metabolomics)
+        :type dataset: pandas dataframe
+
+        :param Id: Name of the column with Unique Identifiers.
+        :type Id: string
+
+        :param annot: Annotation File (For Gene Expression/Metabolomics). This file must contain at
+        least 2 columns.
+        :type annot: file
+
+        :param annotName: Name of the column of the Annotation File that contains the Feature Name
+        (Genes/Metabolites)
+        :type annotName: file
+
+    Returns:
+        :return new_dataset: Wide dataset with feature names (genes/metabolites) instead of unique
+        identifiers
+        :rtype new_dataset: pandas dataset
+    """
+
+    annotTable = pd.read_table(annot, sep="\t", header=0)
+    if "Selected" in annotTable.columns:
+        annotTable = annotTable[annotTable["Selected"] == "Yes"]
+        annotTable = annotTable.drop_duplicates(subset=Id, keep="first")
+
+    for index, row in dataset.iterrows():
+        ID = str(row[Id])
+        name = str(annotTable.loc[annotTable[Id] == ID, annotName].item())
+        dataset.loc[index, Id] = ID + ": " + name
+
+    new_dataset = dataset.rename(columns={Id: annotName})
+    new_dataset = new_dataset.set_index(annotName)
+
+    return new_dataset
+
+
+def nearZeroVar(matrix, freqCut=95 / 5, uniqueCut=10):
+    """
+    Find the variables with near zero variance, as nearZeroVar from caret (used by checkZeroVar in
+    all_by_all_correlation.R).
+
+    Arguments:
+        :param matrix: Matrix with samples in rows and variables in columns.
+        :type matrix: numpy array
+
+        :param freqCut: Cutoff for the ratio of the most common value to the second most common.
+        :type freqCut: float
+
+        :param uniqueCut: Cutoff for the percentage of distinct values out of the samples.
+        :type uniqueCut: float
+
+    Returns:
+        :return nzv: True for the columns with near zero variance.
+        :rtype nzv: numpy array
+    """
+
+    nzv = np.zeros(matrix.shape[1], dtype=bool)
+    for column in range(matrix.shape[1]):
+        data = matrix[:, column]
+        values, counts = np.unique(data[~np.isnan(data)], return_counts=True)
+        # Zero variance (or only NAs)
+        if len(values) <= 1:
+            nzv[column] = True
+            continue
+        counts.sort()
+        freqRatio = counts[-1] / counts[-2]
+        percentUnique = 100 * len(values) / matrix.shape[0]
+        nzv[column] = freqRatio > freqCut and percentUnique <= uniqueCut
+
+    return nzv
+
+
+def correlationScores(matrix, meth):
+    """
+    Transform the columns of a matrix so that the correlation of two columns is the dot product of
+    their scores: centered and normalized values (pearson) or ranks (spearman), or normalized signs
+    of the differences between all pairs of samples (kendall, tau-b as in R).
+
+    Arguments:
+        :param matrix: Matrix with samples in rows and variables in columns.
+        :type matrix: numpy array
+
+        :param meth: Methodology for the correlation. One of 'pearson', 'spearman' or 'kendall'.
+        :type meth: string
+
+    Returns:
+        :return scores: Scores of the columns, NaN for the columns without variance or with NAs.
+        :rtype scores: numpy array
+    """
+
+    matrix = np.asarray(matrix, dtype=float)
+    if meth == "kendall":
+        first, second = np.triu_indices(matrix.shape[0], k=1)
+        scores = np.sign(matrix[second] - matrix[first])
+    elif meth in ("pearson", "spearman"):
+        if meth == "spearman":
+            matrix = st.rankdata(matrix, axis=0)
+        scores = matrix - matrix.mean(axis=0)
+    else:
+        raise ValueError("Unknown correlation method: {0}".format(meth))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return scores / np.sqrt((scores ** 2).sum(axis=0))
+
+
+def correlationMatrix(x, y, meth):
+    """
+    Correlation between the columns of x and the columns of y as a single matrix product, like
+    cor(x, y, method = meth) in R.
+
+    Arguments:
+        :param x: Matrix with samples in rows and genes in columns.
+        :type x: numpy array
+
+        :param y: Matrix with samples in rows and metabolites in columns.
+        :type y: numpy array
+
+        :param meth: Methodology for the correlation. One of 'pearson', 'spearman' or 'kendall'.
+        :type meth: string
+
+    Returns:
+        :return corr: Correlation matrix with genes in rows and metabolites in columns.
+        :rtype corr: numpy array
+    """
+
+    return correlationScores(x, meth).T @ correlationScores(y, meth)
+
+
+# Simulated datasets per random stream of permutationPvalues
+PERMUTATION_CHUNK_SIZE = 50
+
+# Data of the permutation worker processes
+permutationWorker = {}
+
+
+def initPermutationWorker(x, y, meth):
+    """
+    Keep the data of permutationPvalues in the permutation worker process. With fork it is
+    inherited, not copied.
+    """
+
+    permutationWorker.clear()
+    permutationWorker["x"] = x
+    permutationWorker["y"] = y
+    permutationWorker["meth"] = meth
+
+
+def permutationWorkerCounts(chunk):
+    """
+    permutationCounts for a chunk (genes, seed sequence, iterations) in a permutation worker
+    process (see initPermutationWorker). The correlations of the genes (a slice of the columns of
+    x) are computed once per worker and block of genes.
+    """
+
+    genes, seedSequence, iterations = chunk
+    x = permutationWorker["x"][:, genes]
+    if permutationWorker.get("genes") != (genes.start, genes.stop):
+        permutationWorker["genes"] = (genes.start, genes.stop)
+        permutationWorker["absCorr"] = np.abs(
+            correlationMatrix(x, permutationWorker["y"], permutationWorker["meth"])
+        )
+    return permutationCounts(
+        x,
+        permutationWorker["y"],
+        permutationWorker["absCorr"],
+        permutationWorker["meth"],
+        iterations,
+        seedSequence,
+    )
+
+
+def permutationPool(x, y, meth, jobs):
+    """
+    Pool of permutation worker processes for permutationPvalues (see initPermutationWorker).
+    Forked workers share the data copy-on-write instead of unpickling it. The pool can be reused
+    for any block of genes of x.
+
+    Arguments:
+        :param x: Matrix with samples in rows and genes in columns.
+        :type x: numpy array
+
+        :param y: Matrix with samples in rows and metabolites in columns.
+        :type y: numpy array
+
+        :param meth: Methodology for the correlation. One of 'pearson', 'spearman' or 'kendall'.
+        :type meth: string
+
+        :param jobs: Number of processes.
+        :type jobs: int
+
+    Returns:
+        :return pool: Pool of processes, to be closed by the caller (e.g. with a with statement).
+        :rtype pool: multiprocessing.pool.Pool
+    """
 
-    if featureName == keggName:
-        similarity = 1.0
-    elif featureName.lower() == keggName.lower():
-        similarity = 0.9
-    elif (featureName.lower() in mainPrefixes) or (keggName.lower() in mainPrefixes):
-        similarity = SequenceMatcher(a=featureName.lower(), b=keggName.lower()).ratio()
-    elif keggName.lower().replace(featureName.lower(), "") in mainPrefixes:
-        similarity = 0.9
-    elif featureName.lower().replace(keggName.lower(), "") in mainPrefixes:
-        similarity = 0.9
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
     else:
-        similarity = SequenceMatcher(a=featureName, b=keggName).ratio()
-
-    return similarity
+        context = multiprocessing.get_context()
+    return context.Pool(jobs, initializer=initPermutationWorker, initargs=(x, y, meth))
 
 
-def downloadKeggInfo(args):
+def permutationCounts(x, y, absCorr, meth, iterations, seedSequence):
     """
-    Download necessary information from Kegg Database for parsing.
+    Count, for each correlation, the simulated datasets with a stronger correlation.
 
     Arguments:
-        :param geneKeggAnnot: Gene to KEGG ID Link file
-        :type geneKeggAnnot: file
+        :param x: Matrix with samples in rows and genes in columns.
+        :type x: numpy array
 
-        :param metKeggAnnot: Metabolite to KEGG ID Link file
-        :type metKeggAnnot: file
+        :param y: Matrix with samples in rows and metabolites in columns.
+        :type y: numpy array
 
-    Returns:
-        :return gen2kegg: kegg_gene_identifier "\t" Gene_Symbol ";" Gene_name
-        :rtype gen2kegg: file
+        :param absCorr: Absolute value of the correlation matrix between x and y.
+        :type absCorr: numpy array
 
-        :return kgen2pathway: kegg_gene_identifier "\t" pathway_identifier_for_gene
-        :rtype kgen2pathway: file
+        :param meth: Methodology for the correlation. One of 'pearson', 'spearman' or 'kendall'.
+        :type meth: string
 
-        :return met2kegg: kegg_metabolite_identifier "\t" Metabolite_names_list_sep_;
-        :rtype met2kegg: file
+        :param iterations: Number of simulated datasets.
+        :type iterations: int
 
-        :return kmet2pathway: kegg_metabolite_identifier "\t" pathway_identifier_for_metabolite
-        :rtype kmet2pathway:similarity file
+        :param seedSequence: Seed of the random stream of the simulated datasets.
+        :type seedSequence: numpy.random.SeedSequence
 
-        :return pathways: pathway_identifier_for_gene "\t" Pathway_name "-" Specified_organism
-        :rtype pathways: file
+    Returns:
+        :return counts: Number of simulated datasets with a stronger correlation.
+        :rtype counts: numpy array
     """
 
-    # GeneKeggID2PathwayID
-    if args.geneKeggAnnot:
-        geneKeggAnnot = requests.get(
-            "http://rest.kegg.jp/link/" + args.species + "/pathway"
-        )
-        with open(args.kgen2pathways, 'w') as fh:
-            fh.write(geneKeggAnnot.content.decode("utf-8"))
-
-    # MetaboliteKeggID2PathwayID
-    if args.metKeggAnnot:
-        metKeggAnnot = requests.get(
-            "http://rest.kegg.jp/link/compound/pathway"
+    rng = np.random.default_rng(seedSequence)
+    counts = np.zeros(absCorr.shape, dtype=np.int32)
+    stronger = np.empty(absCorr.shape, dtype=bool)
+    for i in range(iterations):
+        corrNew = correlationMatrix(
+            rng.standard_normal(x.shape), rng.standard_normal(y.shape), meth
         )
-        with open(args.kmet2pathways, 'w') as fh:
-            fh.write(metKeggAnnot.content.decode("utf-8"))
+        np.greater(np.abs(corrNew, out=corrNew), absCorr, out=stronger)
+        counts += stronger
 
-    # PathwayID2PathwayNames
-    if args.pathways:
-        pathways_data = requests.get(
-            "http://rest.kegg.jp/list/pathway/" + args.species
-        )
-        with open(args.pathways, 'w') as fh:
-            fh.write(pathways_data.content.decode("utf-8"))
+    return counts
 
 
-def keggAnnot2list(keggAnnotFile, UniqueID, featureName, featureKeggId, featureType):
+def permutationPvalues(x, y, corr, meth, N=1000, seed=None, jobs=1, pool=None, genes=None):
     """
-    Create a dictionary that for the next function to find KEGG pathway information.
-    Use when the input dataset has been parsed with metabolite_parser tool.
+    Estimate the PValue of each correlation as the proportion of N simulated datasets with a
+    stronger correlation, as permutation_pvalues in all_by_all_correlation.R. The correlations of
+    the simulated normal values do not depend on the mean and standard deviation of each feature,
+    so standard normal values are simulated.
+
+    The simulated datasets are split in chunks of PERMUTATION_CHUNK_SIZE, each one with its own
+    random stream derived from the seed, and the chunks are run in jobs processes (or in pool).
+    The PValues only depend on the seed, not on the number of processes.
 
     Arguments:
-        :param keggAnnotFile: Output file from Add KEGG Annotation Info Tool
-        :type keggAnnotFile: file
+        :param x: Matrix with samples in rows and genes in columns.
+        :type x: numpy array
 
-        :param UniqueID: Name of the column with the unique identifiers.
-        :type UniqueID: string
+        :param y: Matrix with samples in rows and metabolites in columns.
+        :type y: numpy array
 
-        :param featureName: Name of the column with feature names.
-        :type featureName: string
+        :param corr: Correlation matrix between the genes of x and y.
+        :type corr: numpy array
 
-        :param featureKeggId: Name of the column with KEGG Identifiers.
-        :type featureKeggId: string
+        :param meth: Methodology for the correlation. One of 'pearson', 'spearman' or 'kendall'.
+        :type meth: string
 
-        :param featureType: One of 'Gene' or 'Metabolite'
-        :type featureType: string
+        :param N: Number of simulated datasets.
+        :type N: int
 
-    Returns:
-        :return featureDict: Dictionary with this information: (uniqueID + "\t" + featureName) =
-        [nameInKegg, kegg_id]
-        :rtype featureDict: dictionary
+        :param seed: Seed of the random numbers.
+        :type seed: int or numpy.random.SeedSequence
 
-        :return featureList: List with the information of the features without kegg_id
-        :return featureList: list
-    """
+        :param jobs: Number of processes.
+        :type jobs: int
 
-    featureDict = {}
-    featureList = []
+        :param pool: Pool from permutationPool(x, y, meth, jobs), reused instead of starting
+        jobs processes.
+        :type pool: multiprocessing.pool.Pool
 
-    with open(keggAnnotFile, "r") as keggAnnot:
-        header = keggAnnot.readline()
-        header = header.strip().split("\t")
-        keggIdCol = header.index(featureKeggId)
-        uniqueIdCol = header.index(UniqueID)
-        featureNameCol = header.index(featureName)
-        for line in keggAnnot:
-            uniqueID = str(line.split("\t")[uniqueIdCol])
-            featureName = str(line.split("\t")[featureNameCol])
-            if "Selected" in header:
-                selectedCol = header.index("Selected")
-                selected = line.split("\t")[selectedCol].strip()
-                if selected == "Yes":
-                    kegg_id = line.split("\t")[keggIdCol]
-                    featureDict[uniqueID + "\t" + featureName] = kegg_id
-                # For those that does not have kegg_id
-                if selected == "NA":
-                    featureList.append(
-                        uniqueID +
-                        "\t" +
-                        featureName +
-                        "\t" +
-                        featureType +
-                        "\t" +
-                        "NA" +
-                        "\t" +
-                        "NA" +
-                        "\t" +
-                        "NA" +
-                        "\n"
-                    )
-            else:
-                kegg_id = line.split("\t")[keggIdCol]
-                if kegg_id:
-                    featureDict[uniqueID + "\t" + featureName] = kegg_id
-                else:
-                    featureList.append(
-                        uniqueID +
-                        "\t" +
-                        featureName +
-                        "\t" +
-                        featureType +
-                        "\t" +
-                        "NA" +
-                        "\t" +
-                        "NA" +
-                        "\t" +
-                        "NA" + "\n"
-                    )
+        :param genes: Block of genes (columns of x) correlated in corr, all by default.
+        :type genes: slice
 
-    return (featureDict, featureList)
+    Returns:
+        :return pvalues: PValue matrix for the correlations between genes and metabolites.
+        :rtype pvalues: numpy array
+    """
 
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    if genes is None:
+        genes = slice(0, x.shape[1])
+    sizes = [
+        min(PERMUTATION_CHUNK_SIZE, N - start) for start in range(0, N, PERMUTATION_CHUNK_SIZE)
+    ]
+    chunks = [(genes, chunkSeed, size) for chunkSeed, size in zip(seed.spawn(len(sizes)), sizes)]
 
-def add_path_info(
-    featureDict,
-    featureList,
-    featureType,
-    keggId2pathway,
-    pathId2pathName,
-    species,
-    outputFile,
-):
-    """
-    Find all pathways in KEGG related to a gene or a metabolite.
+    if pool is None and jobs > 1 and len(chunks) > 1:
+        poolContext = permutationPool(x, y, meth, min(jobs, len(chunks)))
+    else:
+        poolContext = contextlib.nullcontext(pool)
+    counts = np.zeros(corr.shape, dtype=np.int64)
+    with poolContext as pool:
+        if pool is None:
+            absCorr = np.abs(corr)
+            for genes, chunkSeed, iterations in chunks:
+                counts += permutationCounts(x[:, genes], y, absCorr, meth, iterations, chunkSeed)
+        else:
+            for chunkCounts in pool.imap_unordered(permutationWorkerCounts, chunks):
+                counts += chunkCounts
 
-    Arguments:
-        :param featureDict: Dictionary with this information: (uniqueID + "\t" + featureName) =
-        [nameInKegg, kegg_id]
-        :type featureDict: dictionary
+    pvalues = counts / N
+    pvalues[np.isnan(corr)] = np.nan
 
-        :param featureList: List with the information of the features without kegg_id
-        :type featureList: list
+    return pvalues
 
-        :param featureType: Type of the feature. One of 'Gene' or 'Metabolite'
-        :type featureType: string
 
-        :param keggId2pathway: Downloaded information from KEGG with the gene/metabolite KEGG Id
-        and the Pathway ID
-        :type keggId2pathway: file
+def analyticPvalues(corr, n, meth):
+    """
+    Two-sided PValues of the correlations from their distribution under independence, as
+    cor.test with exact = FALSE in R: Student's t with n - 2 degrees of freedom for pearson (exact
+    for normal data) and spearman (large-sample approximation), and the normal approximation for
+    kendall (without correction for ties).
 
-        :param pathId2pathName: Downloaded information from KEGG with the Pathway ID and the
-        Pathway Names
-        :type pathId2pathName: file
+    Arguments:
+        :param corr: Correlation matrix between genes and metabolites.
+        :type corr: numpy array
 
-        :param species: species identifier in kegg
-        :type species: string
+        :param n: Number of samples.
+        :type n: int
 
-        :param outputFile: Output File Name to write the results.
-        :type outputFile: string
-    """
+        :param meth: Methodology for the correlation. One of 'pearson', 'spearman' or 'kendall'.
+        :type meth: string
 
-    output = open(outputFile, "w")
-    output.write(
-        "UniqueID\tFeature_Name\tFeature_Type\tKEGG_ID\tPathway_ID\tPathway_Name\n"
-    )
+    Returns:
+        :return pvalues: PValue matrix for the correlations between genes and metabolites.
+        :rtype pvalues: numpy array
+    """
 
-    features = []
-    for inputFeature, feature in featureDict.items():
-        kegg_ids = [feature]
-        # Step 1) Obtain path_id
-        path_ids = parseWord(kegg_ids, keggId2pathway, 1, species)
-        # Step 2) Obtain path_name
-        paths = parseWord(path_ids, pathId2pathName, 0, species)
-        if paths:
-            for path in paths:
-                features.append(inputFeature + "\t" + featureType + "\t" + path + "\n")
-    features.extend(featureList)
-    for feature in sorted(features, key=natural_keys):
-        output.write(feature)
+    if meth == "kendall":
+        z = 3 * np.abs(corr) * np.sqrt(n * (n - 1)) / np.sqrt(2 * (2 * n + 5))
+        return 2 * st.norm.sf(z)
 
-    output.close()
+    r2 = np.minimum(corr ** 2, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.sqrt(r2 * (n - 2) / (1 - r2))
+    return 2 * st.t.sf(t, n - 2)
 
 
-def parseWord(toParseList, parser, nameIndex, species):
+def correlationEdges(corr, pvalues, geneNames, metNames, thres):
     """
-    Read a column from a KEGG file, find a given word and return a value from another column.
-    Use to parse genes and metabolites into kegg identifiers and find related pathways via names.
+    Table of the correlations with a PValue smaller or equal than the threshold, sorted by their
+    absolute value, as return_result in all_by_all_correlation.R.
 
     Arguments:
-        :param toParseList: Input words list to parse
-        :type toParseList: list
+        :param corr: Correlation matrix between genes and metabolites.
+        :type corr: numpy array
 
-        :param parser: Kegg downloaded file
-        :type parser: file
+        :param pvalues: PValue matrix for the correlations between genes and metabolites.
+        :type pvalues: numpy array
 
-        :param nameIndex: index value of the column where the input word is in the parser file
-        :type nameIndex: integer (0 or 1)
+        :param geneNames metNames: Names of the rows and columns of the matrices.
+        :type geneNames metNames: lists
 
-        :param species: species identifier in kegg
-        :type species: string
+        :param thres: PValue threshold.
+        :type thres: float
 
     Returns:
-        :return outputList: Input list with parsed value included. outputList_v2 if removing gene
-        symbol needed
-        :rtype outputList: list
+        :return edges: Table with this information: Gene Metabolite Correlation Pvalue.
+        :rtype edges: pandas.DataFrame
     """
 
-    parser = open(parser, "r")
-    outputList = []
-    outputList_v2 = []
-    for toParseLine in toParseList:
-        toParseLineList = toParseLine.split("\t")
-        toParseWord = toParseLineList[len(toParseLineList) - 1]
-        parser.seek(0)
-        for parserLine in parser:
-            names2findIn = parserLine.split("\t")[nameIndex].strip()
-            if ";" in names2findIn:
-                names2findIn = names2findIn.split(";")[0].strip()
-            if findWholeWord(toParseWord)(names2findIn):
-                parsedName = parserLine.split("\t")[abs(nameIndex - 1)].strip()
-                # Remove " - species information" from pathway name
-                if " - " in parsedName:
-                    pathName = parsedName.split(" - ")[0]
-                    outputList.append(toParseLine + "\t" + pathName)
-                # Organism specific pathways
-                elif "map" in parsedName:
-                    pathId = parsedName.replace("map", species)
-                    outputList.append(toParseLine + "\t" + pathId)
-                else:
-                    outputList.append(toParseLine + "\t" + parsedName)
-        if not outputList:
-            outputList.append(toParseLine + "\tNA")
-    # In cases of ensembl-gene_symbol-kegg_id-path_id-path_name
-    for outputLine in outputList:
-        if len(outputLine.split("\t")) == 4:
-            if outputLine.split("\t")[3] != "NA":
-                outputLineList = outputLine.split("\t")
-                del outputLineList[0]
-                outputList_v2.append("\t".join(outputLineList))
-            else:
-                outputList.remove(outputLine)
-
-    parser.close()
+    # Column by column, as R walks the matrix, then stable sort by absolute correlation
+    metIndex, geneIndex = np.nonzero((pvalues <= thres).T)
+    correlations = corr[geneIndex, metIndex]
+    order = np.argsort(-np.abs(correlations), kind="stable")
+
+    # Same column names as the data.frame of return_result
+    edges = pd.DataFrame(
+        {
+            '"gene"': np.asarray(geneNames, dtype=object)[geneIndex[order]],
+            '"metabolite"': np.asarray(metNames, dtype=object)[metIndex[order]],
+            '"correlation"': correlations[order],
+            '"p-value"': pvalues[geneIndex[order], metIndex[order]],
+        }
+    )
 
-    return outputList_v2 if outputList_v2 else outputList
+    return edges
 
 
-def findWholeWord(word):
+def plotCorrelationNetwork(edges, figurePath):
     """
-    Find one word inside another word.
+    Plot the correlations in a network-like figure with plot_relations_network from
+    all_by_all_correlation.R.
 
     Arguments:
-        :param word: word to check if is contained inside another word
-        :type word: string
+        :param edges: Table from correlationEdges.
+        :type edges: pandas.DataFrame
 
-    Returns:
-        :return is_contained: Returns "yes" if it's contained, "no" if not
-        :rtype is_contained: boolean
+        :param figurePath: Full path for saving the pdf output.
+        :type figurePath: string
+    """
+    from rpy2 import robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
+    from rpy2.robjects.packages import SignatureTranslatedAnonymousPackage as STAP
+
+    with ires.path("gaitGM.data", "all_by_all_correlation.R") as my_r_script_path:
+        with open(my_r_script_path, "r") as f:
+            rFile = f.read()
+    allByAllCorrScript = STAP(rFile, "plot_relations_network")
+    with localconverter(robjects.default_converter + pandas2ri.converter):
+        R_edges = robjects.conversion.py2rpy(edges)
+    allByAllCorrScript.plot_relations_network(R_edges, figurePath)
+
+
+def allByAllCorrelation(
+    geneTable,
+    metTable,
+    meth,
+    thres,
+    corrMatPath,
+    outputPath,
+    figurePath=None,
+    seed=None,
+    pvalue="permutation",
+    blockSize=None,
+    jobs=1,
+):
     """
+    Correlation analysis between genes and metabolites with NumPy, without R unless the figure is
+    requested. Same analysis and outputs as corr_main_func in all_by_all_correlation.R, the
+    simulated datasets (and so the PValues) differ.
 
-    return re.compile(
-        r"\b(?![-])({0})(?![-])\b".format(word), flags=re.IGNORECASE
-    ).search
+    Arguments:
+        :param geneTable: Gene Wide Dataset with genes in rows (index) and samples in columns.
+        :type geneTable: pandas.DataFrame
 
+        :param metTable: Metabolite Wide Dataset with metabolites in rows (index) and samples in
+        columns.
+        :type metTable: pandas.DataFrame
 
-def atoi(text):
-    """
-    Sort numbers in human readable order.
-    """
-    return int(text) if text.isdigit() else text
+        :param meth: Methodology for the correlation. One of 'pearson', 'spearman' or 'kendall'.
+        :type meth: string
 
+        :param thres: PValue threshold to cut the correlations for the output table.
+        :type thres: float
 
-def natural_keys(text):
-    """
-    alist.sort(key=natural_keys) sorts in human readable order
-    http://nedbatchelder.com/blog/200712/human_sorting.html
-    (See Toothy's implementation in the comments)
-    """
-    return [atoi(c) for c in re.split("(\d+)", text)]
+        :param corrMatPath: Full path for the Correlation Matrix output
+        :type corrMatPath: string
 
+        :param outputPath: Full path for the Output table
+        :type outputPath: string
 
-def fisherExactTest(args, path_feat):
+        :param figurePath: Full Path for the Network-like output figure (optional)
+        :type figurePath: string
+
+        :param seed: Seed of the simulated datasets.
+        :type seed: int
+
+        :param pvalue: PValues from 'permutation' (simulated datasets, see permutationPvalues) or
+        'analytic' (see analyticPvalues).
+        :type pvalue: string
+
+        :param blockSize: If provided, compute the correlations in blocks of blockSize genes and
+        write the correlation matrix as a binary file, see tiledCorrelation.
+        :type blockSize: int
+
+        :param jobs: Number of processes for the simulated datasets.
+        :type jobs: int
     """
-    Perform a complete Pathway enrichment analysis:
-    1) Calculate all values of the contingency table
-    2) Perform a Fisher Exact test
-    3) Perform an FDR correction of p-values
-    *********************
-    * Fisher exact test *
-    *********************
-             | Molecules associated to pathway | Molecules not associated to pathway | Total
-    -----------------------------------------------------------------------------------------
-    DEG/M    |              a                  |                 b                   |  a+b
-    -----------------------------------------------------------------------------------------
-    No DEG/M |              c                  |                 d                   |  c+d
-    -----------------------------------------------------------------------------------------
-    Total    |             a+c                 |                b+d                  |   N
-    -----------------------------------------------------------------------------------------
 
-    N = Total of molecules
-    a+b = Total 1 flags
-    c+d = Total 0 flags
+    # Samples in rows, without near zero variance features
+    x = geneTable.to_numpy(dtype=float).T
+    y = metTable.to_numpy(dtype=float).T
+    keepX = ~nearZeroVar(x)
+    keepY = ~nearZeroVar(y)
+    x = x[:, keepX]
+    y = y[:, keepY]
+    geneNames = geneTable.index[keepX].astype(str)
+    metNames = metTable.index[keepY].astype(str)
+
+    if blockSize:
+        topEdges = tiledCorrelation(
+            x,
+            y,
+            geneNames,
+            metNames,
+            meth,
+            thres,
+            corrMatPath,
+            outputPath,
+            blockSize,
+            seed=seed,
+            pvalue=pvalue,
+            jobs=jobs,
+        )
+        if figurePath:
+            plotCorrelationNetwork(topEdges, figurePath)
+        return
+
+    corr = correlationMatrix(x, y, meth)
+    if pvalue == "analytic":
+        pvalues = analyticPvalues(corr, x.shape[0], meth)
+    else:
+        pvalues = permutationPvalues(x, y, corr, meth, N=1000, seed=seed, jobs=jobs)
+    edges = correlationEdges(corr, pvalues, geneNames, metNames, thres)
+
+    # Same format as write.table in R
+    pd.DataFrame(corr, index=geneNames, columns=metNames).to_csv(
+        corrMatPath,
+        sep="\t",
+        index_label="",
+        float_format="%.15g",
+        na_rep="NA",
+        quoting=csv.QUOTE_NONE,
+        escapechar="\\",
+    )
+    with open(outputPath, "w") as output:
+        output.write("\t".join(edges.columns) + "\n")
+        edges.to_csv(
+            output,
+            sep="\t",
+            header=False,
+            index=False,
+            float_format="%.15g",
+            na_rep="NA",
+            quoting=csv.QUOTE_NONE,
+            escapechar="\\",
+        )
+
+    if figurePath:
+        plotCorrelationNetwork(edges, figurePath)
+
+
+# Edges of a block of tiledCorrelation, the first three fields sort them as return_result in R
+CORRELATION_EDGE = np.dtype(
+    [
+        ("strength", "f8"),
+        ("metabolite", "i8"),
+        ("gene", "i8"),
+        ("correlation", "f8"),
+        ("pvalue", "f8"),
+    ]
+)
+
+
+def tiledCorrelation(
+    x,
+    y,
+    geneNames,
+    metNames,
+    meth,
+    thres,
+    corrMatPath,
+    outputPath,
+    blockSize,
+    seed=None,
+    pvalue="permutation",
+    topEdges=500,
+    jobs=1,
+):
+    """
+    Correlation analysis between genes and metabolites in blocks of genes, keeping only a block of
+    the correlation and PValue matrices in memory:
+    1) The correlation matrix is written into a memory-mapped NumPy binary file (.npy, read it with
+    numpy.load(corrMatPath, mmap_mode="r")), with the gene and metabolite names, one per line, in
+    corrMatPath + ".genes.txt" and corrMatPath + ".metabolites.txt".
+    2) The correlations with a PValue smaller or equal than the threshold of each block are sorted
+    into a temporary file, and the sorted blocks are merged into the output table, with the same
+    format and order as correlationEdges.
 
     Arguments:
-        :params deaGeneDataset deaMetDataset: Tables with Differential Expression Analysis
-        information for gene expression and metabolomics, respectively
-        :types deaGeneDataset met_dataset: files
+        :param x: Matrix with samples in rows and genes in columns.
+        :type x: numpy array
 
-        :params gene_id_col, met_id_col, gene_flag_col, met_flag_col: Column names of unique
-        identifiers and desired flag column of gene expression and metabolomics datasets,
-        respectively
-        :type gene_id_col, met_id_col, gene_flag_col, met_flag_col: strings
+        :param y: Matrix with samples in rows and metabolites in columns.
+        :type y: numpy array
 
-        :params alpha, method: alpha-value and method desired for the FDR correction
-        :type alpha, method: strings
+        :param geneNames metNames: Names of the columns of x and y.
+        :type geneNames metNames: lists
 
-    Returns:
-        :return output: Table with this structure: Pathway Name Odds_Ratio	P_value	FDR_Correction
-        Flag_#
-        :rtype output: file
-    """
-
-    # N_gene = sum(1 for line in open(args.deaGeneDataset)) - 1
-    # N_met = sum(1 for line in open(args.deaMetDataset)) - 1
-    # N = N_gene + N_met
-    # a+b, c+d)
-    metDeCounter = 0
-    metNonDeCounter = 0
-    with open(args.deaGeneDataset, "r") as geneDataset:
-        header_gene = geneDataset.readline().split("\t")
-        indice_gene_flag = header_gene.index(args.gene_flag_col)
-        for line in geneDataset:
-            flag = int(line.split("\t")[indice_gene_flag])
-            if flag == 1:
-                metDeCounter += 1
-            elif flag == 0:
-                metNonDeCounter += 1
-
-    geneDeCounter = 0
-    geneNonDeCounter = 0
-    with open(args.deaMetDataset, "r") as metDataset:
-        header_met = metDataset.readline().split("\t")
-        indice_met_flag = header_met.index(args.met_flag_col)
-        for line in metDataset:
-            flag = int(line.split("\t")[indice_met_flag])
-            if flag == 1:
-                geneDeCounter += 1
-            elif flag == 0:
-                geneNonDeCounter += 1
+        :param meth: Methodology for the correlation. One of 'pearson', 'spearman' or 'kendall'.
+        :type meth: string
 
-    a_b = metDeCounter + geneDeCounter
-    c_d = metNonDeCounter + geneNonDeCounter
+        :param thres: PValue threshold to cut the correlations for the output table.
+        :type thres: float
 
-    # a)
-    geneDataset = open(args.deaGeneDataset, "r")
-    metDataset = open(args.deaMetDataset, "r")
-    PEAList = []
-    pvalues = []
-    indice_gene_id = header_gene.index(args.gene_id_col)
-    indice_met_id = header_met.index(args.met_id_col)
+        :param corrMatPath: Full path for the Correlation Matrix output
+        :type corrMatPath: string
 
-    for pathway in path_feat.keys():
-        a_gen = 0
-        a_met = 0
-        a_c = 0
+        :param outputPath: Full path for the Output table
+        :type outputPath: string
 
-        for value in path_feat[pathway]:
-            geneDataset.seek(0)
-            geneDataset.readline()
-            for line in geneDataset:
-                gene = line.split("\t")[indice_gene_id].replace('"', "")
-                if value == gene:
-                    a_gen += int(line.split("\t")[indice_gene_flag])
-                    a_c += 1
-                    break
-            metDataset.seek(0)
-            metDataset.readline()
-            for line_v2 in metDataset:
-                metabolite = line_v2.split("\t")[indice_met_id].replace('"', "")
-                if value == metabolite:
-                    a_met += int(line_v2.split("\t")[indice_met_flag])
-                    a_c += 1
-                    break
-
-        a = a_gen + a_met
-
-        # b), c), d)
-        b = a_b - (a_gen + a_met)
-        c = a_c - (a_gen + a_met)
-        d = c_d - (a_c - (a_gen + a_met))
-
-        oddsratio, pvalue = st.fisher_exact([[a, b], [c, d]])
-        pvalues.append(pvalue)
-
-        PEAList.append(pathway + "\t" + str(oddsratio) + "\t" + str(pvalue))
-
-    geneDataset.close()
-    metDataset.close()
+        :param blockSize: Number of genes per block.
+        :type blockSize: int
 
-    return PEAList
+        :param seed: Seed of the simulated datasets, each block gets its own stream.
+        :type seed: int
 
+        :param pvalue: PValues from 'permutation' or 'analytic' (see allByAllCorrelation).
+        :type pvalue: string
 
-##########################
-# All vs All Correlation #
-##########################
+        :param topEdges: Number of strongest correlations returned.
+        :type topEdges: int
 
+        :param jobs: Number of processes for the simulated datasets.
+        :type jobs: int
 
-def Ids2Names(dataset, Id, annot, annotName):
+    Returns:
+        :return edges: The topEdges first rows of the output table (for plotCorrelationNetwork).
+        :rtype edges: pandas.DataFrame
     """
-    Change unique identifiers to feature names. It could be used for genes or for metabolites.
 
-    Arguments:
-        :param dataset: Wide dataset (Gene Expression/Metabolomics)
-        :type dataset: pandas dataframe
+    geneNames = list(geneNames)
+    metNames = list(metNames)
+    with open(corrMatPath + ".genes.txt", "w") as names:
+        names.writelines(name + "\n" for name in geneNames)
+    with open(corrMatPath + ".metabolites.txt", "w") as names:
+        names.writelines(name + "\n" for name in metNames)
 
-        :param Id: Name of the column with Unique Identifiers.
-        :type Id: string
+    corrMat = np.lib.format.open_memmap(
+        corrMatPath, mode="w+", dtype=np.float64, shape=(x.shape[1], y.shape[1])
+    )
+    starts = range(0, x.shape[1], blockSize)
+    blockSeeds = np.random.SeedSequence(seed).spawn(len(starts))
 
-        :param annot: Annotation File (For Gene Expression/Metabolomics). This file must contain at
-        least 2 columns.
-        :type annot: file
+    # A single pool of processes for the simulated datasets of all the blocks
+    if pvalue != "analytic" and jobs > 1:
+        poolContext = permutationPool(x, y, meth, jobs)
+    else:
+        poolContext = contextlib.nullcontext()
+    with poolContext as pool, tempfile.TemporaryDirectory() as runDir:
+        runs = []
+        for start, blockSeed in zip(starts, blockSeeds):
+            genes = slice(start, start + blockSize)
+            corr = correlationMatrix(x[:, genes], y, meth)
+            corrMat[genes] = corr
+            if pvalue == "analytic":
+                pvalues = analyticPvalues(corr, x.shape[0], meth)
+            else:
+                pvalues = permutationPvalues(
+                    x, y, corr, meth, N=1000, seed=blockSeed, pool=pool, genes=genes
+                )
 
-        :param annotName: Name of the column of the Annotation File that contains the Feature Name
-        (Genes/Metabolites)
-        :type annotName: file
+            geneIndex, metIndex = np.nonzero(pvalues <= thres)
+            run = np.empty(len(geneIndex), dtype=CORRELATION_EDGE)
+            run["correlation"] = corr[geneIndex, metIndex]
+            run["strength"] = -np.abs(run["correlation"])
+            run["metabolite"] = metIndex
+            run["gene"] = geneIndex + start
+            run["pvalue"] = pvalues[geneIndex, metIndex]
+            run.sort(order=["strength", "metabolite", "gene"])
+            runs.append(os.path.join(runDir, "{0}.npy".format(len(runs))))
+            np.save(runs[-1], run)
+        corrMat.flush()
+        del corrMat
+
+        top = []
+        with open(outputPath, "w") as output:
+            output.write('"gene"\t"metabolite"\t"correlation"\t"p-value"\n')
+            for strength, met, gene, correlation, pval in heapq.merge(
+                *[iterEdgeRun(np.load(run, mmap_mode="r")) for run in runs]
+            ):
+                output.write(
+                    "{0}\t{1}\t{2:.15g}\t{3:.15g}\n".format(
+                        geneNames[gene], metNames[met], correlation, pval
+                    )
+                )
+                if len(top) < topEdges:
+                    top.append((geneNames[gene], metNames[met], correlation, pval))
 
-    Returns:
-        :return new_dataset: Wide dataset with feature names (genes/metabolites) instead of unique
-        identifiers
-        :rtype new_dataset: pandas dataset
+    return pd.DataFrame(top, columns=['"gene"', '"metabolite"', '"correlation"', '"p-value"'])
+
+
+def iterEdgeRun(run, chunkSize=65536):
     """
+    Iterate the edges of a sorted block of tiledCorrelation as tuples, a chunk at a time.
 
-    annotTable = pd.read_table(annot, sep="\t", header=0)
-    if "Selected" in annotTable.columns:
-        annotTable = annotTable[annotTable["Selected"] == "Yes"]
-        annotTable = annotTable.drop_duplicates(subset=Id, keep="first")
+    Arguments:
+        :param run: Edges of a block (CORRELATION_EDGE).
+        :type run: numpy array
 
-    for index, row in dataset.iterrows():
-        ID = str(row[Id])
-        name = str(annotTable.loc[annotTable[Id] == ID, annotName].item())
-        dataset.loc[index, Id] = ID + ": " + name
+        :param chunkSize: Number of edges converted at a time.
+        :type chunkSize: int
 
-    new_dataset = dataset.rename(columns={Id: annotName})
-    new_dataset = new_dataset.set_index(annotName)
+    Returns:
+        :return edges: (strength, metabolite, gene, correlation, pvalue) tuples.
+        :rtype edges: generator
+    """
 
-    return new_dataset
+    for start in range(0, len(run), chunkSize):
+        yield from run[start:start + chunkSize].tolist()
 
 
 ########
@@ -1044,6 +3514,9 @@ def prepareSPLSData(args):
         datasets, respectively.
         :type geneOption metOption: string
     """
+    from rpy2 import robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
 
     args.geneDataset = pd.read_table(args.geneDataset, sep="\t", header=0)
     metTable = pd.read_table(args.metDataset, sep="\t", header=0)
@@ -1320,6 +3793,9 @@ def prepareSPLSGeneAllData(args):
         :return R_gene_df: Wide dataset (annotated or not) in R format.
         :rtype R_gene_df: R object
     """
+    from rpy2 import robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
 
     geneTable = args.geneDataset
 
@@ -1359,6 +3835,9 @@ def prepareSPLSGeneListData(args):
         :return R_gene_df: Wide dataset (annotated or not) in R format.
         :rtype R_gene_df: R object
     """
+    from rpy2 import robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
 
     with open(args.geneList) as geneListFile:
         geneList = geneListFile.read().splitlines()
@@ -1406,6 +3885,9 @@ def prepareSPLSGenePathData(args, uniqueIDs):
         :return R_gene_df: Wide dataset (annotated or not) in R format.
         :rtype R_gene_df: R object
     """
+    from rpy2 import robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
 
     geneKeggPath = pd.read_table(args.geneKeggPath, header=0, sep="\t")
     metKeggPath = pd.read_table(args.metKeggPath, header=0, sep="\t")
@@ -1467,10 +3949,18 @@ def prepareSPLSGenePanaData(args):
         :param path2genes: Downloaded file form KEGG with this information: path_id "\t" gene_id
         :type path2genes: file
 
+        :param keggDb: KEGG database (see buildKeggDb), used instead of path2genes and path2names.
+        :type keggDb: file
+
     Returns:
         :return R_gene_df: Wide dataset (annotated or not) in R format.
         :rtype R_gene_df: R object
     """
+    from rpy2 import robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
+    from rpy2.robjects.packages import SignatureTranslatedAnonymousPackage as STAP
+
     pandas2ri.activate()
 
     with ires.path("gaitGM.data", "PCA2GO.2.R") as my_r_script_path:
@@ -1495,9 +3985,17 @@ def prepareSPLSGenePanaData(args):
         R_input_file = robjects.conversion.py2rpy(input_file)
 
     # Prepare genes2pathway
-    pathway2genes = pd.read_table(
-        args.path2genes, sep="\t", header=None, names=["pathId", "geneId"]
-    )
+    if args.keggDb:
+        keggDb = openKeggDb(args.keggDb)
+        pathway2genes = pd.read_sql_query(
+            "SELECT pathway_id AS pathId, kegg_id AS geneId FROM links "
+            "WHERE feature_type = 'Gene' ORDER BY rowid",
+            keggDb,
+        )
+    else:
+        pathway2genes = pd.read_table(
+            args.path2genes, sep="\t", header=None, names=["pathId", "geneId"]
+        )
     genes2pathway = pathway2genes[["geneId", "pathId"]]
     # convert to R dataframe
     with localconverter(robjects.default_converter + pandas2ri.converter):
@@ -1514,13 +4012,20 @@ def prepareSPLSGenePanaData(args):
         panaOutputTable = robjects.conversion.rpy2py(panaOutput[1])
 
     # Add Annotation
-    if args.path2names:
+    if args.path2names or args.keggDb:
         with localconverter(robjects.default_converter + pandas2ri.converter):
             gene_df = robjects.conversion.rpy2py(panaOutput[0])
         gene_df.set_index("metagene_name", inplace=True)
-        path2name = pd.read_table(
-            args.path2names, sep="\t", names=["pathId", "pathName"]
-        )
+        if args.keggDb:
+            path2name = pd.read_sql_query(
+                "SELECT pathway_id AS pathId, name AS pathName FROM pathways ORDER BY rowid",
+                keggDb,
+            )
+            keggDb.close()
+        else:
+            path2name = pd.read_table(
+                args.path2names, sep="\t", names=["pathId", "pathName"]
+            )
         path2nameDict = pd.Series(
             path2name.pathName.values, index=path2name.pathId
         ).to_dict()
@@ -9,10 +9,12 @@
 # VERSION: 1.0
 #######################################################################################
 import os
+import logging
 import argparse
 from argparse import RawDescriptionHelpFormatter
 import pandas as pd
 import gaitGM.keggPeaModules as modules
+from secimtools.dataManager import logger as sl
 
 
 def getOptions():
@@ -79,6 +81,76 @@ def getOptions():
         required=False,
         help="Name of the column with metabolite names.",
     )
+    tool.add_argument(
+        "-cd",
+        "--cacheDir",
+        dest="cacheDir",
+        action="store",
+        required=False,
+        default=None,
+        help="Directory to cache KEGG downloads (default: $GAITGM_KEGG_CACHE or "
+        "~/.cache/gaitGM/kegg).",
+    )
+    tool.add_argument(
+        "-kdb",
+        "--keggDb",
+        dest="keggDb",
+        action="store",
+        required=False,
+        default=None,
+        help="KEGG database from build_kegg_db.py, used instead of downloading from KEGG.",
+    )
+    tool.add_argument(
+        "-fs",
+        "--fastSimilarity",
+        dest="fastSimilarity",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Score name similarity with the faster Indel ratio instead of difflib. "
+        "Similarities and tie breaks may differ slightly from the default.",
+    )
+    tool.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        required=False,
+        default=1,
+        help="Number of processes to annotate the features with (Default: 1).",
+    )
+    tool.add_argument(
+        "-mc",
+        "--matchCache",
+        dest="matchCache",
+        action="store",
+        required=False,
+        default=None,
+        help="Match cache file to reuse the KEGG matches of names annotated in previous runs.",
+    )
+    tool.add_argument(
+        "-pr",
+        "--previous",
+        dest="previous",
+        action="store",
+        nargs="+",
+        required=False,
+        default=None,
+        help="Outputs of a previous run (gene and/or metabolite). Their rows are reused for the "
+        "features with the same unique ID and name, only new or renamed features are matched.",
+    )
+    tool.add_argument(
+        "-ef",
+        "--exactFirst",
+        dest="exactFirst",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Match gene names to the KEGG symbols equal to them (case insensitive) and search "
+        "only the other names in all the KEGG symbols. Partial matches of the exactly matched "
+        "names are not reported.",
+    )
 
     # Tool Output
     output = parser.add_argument_group(description="Output")
@@ -108,11 +180,29 @@ def getOptions():
     if args.metAnnot:
         args.metAnnot = os.path.abspath(args.metAnnot)
         args.metOut = os.path.abspath(args.metOut)
+    if args.keggDb:
+        args.keggDb = os.path.abspath(args.keggDb)
+    if args.matchCache:
+        args.matchCache = os.path.abspath(args.matchCache)
+    if args.previous:
+        args.previous = [os.path.abspath(previous) for previous in args.previous]
 
     return args
 
 
-def main(annotFile, uniqId, featureNames, parser, outputFile, featureType):
+def main(
+    annotFile,
+    uniqId,
+    featureNames,
+    parser,
+    outputFile,
+    featureType,
+    difflibCompatible=True,
+    jobs=1,
+    matchCache=None,
+    previous=None,
+    exactFirst=False,
+):
 
     """
     Analyze input genes or metabolites finding the corresponding name and its identifier in KEGG.
@@ -137,6 +227,22 @@ def main(annotFile, uniqId, featureNames, parser, outputFile, featureType):
 
         :param featureType: Specification of the feature to analyze, one of: 'Gene' or "Metabolite'
         :type featureType: string
+
+        :param difflibCompatible: Score names with difflib.SequenceMatcher instead of the faster
+        Indel similarity.
+        :type difflibCompatible: boolean
+
+        :param jobs: Number of processes to annotate the features with.
+        :type jobs: int
+
+        :param matchCache: Match cache file to reuse matches from previous runs.
+        :type matchCache: string
+
+        :param previous: Previous output rows of each feature (see modules.loadPreviousAnno).
+        :type previous: dictionary
+
+        :param exactFirst: Search only the gene names without an exact KEGG symbol.
+        :type exactFirst: boolean
     """
 
     output = open(outputFile, "w")
@@ -147,24 +253,52 @@ def main(annotFile, uniqId, featureNames, parser, outputFile, featureType):
         "\tFeature_Type\tMatched\tName_in_KEGG\tKEGG_ID\tSimilarity\tTie\tSelected\n"
     )
 
-    annotFile = pd.read_table(annotFile, delimiter="\t", header=0)
+    # Only the columns used, the annotation is kept while annotating
+    annotFile = pd.read_table(
+        annotFile,
+        delimiter="\t",
+        header=0,
+        usecols=lambda column: column in (uniqId, featureNames, "Selected"),
+    )
     if "Selected" in annotFile.columns:
         annotFile = annotFile.loc[annotFile["Selected"] != "No"]
 
     annotFile = annotFile[[uniqId, featureNames]]
 
     # Output file -> UniqueID Feature_Name Matched Name_In_Kegg KEGG_ID Similarity Tie Selected
-    modules.keggAnno(annotFile, parser, output, uniqId, featureNames, featureType)
+    modules.keggAnno(
+        annotFile,
+        parser,
+        output,
+        uniqId,
+        featureNames,
+        featureType,
+        difflibCompatible,
+        jobs,
+        matchCache,
+        previous,
+        exactFirst,
+    )
 
     output.close()
 
 
 if __name__ == "__main__":
     args = getOptions()
+    logger = logging.getLogger()
+    sl.setLogger(logger)
+    if args.keggDb:
+        keggDb = modules.openKeggDb(args.keggDb, args.species)
+    previous = None
+    if args.previous:
+        previous = modules.loadPreviousAnno(args.previous)
 
     if args.geneAnnot:
         modules.checkForDuplicates(args.geneAnnot, args.geneUniqId)
-        gene2keggs = modules.downloadGeneParser(args.species)
+        if args.keggDb:
+            gene2keggs = modules.loadKeggDbList(keggDb, "Gene")
+        else:
+            gene2keggs = modules.downloadGeneParser(args.species, args.cacheDir)
         main(
             args.geneAnnot,
             args.geneUniqId,
@@ -172,10 +306,18 @@ if __name__ == "__main__":
             gene2keggs,
             args.geneOut,
             featureType="Gene",
+            difflibCompatible=not args.fastSimilarity,
+            jobs=args.jobs,
+            matchCache=args.matchCache,
+            previous=previous,
+            exactFirst=args.exactFirst,
         )
     if args.metAnnot:
         modules.checkForDuplicates(args.metAnnot, args.metUniqId)
-        met2keggs = modules.downloadMetParser()
+        if args.keggDb:
+            met2keggs = modules.loadKeggDbList(keggDb, "Metabolite")
+        else:
+            met2keggs = modules.downloadMetParser(args.cacheDir)
         main(
             args.metAnnot,
             args.metUniqId,
@@ -183,4 +325,9 @@ if __name__ == "__main__":
             met2keggs,
             args.metOut,
             featureType="Metabolite",
+            difflibCompatible=not args.fastSimilarity,
+            jobs=args.jobs,
+            matchCache=args.matchCache,
+            previous=previous,
+            exactFirst=args.exactFirst,
         )
@@ -92,6 +92,25 @@ def getOptions():
         required=False,
         help="Name of the column with Metabolite KEGG Identifiers.",
     )
+    tool.add_argument(
+        "-cd",
+        "--cacheDir",
+        dest="cacheDir",
+        action="store",
+        required=False,
+        default=None,
+        help="Directory to cache KEGG downloads (default: $GAITGM_KEGG_CACHE or "
+        "~/.cache/gaitGM/kegg).",
+    )
+    tool.add_argument(
+        "-kdb",
+        "--keggDb",
+        dest="keggDb",
+        action="store",
+        required=False,
+        default=None,
+        help="KEGG database from build_kegg_db.py, used instead of downloading from KEGG.",
+    )
 
     output = parser.add_argument_group(description="Output")
     output.add_argument(
@@ -148,6 +167,8 @@ def getOptions():
         args.metOut = os.path.abspath(args.metOut)
 
     args.pathways = os.path.abspath(args.pathways)
+    if args.keggDb:
+        args.keggDb = os.path.abspath(args.keggDb)
 
     return args
 
@@ -188,10 +209,15 @@ def main():
         :rtypes pathways: file
     """
     args = getOptions()
-    modules.downloadKeggInfo(args)
+    if args.keggDb:
+        keggDb = modules.openKeggDb(args.keggDb, args.species)
+        modules.exportKeggDbInfo(args, keggDb)
+    else:
+        keggDb = None
+        modules.downloadKeggInfo(args)
     # Add KEGG Pathway Info for genes
     if args.geneKeggAnnot:
-        geneDict, geneList = modules.keggAnnot2list(
+        geneFeatures, geneList = modules.keggAnnot2list(
             args.geneKeggAnnot,
             args.geneUniqId,
             args.geneName,
@@ -199,18 +225,19 @@ def main():
             featureType="Gene",
         )
         modules.add_path_info(
-            geneDict,
+            geneFeatures,
             geneList,
             "Gene",
             args.kgen2pathways,
             args.pathways,
             args.species,
             args.geneOut,
+            keggDb,
         )
 
     # Add KEGG Pathway Info for Metabolites
     if args.metKeggAnnot:
-        metDict, metList = modules.keggAnnot2list(
+        metFeatures, metList = modules.keggAnnot2list(
             args.metKeggAnnot,
             args.metUniqId,
             args.metName,
@@ -218,13 +245,14 @@ def main():
             featureType="Metabolite",
         )
         modules.add_path_info(
-            metDict,
+            metFeatures,
             metList,
             "Metabolite",
             args.kmet2pathways,
             args.pathways,
             args.species,
             args.metOut,
+            keggDb,
         )
 
 
@@ -12,9 +12,6 @@ import argparse
 from argparse import RawDescriptionHelpFormatter
 import matplotlib
 import pandas as pd
-from rpy2.robjects import pandas2ri
-from rpy2.rinterface import RRuntimeWarning
-from rpy2.robjects.packages import SignatureTranslatedAnonymousPackage as STAP
 import gaitGM.keggPeaModules as modules
 from secimtools.dataManager import logger as sl
 from importlib import resources as ires
@@ -106,6 +103,64 @@ def getOptions():
         required=True,
         help="Pvalue threshold for the output.",
     )
+    tool.add_argument(
+        "-en",
+        "--engine",
+        dest="engine",
+        action="store",
+        required=False,
+        default=None,
+        choices=("R", "numpy"),
+        help="Compute the correlations with 'R' or 'numpy' (Default: R, or numpy with "
+        "-bs/--blockSize). The numpy engine only loads R to draw the optional figure (-f/--fig).",
+    )
+    tool.add_argument(
+        "-pv",
+        "--pvalue",
+        dest="pvalue",
+        action="store",
+        required=False,
+        default="permutation",
+        choices=("permutation", "analytic"),
+        help="Compute the Pvalues from 1000 simulated datasets ('permutation', default) or from "
+        "the distribution of the correlation coefficient ('analytic': t distribution for pearson "
+        "and spearman, normal approximation for kendall).",
+    )
+    tool.add_argument(
+        "-bs",
+        "--blockSize",
+        dest="blockSize",
+        type=int,
+        action="store",
+        required=False,
+        default=None,
+        help="Compute the correlations in blocks of this number of genes, with the numpy engine "
+        "(the R engine keeps the whole matrices in memory). The correlation matrix -c/--corMat "
+        "must then be named <name>.npy: it is written as a binary NumPy file with the gene and "
+        "metabolite names in <corMat>.genes.txt and <corMat>.metabolites.txt.",
+    )
+    tool.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        required=False,
+        default=1,
+        help="Number of processes for the simulated datasets of the permutation Pvalues "
+        "(Default: 1).",
+    )
+    tool.add_argument(
+        "-sd",
+        "--seed",
+        dest="seed",
+        type=int,
+        action="store",
+        required=False,
+        default=None,
+        help="Seed of the simulated datasets. The Pvalues are the same for a seed with any number "
+        "of processes, but differ between the R and numpy engines.",
+    )
     output = parser.add_argument_group(description="Output")
     output.add_argument(
         "-o",
@@ -128,17 +183,30 @@ def getOptions():
         "--fig",
         dest="fig",
         action="store",
-        required=True,
-        help="Output figure name for results [pdf].",
+        required=False,
+        default=None,
+        help="Output figure name for results [pdf]. Required with the R engine.",
     )
 
     args = parser.parse_args()
+    if args.blockSize and args.engine == "R":
+        parser.error("-bs/--blockSize requires the numpy engine (-en/--engine=numpy)")
+    if args.engine is None:
+        args.engine = "numpy" if args.blockSize else "R"
+    if args.blockSize and not args.corMat.endswith(".npy"):
+        parser.error(
+            "with -bs/--blockSize the correlation matrix (-c/--corMat) is a binary NumPy file, "
+            "its name must end with .npy"
+        )
+    if args.engine == "R" and not args.fig:
+        parser.error("the R engine requires an output figure (-f/--fig)")
 
     args.geneDataset = os.path.abspath(args.geneDataset)
     args.metDataset = os.path.abspath(args.metDataset)
     args.output = os.path.abspath(args.output)
     args.corMat = os.path.abspath(args.corMat)
-    args.fig = os.path.abspath(args.fig)
+    if args.fig:
+        args.fig = os.path.abspath(args.fig)
 
     if args.geneAnnot:
         args.geneAnnot = os.path.abspath(args.geneAnnot)
@@ -181,20 +249,34 @@ def main():
         :param thres: PValue Threshold to cut the correlations for the output table.
         :type thres: float
 
+        :param engine: Compute the correlations with 'R' or 'numpy'.
+        :type engine: string
+
+        :param pvalue: Compute the PValues with 'permutation' or 'analytic'.
+        :type pvalue: string
+
+        :param blockSize: Number of genes per block (numpy engine only).
+        :type blockSize: int
+
+        :param jobs: Number of processes for the simulated datasets.
+        :type jobs: int
+
+        :param seed: Seed of the simulated datasets.
+        :type seed: int
+
     Returns:
         :return output: Output table with the following information: Metabolite "\t" Gene "\t"
         Correlation "\t" pvalue
 
         :rtype output: file
 
-        :return corMat: Correlation Matrix
+        :return corMat: Correlation Matrix (NumPy binary file named <name>.npy with blockSize)
         :rtype corMat: file
 
         :return fig: Network-like output figure
         :rtype fig: pdf
     """
 
-    warnings.filterwarnings("ignore", category=RRuntimeWarning)
     args = getOptions()
     logger = logging.getLogger()
     sl.setLogger(logger)
@@ -205,41 +287,62 @@ def main():
         "\n\tMet Dataset:{}"
         "\n\tMet UniqueID:  {}"
         "\n\tMethod:  {}"
-        "\n\tThreshold:  {}".format(
+        "\n\tThreshold:  {}"
+        "\n\tEngine:  {}".format(
             args.geneDataset,
             args.geneId,
             args.metDataset,
             args.metId,
             args.meth,
             args.thres,
+            args.engine,
         )
     )
 
     modules.checkForDuplicates(args.geneDataset, args.geneId)
     modules.checkForDuplicates(args.metDataset, args.metId)
-    pandas2ri.activate()
-    with ires.path("gaitGM.data", "all_by_all_correlation.R") as my_r_script_path:
-        f = open(my_r_script_path, "r")
-        rFile = f.read()
-    allByAllCorrScript = STAP(rFile, "corr_main_func")
     # Prepare Gene Expression Data
     geneTable = pd.read_table(args.geneDataset, sep="\t", header=0)
     if args.geneAnnot:
-        R_gene_df = modules.Ids2Names(
-            geneTable, args.geneId, args.geneAnnot, args.geneName
-        )
+        geneTable = modules.Ids2Names(geneTable, args.geneId, args.geneAnnot, args.geneName)
     else:
-
         geneTable = geneTable.set_index(args.geneId)
-        R_gene_df = pandas2ri.py2rpy(geneTable)
 
     # Prepare Metabolomics Data
     metTable = pd.read_table(args.metDataset, sep="\t", header=0)
     if args.metAnnot:
-        R_met_df = modules.Ids2Names(metTable, args.metId, args.metAnnot, args.metName)
+        metTable = modules.Ids2Names(metTable, args.metId, args.metAnnot, args.metName)
     else:
         metTable = metTable.set_index(args.metId)
-        R_met_df = pandas2ri.py2rpy(metTable)
+
+    if args.engine == "numpy":
+        modules.allByAllCorrelation(
+            geneTable,
+            metTable,
+            meth=args.meth,
+            thres=float(args.thres),
+            corrMatPath=args.corMat,
+            outputPath=args.output,
+            figurePath=args.fig,
+            pvalue=args.pvalue,
+            blockSize=args.blockSize,
+            jobs=args.jobs,
+            seed=args.seed,
+        )
+        return
+
+    from rpy2.robjects import NULL, pandas2ri
+    from rpy2.rinterface import RRuntimeWarning
+    from rpy2.robjects.packages import SignatureTranslatedAnonymousPackage as STAP
+
+    warnings.filterwarnings("ignore", category=RRuntimeWarning)
+    pandas2ri.activate()
+    with ires.path("gaitGM.data", "all_by_all_correlation.R") as my_r_script_path:
+        f = open(my_r_script_path, "r")
+        rFile = f.read()
+    allByAllCorrScript = STAP(rFile, "corr_main_func")
+    R_gene_df = pandas2ri.py2rpy(geneTable)
+    R_met_df = pandas2ri.py2rpy(metTable)
 
     allByAllCorrScript.corr_main_func(
         x=R_gene_df,
@@ -249,6 +352,9 @@ def main():
         corrMatPath=args.corMat,
         outputPath=args.output,
         figurePath=args.fig,
+        pvalue=args.pvalue,
+        jobs=args.jobs,
+        seed=args.seed if args.seed is not None else NULL,
     )
 
 
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+######################################################################################
+# AUTHOR: Oleksandr Moskalenko <om@rc.ufl.edu>
+# DESCRIPTION: Download the KEGG information of the selected species once and store it in an
+# indexed SQLite database that add_kegg_anno_info.py, add_kegg_pathway_info.py and sPLS.py can
+# use instead of downloading from KEGG.
+#######################################################################################
+
+import os
+import logging
+import argparse
+from argparse import RawDescriptionHelpFormatter
+import gaitGM.keggPeaModules as modules
+from secimtools.dataManager import logger as sl
+
+
+def getOptions():
+    parser = argparse.ArgumentParser(
+        description="Build KEGG DB", formatter_class=RawDescriptionHelpFormatter
+    )
+    tool = parser.add_argument_group(title="Tool Specific Inputs")
+    tool.add_argument(
+        "-s",
+        "--species",
+        dest="species",
+        action="store",
+        required=True,
+        help="Species to download.",
+    )
+    tool.add_argument(
+        "-cd",
+        "--cacheDir",
+        dest="cacheDir",
+        action="store",
+        required=False,
+        default=None,
+        help="Directory to cache KEGG downloads (default: $GAITGM_KEGG_CACHE or "
+        "~/.cache/gaitGM/kegg).",
+    )
+    output = parser.add_argument_group(description="Output")
+    output.add_argument(
+        "-kdb",
+        "--keggDb",
+        dest="keggDb",
+        action="store",
+        required=True,
+        help="KEGG database file name.",
+    )
+    args = parser.parse_args()
+
+    args.keggDb = os.path.abspath(args.keggDb)
+
+    return args
+
+
+def main():
+    """
+    Build a KEGG SQLite database with the gene list of a species, the compound list, the
+    gene/compound to pathway links and the pathway names.
+
+    Arguments:
+        :param species: species identifier in kegg to download
+        :type species: string
+
+        :param cacheDir: Directory to cache KEGG downloads (optional)
+        :type cacheDir: string
+
+    Returns:
+        :return keggDb: KEGG SQLite database
+        :rtype keggDb: file
+    """
+    args = getOptions()
+    logger = logging.getLogger()
+    sl.setLogger(logger)
+    logger.info(
+        u"""Importing data with following parameters: \
+        \n\tSpecies: {0}\
+        \n\tKEGG DB: {1}""".format(
+            args.species, args.keggDb
+        )
+    )
+
+    modules.buildKeggDb(args.keggDb, args.species, args.cacheDir)
+    logger.info("KEGG database written to " + args.keggDb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+######################################################################################
+# AUTHOR: Oleksandr Moskalenko <om@rc.ufl.edu>
+# DESCRIPTION: Pathway enrichment analysis (one-sided Fisher exact test with Benjamini-Hochberg
+# FDR) of the flagged genes and metabolites of a Differential Expression Analysis, using the
+# pathways of add_kegg_pathway_info.py.
+#######################################################################################
+
+import os
+import logging
+import argparse
+from argparse import RawDescriptionHelpFormatter
+import gaitGM.keggPeaModules as modules
+from secimtools.dataManager import logger as sl
+
+
+def getOptions():
+    parser = argparse.ArgumentParser(
+        description="Pathway Enrichment", formatter_class=RawDescriptionHelpFormatter
+    )
+    tool = parser.add_argument_group(description="Tool Input")
+    tool.add_argument(
+        "-gd",
+        "--geneDataset",
+        dest="deaGeneDataset",
+        action="store",
+        required=True,
+        help="Gene Expression flags (e.g. add_pval_flags.py flags output).",
+    )
+    tool.add_argument(
+        "-gid",
+        "--geneId",
+        dest="gene_id_col",
+        action="store",
+        required=True,
+        help="Name of the column with the gene unique identifiers.",
+    )
+    tool.add_argument(
+        "-md",
+        "--metDataset",
+        dest="deaMetDataset",
+        action="store",
+        required=True,
+        help="Metabolomics flags (e.g. add_pval_flags.py flags output).",
+    )
+    tool.add_argument(
+        "-mid",
+        "--metId",
+        dest="met_id_col",
+        action="store",
+        required=True,
+        help="Name of the column with the metabolite unique identifiers.",
+    )
+    tool.add_argument(
+        "-gp",
+        "--genePathways",
+        dest="genePathways",
+        action="store",
+        required=True,
+        help="Gene pathways (add_kegg_pathway_info.py gene output).",
+    )
+    tool.add_argument(
+        "-mp",
+        "--metPathways",
+        dest="metPathways",
+        action="store",
+        required=True,
+        help="Metabolite pathways (add_kegg_pathway_info.py metabolite output).",
+    )
+    tool.add_argument(
+        "-fl",
+        "--flags",
+        dest="flags",
+        action="store",
+        required=False,
+        default=None,
+        help="Comma separated flag columns, present in both datasets, tested at once (Default: "
+        "all the Flag_ columns of the gene dataset).",
+    )
+    tool.add_argument(
+        "-gf",
+        "--geneFlag",
+        dest="gene_flag_col",
+        action="store",
+        required=False,
+        default=None,
+        help="Single gene flag column, tested with the metabolite flag column -mf/--metFlag.",
+    )
+    tool.add_argument(
+        "-mf",
+        "--metFlag",
+        dest="met_flag_col",
+        action="store",
+        required=False,
+        default=None,
+        help="Single metabolite flag column, tested with the gene flag column -gf/--geneFlag.",
+    )
+    output = parser.add_argument_group(description="Output")
+    output.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        action="store",
+        required=True,
+        help="Output table: Pathway_ID Pathway_Name Flag Odds_Ratio P_value FDR_BH.",
+    )
+    args = parser.parse_args()
+    if bool(args.gene_flag_col) != bool(args.met_flag_col):
+        parser.error("-gf/--geneFlag and -mf/--metFlag must be used together")
+    if args.gene_flag_col and args.flags:
+        parser.error("-fl/--flags can not be combined with -gf/--geneFlag and -mf/--metFlag")
+
+    args.deaGeneDataset = os.path.abspath(args.deaGeneDataset)
+    args.deaMetDataset = os.path.abspath(args.deaMetDataset)
+    args.genePathways = os.path.abspath(args.genePathways)
+    args.metPathways = os.path.abspath(args.metPathways)
+    args.output = os.path.abspath(args.output)
+    if args.flags:
+        args.flags = [flag.strip() for flag in args.flags.split(",")]
+
+    return args
+
+
+def main():
+    """
+    Pathway enrichment analysis of the flagged genes and metabolites. With -gf/--geneFlag and
+    -mf/--metFlag a single pair of flag columns is tested (fisherExactTest), otherwise every flag
+    column is tested at once (multiFlagEnrichment), with the FDR corrected within each flag.
+
+    Arguments:
+        :param deaGeneDataset deaMetDataset: Gene Expression/Metabolomics flags, respectively.
+        :type deaGeneDataset deaMetDataset: files
+
+        :param gene_id_col met_id_col: Name of the unique identifier columns.
+        :type gene_id_col met_id_col: strings
+
+        :param genePathways metPathways: add_kegg_pathway_info.py outputs.
+        :type genePathways metPathways: files
+
+        :param flags: Flag columns, in both datasets.
+        :type flags: list
+
+        :param gene_flag_col met_flag_col: Single flag column of each dataset.
+        :type gene_flag_col met_flag_col: strings
+
+    Returns:
+        :return output: Output table with this information: Pathway_ID Pathway_Name Flag
+        Odds_Ratio P_value FDR_BH
+        :rtype output: file
+    """
+    args = getOptions()
+    logger = logging.getLogger()
+    sl.setLogger(logger)
+    logger.info(
+        u"""Importing data with following parameters: \
+        \n\tGene Dataset: {0}\
+        \n\tMetabolite Dataset: {1}\
+        \n\tGene Pathways: {2}\
+        \n\tMetabolite Pathways: {3}""".format(
+            args.deaGeneDataset, args.deaMetDataset, args.genePathways, args.metPathways
+        )
+    )
+
+    pathwayFiles = [args.genePathways, args.metPathways]
+    if args.gene_flag_col:
+        path_feat, pathwayNames = modules.readPathwayMembers(pathwayFiles)
+        if args.gene_flag_col == args.met_flag_col:
+            flag = args.gene_flag_col
+        else:
+            flag = args.gene_flag_col + "|" + args.met_flag_col
+        with open(args.output, "w") as output:
+            output.write("Pathway_ID\tPathway_Name\tFlag\tOdds_Ratio\tP_value\tFDR_BH\n")
+            for line in modules.fisherExactTest(args, path_feat):
+                pathway, values = line.split("\t", 1)
+                output.write("\t".join([pathway, pathwayNames[pathway], flag, values]) + "\n")
+    else:
+        enrichment = modules.multiFlagEnrichment(args, pathwayFiles, args.flags)
+        enrichment.to_csv(args.output, sep="\t", index=False)
+    logger.info("Pathway enrichment written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -137,6 +137,16 @@ def getOptions():
         help="PathId2PathNames File, from Add KEGG Pathway Info Tool\
                       (Only required in pana option and if desired).",
     )
+    genes.add_argument(
+        "-kdb",
+        "--keggDb",
+        dest="keggDb",
+        action="store",
+        required=False,
+        default=None,
+        help="KEGG database from build_kegg_db.py, used instead of path2genes and path2names\
+                      (Only in pana option).",
+    )
     genes.add_argument(
         "-cu",
         "--cutoff",
@@ -342,8 +352,11 @@ def getOptions():
         args.metKeggPath = os.path.abspath(args.metKeggPath)
     elif args.geneOption == "pana":
         args.geneKeggAnno = os.path.abspath(args.geneKeggAnno)
-        args.path2genes = os.path.abspath(args.path2genes)
         args.panaOut = os.path.abspath(args.panaOut)
+        if args.keggDb:
+            args.keggDb = os.path.abspath(args.keggDb)
+        else:
+            args.path2genes = os.path.abspath(args.path2genes)
         if args.path2names:
             args.path2names = os.path.abspath(args.path2names)
 
@@ -413,6 +426,9 @@ def main():
         :param path2genes: Downloaded KEGG file with this information: pathway_ID "\t" geneKEGG_ID
         :type path2genes: file
 
+        :param keggDb: KEGG database, used instead of path2genes and path2names in pana option.
+        :type keggDb: file
+
     Returns:
         :return figure1: sPLS heatmaps
         :rtype figure1: pdf
@@ -0,0 +1,30 @@
+#! /bin/bash
+# add_kegg_anno_info.py test with a match cache, the second run is served from the cache
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+for run in 1 2; do
+    add_kegg_anno_info.py \
+        -s=rno \
+        -mc=$OUTPUT_DIR/match_cache.db \
+        -ma=$INPUT_DIR/metabolite_annotation.tsv \
+        -mid=UniqueID \
+        -mn=MetName \
+        -mo=$OUTPUT_DIR/metabolite_to_keggId_link_${run}.tsv
+done
+
+diff $OUTPUT_DIR/metabolite_to_keggId_link_1.tsv $OUTPUT_DIR/metabolite_to_keggId_link_2.tsv
+
+echo "### Finished test: ${TEST} on $(date)"
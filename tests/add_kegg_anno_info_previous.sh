@@ -0,0 +1,35 @@
+#! /bin/bash
+# add_kegg_anno_info.py test reusing a previous output, both outputs must be the same
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+add_kegg_anno_info.py \
+    -s=rno \
+    -ma=$INPUT_DIR/metabolite_annotation.tsv \
+    -mid=UniqueID \
+    -mn=MetName \
+    -mo=$OUTPUT_DIR/metabolite_to_keggId_link.tsv
+
+add_kegg_anno_info.py \
+    -s=rno \
+    -pr $OUTPUT_DIR/metabolite_to_keggId_link.tsv \
+    -ma=$INPUT_DIR/metabolite_annotation.tsv \
+    -mid=UniqueID \
+    -mn=MetName \
+    -mo=$OUTPUT_DIR/metabolite_to_keggId_link_previous.tsv
+
+diff $OUTPUT_DIR/metabolite_to_keggId_link.tsv $OUTPUT_DIR/metabolite_to_keggId_link_previous.tsv
+
+echo "### Finished test: ${TEST} on $(date)"
@@ -0,0 +1,52 @@
+#! /bin/bash
+# add_kegg_pathway_info.py test against a local stand-in for the KEGG REST server
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+# Serve the test-data KEGG files with the KEGG REST layout
+KEGG_DIR=$TESTDIR/kegg
+mkdir -p $KEGG_DIR/link/rno $KEGG_DIR/link/compound $KEGG_DIR/list/pathway
+cp $INPUT_DIR/geneKeggId2pathwayId.tsv $KEGG_DIR/link/rno/pathway
+cp $INPUT_DIR/metaboliteKeggId2pathwayId.tsv $KEGG_DIR/link/compound/pathway
+cp $INPUT_DIR/pathwayId2pathwayNames.tsv $KEGG_DIR/list/pathway/rno
+PORT=8765
+python3 -m http.server $PORT --bind 127.0.0.1 --directory $KEGG_DIR > /dev/null 2>&1 &
+SERVER_PID=$!
+trap "kill $SERVER_PID" EXIT
+sleep 1
+
+GAITGM_KEGG_URL="http://127.0.0.1:${PORT}/" add_kegg_pathway_info.py \
+    -sp=rno \
+    -cd=$OUTPUT_DIR/cache \
+    -gka=$INPUT_DIR/gene_to_keggId_link.tsv \
+    -gid=UniqueID \
+    -gn=GeneSymbol \
+    -gkid=KEGG_ID \
+    -mka=$INPUT_DIR/metabolite_to_keggId_link.tsv \
+    -mid=UniqueID \
+    -mn=MetName \
+    -mkid=KEGG_ID \
+    -kg2p=$OUTPUT_DIR/geneKeggId2pathwayId.tsv \
+    -km2p=$OUTPUT_DIR/metaboliteKeggId2pathwayId.tsv \
+    -go=$OUTPUT_DIR/gene_kegg_pathway.tsv \
+    -mo=$OUTPUT_DIR/metabolite_kegg_pathway.tsv \
+    -p=$OUTPUT_DIR/pathwayId2pathwayNames.tsv
+
+for OUT in geneKeggId2pathwayId.tsv metaboliteKeggId2pathwayId.tsv pathwayId2pathwayNames.tsv \
+    gene_kegg_pathway.tsv metabolite_kegg_pathway.tsv; do
+    diff -q $INPUT_DIR/$OUT $OUTPUT_DIR/$OUT || exit 1
+done
+
+echo "### Finished test: ${TEST} on $(date)"
@@ -0,0 +1,96 @@
+#! /bin/bash
+# all_by_all_correlation.py test with analytic p-values with the numpy and R engines, which must
+# give the same output: the same edges sorted by strength, with the same correlations and
+# p-values (up to the last digits of the R and NumPy/SciPy floating point arithmetic, which may
+# also swap tied correlations)
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+set -e
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+for meth in pearson spearman; do
+    for engine in numpy R; do
+        all_by_all_correlation.py \
+            -g=$INPUT_DIR/gene_wide_dataset.tsv \
+            -gid=UniqueID \
+            -ga=$INPUT_DIR/gene_annotation.tsv \
+            -gn=GeneName \
+            -m=$INPUT_DIR/metabolite_wide_dataset.tsv \
+            -mid=UniqueID \
+            -ma=$INPUT_DIR/metabolite_annotation.tsv \
+            -mn=MetName \
+            -me=${meth} \
+            -en=${engine} \
+            -pv=analytic \
+            -t=0.05 \
+            -o=$OUTPUT_DIR/correlation_${meth}_${engine}.tsv \
+            -c=$OUTPUT_DIR/correlation_matrix_${meth}_${engine}.tsv \
+            -f=$OUTPUT_DIR/figure_${meth}_${engine}.pdf
+    done
+done
+
+python - "$OUTPUT_DIR" pearson spearman <<'PYTHON'
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+outputDir = sys.argv[1]
+
+
+def read(name, **kwargs):
+    return pd.read_table(
+        os.path.join(outputDir, name), sep="\t", quoting=3, keep_default_na=False, **kwargs
+    )
+
+
+for meth in sys.argv[2:]:
+    edges = {
+        engine: read("correlation_{0}_{1}.tsv".format(meth, engine)) for engine in ("numpy", "R")
+    }
+    assert list(edges["numpy"].columns) == list(edges["R"].columns), meth
+    gene, met, corr, pval = edges["R"].columns
+    assert len(edges["R"]) > 0, meth
+    for engine in ("numpy", "R"):
+        # Sorted by strength, up to rounding (the order of tied correlations may differ)
+        strength = edges[engine][corr].astype(float).abs().to_numpy()
+        assert np.all(np.diff(strength) <= 1e-12), (meth, engine)
+        edges[engine] = edges[engine].set_index([gene, met]).sort_index()
+    assert edges["numpy"].index.equals(edges["R"].index), meth
+    for column in (corr, pval):
+        assert np.allclose(
+            edges["numpy"][column].astype(float),
+            edges["R"][column].astype(float),
+            rtol=1e-9,
+            atol=0,
+        ), (meth, column)
+
+    matrices = {
+        engine: read("correlation_matrix_{0}_{1}.tsv".format(meth, engine), index_col=0)
+        for engine in ("numpy", "R")
+    }
+    assert matrices["numpy"].index.tolist() == matrices["R"].index.tolist(), meth
+    assert matrices["numpy"].columns.tolist() == matrices["R"].columns.tolist(), meth
+    assert np.allclose(
+        matrices["numpy"].replace("NA", np.nan).to_numpy(dtype=float),
+        matrices["R"].replace("NA", np.nan).to_numpy(dtype=float),
+        rtol=1e-9,
+        atol=1e-15,
+        equal_nan=True,
+    ), meth
+    print(meth, len(edges["R"]), "edges, same output for the numpy and R engines")
+PYTHON
+
+echo "### Finished test: ${TEST} on $(date)"
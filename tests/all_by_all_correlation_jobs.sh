@@ -0,0 +1,39 @@
+#! /bin/bash
+# all_by_all_correlation.py test with parallel permutations, same p-values with 1 and 4 processes
+# for each engine
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+for engine in numpy R; do
+    for jobs in 1 4; do
+        all_by_all_correlation.py \
+            -g=$INPUT_DIR/gene_wide_dataset.tsv \
+            -gid=UniqueID \
+            -m=$INPUT_DIR/metabolite_wide_dataset.tsv \
+            -mid=UniqueID \
+            -me=pearson \
+            -en=${engine} \
+            -j=${jobs} \
+            -sd=2021 \
+            -t=0.05 \
+            -o=$OUTPUT_DIR/correlation_${engine}_${jobs}.tsv \
+            -c=$OUTPUT_DIR/correlation_matrix_${engine}_${jobs}.tsv \
+            -f=$OUTPUT_DIR/figure_${engine}_${jobs}.pdf
+    done
+
+    diff $OUTPUT_DIR/correlation_${engine}_1.tsv $OUTPUT_DIR/correlation_${engine}_4.tsv
+done
+
+echo "### Finished test: ${TEST} on $(date)"
@@ -0,0 +1,121 @@
+#! /bin/bash
+# all_by_all_correlation.R permutation p-values test
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+#
+# Compares the counts of the vectorized permutation_counts with the former cell by cell loop
+# under the same seed on a small simulated input (every method), then on a subset of the test
+# data, and reports the time of both in timings.tsv. Also checks
+# that permutation_pvalues keeps the former results by default, and gives the same p-values for
+# a seed with 1 and 2 processes.
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+R_SCRIPT="src/gaitGM/data/all_by_all_correlation.R"
+GENES=300
+ITERATIONS=50
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+if ! command -v Rscript > /dev/null; then
+    echo "### Failed test: ${TEST}, Rscript not found"
+    exit 1
+fi
+
+Rscript - "${R_SCRIPT}" "${INPUT_DIR}" "${OUTPUT_DIR}" "${GENES}" "${ITERATIONS}" <<'RSCRIPT' || exit 1
+args <- commandArgs(trailingOnly = TRUE)
+source(args[1])
+genes <- as.integer(args[4])
+N <- as.integer(args[5])
+
+# Former implementation, one R comparison per correlation and iteration
+legacy_counts <- function(new_x, new_y, corr_orig, meth, N){
+  pval_mat_counts <- corr_orig
+  pval_mat_counts[,] <- 0
+  values <- nrow(corr_orig)*ncol(corr_orig)
+  means_x <- apply(new_x, 2, mean)
+  means_y <- apply(new_y, 2, mean)
+  sds_x <- apply(new_x, 2, sd)
+  sds_y <- apply(new_y, 2, sd)
+  for (i in 1:N){
+    x_new <- mapply(rnorm, nrow(new_x), means_x, sds_x)
+    y_new <- mapply(rnorm, nrow(new_y), means_y, sds_y)
+    corr_new <- cor(x_new, y_new, method = meth)
+    for(j in 1:values){
+      if (abs(corr_new[j]) > abs(corr_orig[j])){
+        pval_mat_counts[j] <- pval_mat_counts[j] + 1
+      }
+    }
+  }
+  return(pval_mat_counts)
+}
+
+# Small fixed-seed input: counts of the former loop and of permutation_counts, for every method
+set.seed(1)
+small_x <- matrix(rnorm(12 * 6, mean = 5), nrow = 12)
+small_y <- matrix(rnorm(12 * 4, mean = -2, sd = 3), nrow = 12)
+for (meth in c("pearson", "spearman", "kendall")){
+  small_corr <- cor(small_x, small_y, method = meth)
+  set.seed(7)
+  loop <- legacy_counts(small_x, small_y, small_corr, meth, 200)
+  set.seed(7)
+  vectorized <- permutation_counts(small_x, small_y, abs(small_corr), meth, 200)
+  write.table(vectorized, file.path(args[3], paste0("counts_small_", meth, ".tsv")), sep = "\t",
+              col.names = NA, quote = FALSE)
+  if (sum(loop) == 0 || !identical(loop, vectorized)){
+    stop("Counts of the vectorized permutations differ from the loop for ", meth)
+  }
+}
+
+x <- as.matrix(read.table(file.path(args[2], "gene_wide_dataset.tsv"), header = TRUE, sep = "\t",
+                          row.names = 1))
+y <- as.matrix(read.table(file.path(args[2], "metabolite_wide_dataset.tsv"), header = TRUE,
+                          sep = "\t", row.names = 1))
+new_x <- checkZeroVar(t(x[1:genes,]))
+new_y <- checkZeroVar(t(y))
+
+for (meth in c("pearson", "spearman")){
+  corr_orig <- cor(new_x, new_y, method = meth)
+  set.seed(2021)
+  legacy_time <- system.time(legacy <- legacy_counts(new_x, new_y, corr_orig, meth, N)/N)
+  set.seed(2021)
+  new_time <- system.time(
+    pval_mat <- permutation_counts(new_x, new_y, abs(corr_orig), meth, N)/N
+  )
+  cat(meth, ": loop", legacy_time[["elapsed"]], "s, vectorized", new_time[["elapsed"]], "s\n")
+  timings <- file.path(args[3], "timings.tsv")
+  write.table(data.frame(method = meth, genes = ncol(new_x), metabolites = ncol(new_y),
+                         iterations = N, loop = legacy_time[["elapsed"]],
+                         vectorized = new_time[["elapsed"]]),
+              timings, sep = "\t", row.names = FALSE, quote = FALSE, append = file.exists(timings),
+              col.names = !file.exists(timings))
+  write.table(pval_mat, file.path(args[3], paste0("pvalues_", meth, ".tsv")), sep = "\t",
+              col.names = NA, quote = FALSE)
+  if (!identical(legacy, pval_mat)){
+    stop("P-values of the vectorized permutations differ for ", meth)
+  }
+
+  # Default serial call (jobs = 1, no seed): same random stream, and results, as the former loop
+  set.seed(2021)
+  if (!identical(legacy, permutation_pvalues(new_x, new_y, corr_orig, meth, N))){
+    stop("P-values of the default serial permutations changed for ", meth)
+  }
+
+  serial <- permutation_pvalues(new_x, new_y, corr_orig, meth, N, jobs = 1, seed = 2021,
+                                chunk_size = 10)
+  forked <- permutation_pvalues(new_x, new_y, corr_orig, meth, N, jobs = 2, seed = 2021,
+                                chunk_size = 10)
+  if (!identical(serial, forked)){
+    stop("P-values of the chunked permutations differ between 1 and 2 processes for ", meth)
+  }
+}
+RSCRIPT
+
+echo "### Finished test: ${TEST} on $(date)"
@@ -0,0 +1,53 @@
+#! /bin/bash
+# all_by_all_correlation.py test in blocks of genes, with a binary correlation matrix
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+all_by_all_correlation.py \
+    -g=$INPUT_DIR/gene_wide_dataset.tsv \
+    -gid=UniqueID \
+    -ga=$INPUT_DIR/gene_annotation.tsv \
+    -gn=GeneName \
+    -m=$INPUT_DIR/metabolite_wide_dataset.tsv \
+    -mid=UniqueID \
+    -ma=$INPUT_DIR/metabolite_annotation.tsv \
+    -mn=MetName \
+    -me=pearson \
+    -bs=2000 \
+    -t=0.05 \
+    -o=$OUTPUT_DIR/correlation.tsv \
+    -c=$OUTPUT_DIR/correlation_matrix.npy
+
+# Blocks are refused with an explicit R engine or a correlation matrix not named .npy
+for options in "-en=R -c=$OUTPUT_DIR/correlation_matrix.npy" "-c=$OUTPUT_DIR/correlation_matrix.tsv"
+do
+    if all_by_all_correlation.py \
+        -g=$INPUT_DIR/gene_wide_dataset.tsv \
+        -gid=UniqueID \
+        -m=$INPUT_DIR/metabolite_wide_dataset.tsv \
+        -mid=UniqueID \
+        -me=pearson \
+        -bs=2000 \
+        -t=0.05 \
+        -o=$OUTPUT_DIR/refused.tsv \
+        $options 2> $OUTPUT_DIR/refused.log
+    then
+        echo "-bs/--blockSize was accepted with: $options"
+        exit 1
+    fi
+done
+
+echo "### Finished test: ${TEST} on $(date)"
+
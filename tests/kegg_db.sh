@@ -0,0 +1,140 @@
+#! /bin/bash
+# build_kegg_db.py test against a local stand-in for the KEGG REST server, followed by the KEGG
+# tools reading the database, compared with the same tools reading the downloaded KEGG files
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+set -e
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+# Serve the test-data KEGG files with the KEGG REST layout. The gene and compound lists are made
+# from the KEGG names of the test-data annotations, with D-Glucose (C00031) added.
+KEGG_DIR=$TESTDIR/kegg
+mkdir -p $KEGG_DIR/link/rno $KEGG_DIR/link/compound $KEGG_DIR/list/pathway
+cp $INPUT_DIR/geneKeggId2pathwayId.tsv $KEGG_DIR/link/rno/pathway
+cp $INPUT_DIR/metaboliteKeggId2pathwayId.tsv $KEGG_DIR/link/compound/pathway
+cp $INPUT_DIR/pathwayId2pathwayNames.tsv $KEGG_DIR/list/pathway/rno
+python - "$INPUT_DIR" "$KEGG_DIR" <<'PYTHON'
+import csv
+import sys
+
+inputDir, keggDir = sys.argv[1:]
+for annotation, keggList, extra in (
+    ("gene_to_keggId_link.tsv", "list/rno", {}),
+    ("metabolite_to_keggId_link.tsv", "list/compound",
+     {"cpd:C00031": ["D-Glucose", "Grape sugar", "Dextrose"]}),
+):
+    entries = {}
+    with open(inputDir + "/" + annotation) as fh:
+        for row in csv.DictReader(fh, delimiter="\t"):
+            if row["KEGG_ID"] not in ("", "NA"):
+                names = entries.setdefault(row["KEGG_ID"], [])
+                if row["Name_in_KEGG"] not in names:
+                    names.append(row["Name_in_KEGG"])
+    entries.update(extra)
+    with open(keggDir + "/" + keggList, "w") as fh:
+        for keggId, names in entries.items():
+            fh.write(keggId + "\t" + "; ".join(names) + "\n")
+PYTHON
+PORT=8766
+python3 -m http.server $PORT --bind 127.0.0.1 --directory $KEGG_DIR > /dev/null 2>&1 &
+SERVER_PID=$!
+trap "kill $SERVER_PID" EXIT
+sleep 1
+export GAITGM_KEGG_URL="http://127.0.0.1:${PORT}/"
+
+build_kegg_db.py \
+    -s=rno \
+    -cd=$OUTPUT_DIR/cache \
+    -kdb=$OUTPUT_DIR/kegg_rno.db
+
+# Layout of the database and a lookup of D-Glucose (C00031) and its pathways
+python - "$OUTPUT_DIR/kegg_rno.db" <<'PYTHON'
+import sqlite3
+import sys
+
+conn = sqlite3.connect(sys.argv[1])
+tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+assert tables == {"meta", "entries", "links", "pathways"}, tables
+meta = dict(conn.execute("SELECT key, value FROM meta"))
+assert meta["version"] == "2" and meta["species"] == "rno", meta
+for featureType in ("Gene", "Metabolite"):
+    count = conn.execute(
+        "SELECT count(*) FROM entries WHERE feature_type = ?", (featureType,)
+    ).fetchone()[0]
+    assert count > 0, featureType
+glucose = ("C00031", "cpd:C00031")
+names = conn.execute(
+    "SELECT names FROM entries WHERE feature_type = 'Metabolite' AND kegg_id IN (?, ?)", glucose
+).fetchone()
+assert names and "D-Glucose" in names[0], names
+pathways = conn.execute(
+    "SELECT count(*) FROM links WHERE feature_type = 'Metabolite' AND kegg_id IN (?, ?)", glucose
+).fetchone()[0]
+assert pathways > 0, "no pathways for D-Glucose"
+PYTHON
+
+# Each tool runs once on the database (db) and once on the KEGG files of the cache (files)
+for SOURCE in db files; do
+    if [ "$SOURCE" == "db" ]; then
+        KEGG_OPTION="-kdb=$OUTPUT_DIR/kegg_rno.db"
+    else
+        KEGG_OPTION="-cd=$OUTPUT_DIR/cache"
+    fi
+    mkdir -p $OUTPUT_DIR/$SOURCE
+
+    add_kegg_anno_info.py \
+        -s=rno \
+        $KEGG_OPTION \
+        -ma=$INPUT_DIR/metabolite_annotation.tsv \
+        -mid=UniqueID \
+        -mn=MetName \
+        -mo=$OUTPUT_DIR/$SOURCE/metabolite_to_keggId_link.tsv
+
+    add_kegg_pathway_info.py \
+        -sp=rno \
+        $KEGG_OPTION \
+        -gka=$INPUT_DIR/gene_to_keggId_link.tsv \
+        -gid=UniqueID \
+        -gn=GeneSymbol \
+        -gkid=KEGG_ID \
+        -mka=$INPUT_DIR/metabolite_to_keggId_link.tsv \
+        -mid=UniqueID \
+        -mn=MetName \
+        -mkid=KEGG_ID \
+        -kg2p=$OUTPUT_DIR/$SOURCE/geneKeggId2pathwayId.tsv \
+        -km2p=$OUTPUT_DIR/$SOURCE/metaboliteKeggId2pathwayId.tsv \
+        -go=$OUTPUT_DIR/$SOURCE/gene_kegg_pathway.tsv \
+        -mo=$OUTPUT_DIR/$SOURCE/metabolite_kegg_pathway.tsv \
+        -p=$OUTPUT_DIR/$SOURCE/pathwayId2pathwayNames.tsv
+done
+
+for OUT in metabolite_to_keggId_link.tsv geneKeggId2pathwayId.tsv \
+    metaboliteKeggId2pathwayId.tsv pathwayId2pathwayNames.tsv gene_kegg_pathway.tsv \
+    metabolite_kegg_pathway.tsv; do
+    diff -q $OUTPUT_DIR/db/$OUT $OUTPUT_DIR/files/$OUT
+done
+
+# A file that is not a KEGG database is refused with an error, not a traceback
+NOT_KEGG_DB=$OUTPUT_DIR/not_kegg.db
+python -c "import sqlite3, sys; sqlite3.connect(sys.argv[1]).execute('CREATE TABLE t (x)')" \
+    $NOT_KEGG_DB
+if add_kegg_anno_info.py -s=rno -kdb=$NOT_KEGG_DB -ma=$INPUT_DIR/metabolite_annotation.tsv \
+    -mid=UniqueID -mn=MetName -mo=$OUTPUT_DIR/not_kegg.tsv 2> $OUTPUT_DIR/not_kegg.log; then
+    echo "$NOT_KEGG_DB was accepted as a KEGG database"
+    exit 1
+fi
+grep -q "is not a KEGG database" $OUTPUT_DIR/not_kegg.log
+
+echo "### Finished test: ${TEST} on $(date)"
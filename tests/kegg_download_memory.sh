@@ -0,0 +1,81 @@
+#! /bin/bash
+# Memory benchmark of the KEGG list download: a synthetic gene list served from a local server,
+# parsed by downloadGeneParser (streamed to the cache) and by reading the whole response in
+# memory (response.content, splitlines, decode). Peaks are measured with tracemalloc.
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+set -e
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+# 600,000 synthetic genes (about 50 MB) with the KEGG list layout
+KEGG_DIR=$TESTDIR/kegg
+mkdir -p $KEGG_DIR/list
+python - "$KEGG_DIR/list/ath" <<'PYTHON'
+import sys
+
+with open(sys.argv[1], "w") as fh:
+    for i in range(600000):
+        fh.write("ath:AT%07d\tGENE%d, ALIAS%d; putative protein of unknown function %d\n" % (
+            i, i, i, i))
+PYTHON
+PORT=8767
+python3 -m http.server $PORT --bind 127.0.0.1 --directory $KEGG_DIR > /dev/null 2>&1 &
+SERVER_PID=$!
+trap "kill $SERVER_PID" EXIT
+sleep 1
+export GAITGM_KEGG_URL="http://127.0.0.1:${PORT}/"
+
+# Each method runs in its own process
+for METHOD in inMemory streamed; do
+    python - "$METHOD" "$OUTPUT_DIR" <<'PYTHON'
+import sys
+import tracemalloc
+
+import requests
+
+import gaitGM.keggPeaModules as modules
+
+method, outputDir = sys.argv[1:]
+tracemalloc.start()
+if method == "inMemory":
+    genes = {}
+    with requests.get(modules.KEGG_REST_URL + "list/ath") as response:
+        lines = response.content.splitlines()
+    for line in lines:
+        line = line.decode("utf-8")
+        genes[line.split("\t")[0]] = line.split("\t")[1]
+else:
+    genes = modules.downloadGeneParser("ath", outputDir + "/cache")
+current, peak = tracemalloc.get_traced_memory()
+with open(outputDir + "/" + method + ".tsv", "w") as fh:
+    fh.write("{0}\t{1}\t{2:.1f}\t{3:.1f}\n".format(method, len(genes), current / 1e6, peak / 1e6))
+PYTHON
+done
+
+echo -e "method\tgenes\tresult_MB\tpeak_MB" > $OUTPUT_DIR/memory.tsv
+cat $OUTPUT_DIR/inMemory.tsv $OUTPUT_DIR/streamed.tsv >> $OUTPUT_DIR/memory.tsv
+cat $OUTPUT_DIR/memory.tsv
+
+# Same genes, and the streamed download peaks below the in-memory one
+python - "$OUTPUT_DIR/memory.tsv" <<'PYTHON'
+import sys
+
+import pandas as pd
+
+memory = pd.read_table(sys.argv[1], index_col=0)
+assert memory["genes"].nunique() == 1, memory
+assert memory.loc["streamed", "peak_MB"] < memory.loc["inMemory", "peak_MB"], memory
+PYTHON
+
+echo "### Finished test: ${TEST} on $(date)"
@@ -0,0 +1,77 @@
+#! /bin/bash
+# Micro-benchmark of the KEGG name similarity scores: difflib.SequenceMatcher for every pair,
+# difflibRatio (containment shortcut), calculateSimilarities with difflib and with Indel scores.
+# The difflib compatible scores must be identical to SequenceMatcher.
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+set -e
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+python - "$INPUT_DIR" "$OUTPUT_DIR/timings.tsv" <<'PYTHON'
+import sys
+import time
+from difflib import SequenceMatcher
+
+import pandas as pd
+
+import gaitGM.keggPeaModules as modules
+
+inputDir, timingsFile = sys.argv[1:]
+names = pd.read_table(inputDir + "/metabolite_annotation.tsv")["MetName"].astype(str)
+featureNames = list(names.head(20))
+links = pd.read_table(inputDir + "/metabolite_to_keggId_link.tsv")
+keggNames = sorted(set(links["Name_in_KEGG"].dropna().astype(str)))
+print("{0} names x {1} KEGG names".format(len(featureNames), len(keggNames)))
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+reference, sequenceMatcherTime = timed(
+    lambda: [[SequenceMatcher(a=a, b=b).ratio() for b in keggNames] for a in featureNames]
+)
+shortcut, shortcutTime = timed(
+    lambda: [[modules.difflibRatio(a, b) for b in keggNames] for a in featureNames]
+)
+assert shortcut == reference, "difflibRatio differs from difflib.SequenceMatcher"
+
+perPair, perPairTime = timed(
+    lambda: [[modules.calculateSimilarity(a, b) for b in keggNames] for a in featureNames]
+)
+batch, batchTime = timed(
+    lambda: [modules.calculateSimilarities(a, keggNames) for a in featureNames]
+)
+assert batch == perPair, "calculateSimilarities differs from calculateSimilarity"
+indel, indelTime = timed(
+    lambda: [modules.calculateSimilarities(a, keggNames, False) for a in featureNames]
+)
+
+with open(timingsFile, "w") as fh:
+    fh.write("method\tseconds\n")
+    for method, seconds in (
+        ("SequenceMatcher", sequenceMatcherTime),
+        ("difflibRatio", shortcutTime),
+        ("calculateSimilarity", perPairTime),
+        ("calculateSimilarities", batchTime),
+        ("calculateSimilarities_indel", indelTime),
+    ):
+        fh.write("{0}\t{1:.3f}\n".format(method, seconds))
+PYTHON
+cat $OUTPUT_DIR/timings.tsv
+
+echo "### Finished test: ${TEST} on $(date)"
@@ -0,0 +1,79 @@
+#! /bin/bash
+# Benchmark of the KEGG whole-word lookups: parseWord with the cached KeggWordIndex against an
+# index built on every call, and findWholeWord with the cached patterns against a pattern compiled
+# on every call. The results must be identical.
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+set -e
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+python - "$INPUT_DIR/metaboliteKeggId2pathwayId.tsv" "$OUTPUT_DIR/timings.tsv" <<'PYTHON'
+import re
+import sys
+import time
+
+import gaitGM.keggPeaModules as modules
+
+keggFile, timingsFile = sys.argv[1:]
+with open(keggFile) as fh:
+    keys = [line.split("\t")[1].strip() for line in fh]
+ids = list(dict.fromkeys(keys))[:200]
+print("{0} lines, {1} compound IDs".format(len(keys), len(ids)))
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def uncachedWholeWord(word):
+    return re.compile(r"\b(?![-])({0})(?![-])\b".format(word), flags=re.IGNORECASE).search
+
+
+rebuilt, rebuiltTime = timed(
+    lambda: [
+        modules.parseWordIndex([i], modules.KeggWordIndex.fromFile(keggFile, 1, "rno"))
+        for i in ids
+    ]
+)
+cached, cachedTime = timed(lambda: [modules.parseWord([i], keggFile, 1, "rno") for i in ids])
+assert cached == rebuilt, "parseWord differs from an index built on every call"
+wordIndex = modules.KeggWordIndex.fromFile(keggFile, 1, "rno")
+indexed, indexedTime = timed(lambda: [modules.parseWordIndex([i], wordIndex) for i in ids])
+assert indexed == rebuilt, "parseWordIndex differs from an index built on every call"
+
+compiled, compiledTime = timed(
+    lambda: [[bool(uncachedWholeWord(i)(k)) for k in keys] for i in ids[:20]]
+)
+patterns, patternsTime = timed(
+    lambda: [[bool(modules.findWholeWord(i)(k)) for k in keys] for i in ids[:20]]
+)
+assert patterns == compiled, "findWholeWord differs from a pattern compiled on every call"
+
+with open(timingsFile, "w") as fh:
+    fh.write("method\tseconds\n")
+    for method, seconds in (
+        ("parseWord_index_per_call", rebuiltTime),
+        ("parseWord", cachedTime),
+        ("parseWordIndex", indexedTime),
+        ("findWholeWord_compile_per_call", compiledTime),
+        ("findWholeWord", patternsTime),
+    ):
+        fh.write("{0}\t{1:.3f}\n".format(method, seconds))
+PYTHON
+cat $OUTPUT_DIR/timings.tsv
+
+echo "### Finished test: ${TEST} on $(date)"
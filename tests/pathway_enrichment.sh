@@ -0,0 +1,66 @@
+#! /bin/bash
+# pathway_enrichment.py test: all the flags of add_pval_flags.py at once, then each flag alone,
+# which must give the same P-values and FDR
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+set -e
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+INPUT_DIR="galaxy/test-data"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+pathway_enrichment.py \
+    -gd=$INPUT_DIR/add_flags_gene_flags.tsv \
+    -gid=UniqueID \
+    -md=$INPUT_DIR/add_flags_metabolite_flags.tsv \
+    -mid=UniqueID \
+    -gp=$INPUT_DIR/gene_kegg_pathway.tsv \
+    -mp=$INPUT_DIR/metabolite_kegg_pathway.tsv \
+    -o=$OUTPUT_DIR/enrichment_all.tsv
+
+FLAGS="Flag_0.1 Flag_0.05 Flag_0.01"
+for flag in $FLAGS; do
+    pathway_enrichment.py \
+        -gd=$INPUT_DIR/add_flags_gene_flags.tsv \
+        -gid=UniqueID \
+        -md=$INPUT_DIR/add_flags_metabolite_flags.tsv \
+        -mid=UniqueID \
+        -gp=$INPUT_DIR/gene_kegg_pathway.tsv \
+        -mp=$INPUT_DIR/metabolite_kegg_pathway.tsv \
+        -gf=${flag} \
+        -mf=${flag} \
+        -o=$OUTPUT_DIR/enrichment_${flag}.tsv
+done
+
+python - "$OUTPUT_DIR" $FLAGS <<'PYTHON'
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+outputDir = sys.argv[1]
+allFlags = pd.read_table(os.path.join(outputDir, "enrichment_all.tsv"))
+assert sorted(allFlags["Flag"].unique()) == sorted(sys.argv[2:]), allFlags["Flag"].unique()
+for flag in sys.argv[2:]:
+    multi = allFlags.loc[allFlags["Flag"] == flag].reset_index(drop=True)
+    single = pd.read_table(os.path.join(outputDir, "enrichment_" + flag + ".tsv"))
+    assert len(multi) > 0 and multi["Pathway_ID"].tolist() == single["Pathway_ID"].tolist(), flag
+    assert multi["Pathway_Name"].tolist() == single["Pathway_Name"].tolist(), flag
+    for column in ("Odds_Ratio", "P_value", "FDR_BH"):
+        assert np.allclose(multi[column], single[column], rtol=1e-12, atol=0, equal_nan=True), (
+            flag,
+            column,
+        )
+    print(flag, len(single), "pathways,", (single["FDR_BH"] <= 0.05).sum(), "with FDR <= 0.05")
+PYTHON
+
+echo "### Finished test: ${TEST} on $(date)"
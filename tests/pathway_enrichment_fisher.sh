@@ -0,0 +1,148 @@
+#! /bin/bash
+# Pathway enrichment statistics test: the one-sided Fisher exact test of enrichmentTest and
+# fisherExactTest against scipy.stats.fisher_exact(alternative="greater"), and benjaminiHochberg
+# against R p.adjust(method = "BH") (and statsmodels, if installed), with ties and P-values of 1
+# Copyright (C) 2018-2021 Oleksandr Moskalenko <om@rc.ufl.edu>
+# Distributed under terms of the MIT license.
+
+set -e
+
+SCRIPT=$(basename "${BASH_SOURCE[0]}");
+echo "script $SCRIPT"
+
+TEST="${SCRIPT%.*}"
+
+TESTDIR="testout/${TEST}"
+OUTPUT_DIR=$TESTDIR
+rm -rf "${TESTDIR}"
+mkdir -p "${TESTDIR}"
+echo "### Starting test: ${TEST}"
+
+python - "$OUTPUT_DIR" <<'PYTHON'
+import os
+import sys
+import argparse
+import numpy as np
+import scipy.stats as st
+import gaitGM.keggPeaModules as modules
+
+
+def assertClose(observed, expected, what):
+    assert np.allclose(observed, expected, rtol=1e-12, atol=0, equal_nan=True), (
+        what,
+        observed,
+        expected,
+    )
+
+
+# Hand-built contingency tables (a, a+c, a+b, c+d): depleted, enriched, all flagged, no molecule
+# of the pathway found, every molecule in the pathway (b+d = 0), and P-values of 1
+tables = np.array(
+    [
+        (0, 4, 5, 20),
+        (1, 4, 5, 20),
+        (3, 4, 5, 20),
+        (5, 5, 5, 20),
+        (0, 0, 5, 20),
+        (5, 25, 5, 20),
+        (2, 7, 10, 10),
+        (10, 12, 10, 10),
+        (0, 10, 10, 10),
+        (1, 1, 1, 0),
+    ]
+)
+oddsratios, pvalues = modules.enrichmentTest(*tables.T)
+for (a, a_c, a_b, c_d), oddsratio, pvalue in zip(tables, oddsratios, pvalues):
+    table = [[a, a_b - a], [a_c - a, c_d - (a_c - a)]]
+    expectedOdds, expectedP = st.fisher_exact(table, alternative="greater")
+    assertClose(pvalue, expectedP, table)
+    assertClose(oddsratio, expectedOdds, table)
+assert (pvalues == 1).sum() >= 3, pvalues
+
+# R: p.adjust(c(0.01, 0.04, 0.04, 0.03, 1, 1, 0.2), method = "BH")
+pvals = np.array([0.01, 0.04, 0.04, 0.03, 1, 1, 0.2])
+assertClose(
+    modules.benjaminiHochberg(pvals), [0.07, 0.07, 0.07, 0.07, 1, 1, 0.28], "p.adjust ties"
+)
+# R: p.adjust(c(1, 1, 1), method = "BH"), p.adjust(c(0.5), method = "BH")
+assertClose(modules.benjaminiHochberg([1, 1, 1]), [1, 1, 1], "p.adjust all 1")
+assertClose(modules.benjaminiHochberg([0.5]), [0.5], "p.adjust single")
+# R: p.adjust(c(0.002, 0.02, 0.02, 0.9, 0.002), method = "BH")
+assertClose(
+    modules.benjaminiHochberg([0.002, 0.02, 0.02, 0.9, 0.002]),
+    [0.005, 0.025, 0.025, 0.9, 0.005],
+    "p.adjust ties 2",
+)
+
+try:
+    from statsmodels.stats.multitest import multipletests
+except ImportError:
+    multipletests = None
+    print("statsmodels not installed, BH only checked against the R values")
+if multipletests is not None:
+    rng = np.random.default_rng(2021)
+    for pvals in (
+        rng.uniform(size=50),
+        np.round(rng.uniform(size=200), 2),
+        np.concatenate([rng.uniform(0, 0.01, 10), np.ones(20)]),
+    ):
+        assertClose(
+            modules.benjaminiHochberg(pvals),
+            multipletests(pvals, method="fdr_bh")[1],
+            "statsmodels",
+        )
+
+# fisherExactTest on hand-built flag tables: 4 of 6 genes and 1 of 3 metabolites flagged
+outputDir = sys.argv[1]
+with open(os.path.join(outputDir, "gene_flags.tsv"), "w") as flags:
+    flags.write("UniqueID\tFlag_0.05\n")
+    flags.writelines(
+        "G{0}\t{1}\n".format(i, flag) for i, flag in enumerate([1, 1, 0, 0, 1, 1], 1)
+    )
+with open(os.path.join(outputDir, "met_flags.tsv"), "w") as flags:
+    flags.write('UniqueID\tFlag_0.05\n"M1"\t1\nM2\t0\nM3\t0\n')
+args = argparse.Namespace(
+    deaGeneDataset=os.path.join(outputDir, "gene_flags.tsv"),
+    deaMetDataset=os.path.join(outputDir, "met_flags.tsv"),
+    gene_id_col="UniqueID",
+    met_id_col="UniqueID",
+    gene_flag_col="Flag_0.05",
+    met_flag_col="Flag_0.05",
+)
+# Pathway: (molecules, a, a+c), X* molecules are not in the datasets
+path_feat = {
+    "P1": (["G1", "G2", "M1"], 3, 3),
+    "P2": (["G3", "G4"], 0, 2),
+    "P3": (["G1", "G3", "M2", "X9"], 1, 3),
+    "P4": (["X8"], 0, 0),
+    "P5": (["G1", "G2", "G3", "G4", "G5", "G6", "M1", "M2", "M3"], 5, 9),
+    "P6": (["G5", "G6"], 2, 2),
+    "P7": (["G2", "G6"], 2, 2),
+}
+a_b, c_d = 5, 4
+lines = modules.fisherExactTest(args, {path: ids for path, (ids, _, _) in path_feat.items()})
+pvals = []
+for line, (pathway, (ids, a, a_c)) in zip(lines, path_feat.items()):
+    fields = line.split("\t")
+    assert fields[0] == pathway, (fields, pathway)
+    expectedOdds, expectedP = st.fisher_exact(
+        [[a, a_b - a], [a_c - a, c_d - (a_c - a)]], alternative="greater"
+    )
+    assertClose(float(fields[1]), expectedOdds, pathway)
+    assertClose(float(fields[2]), expectedP, pathway)
+    pvals.append(float(fields[2]))
+assertClose(
+    [float(line.split("\t")[3]) for line in lines],
+    modules.benjaminiHochberg(pvals),
+    "fisherExactTest FDR",
+)
+if multipletests is not None:
+    assertClose(
+        [float(line.split("\t")[3]) for line in lines],
+        multipletests(pvals, method="fdr_bh")[1],
+        "fisherExactTest FDR statsmodels",
+    )
+print(len(tables), "tables and", len(lines), "pathways match scipy.stats.fisher_exact")
+PYTHON
+
+echo "### Finished test: ${TEST} on $(date)"